@@ -0,0 +1,120 @@
+import bisect
+
+from biothings.utils.hub_db import get_src_build
+
+
+class IndexCheckpoint(object):
+    """
+    Keep track of batches of documents successfully indexed, so an interrupted
+    index can be resumed without asking ES, for each document, whether it's
+    already indexed or not. Batches are identified by their position in the
+    stream of _ids returned by id_feeder (start/end offsets), along with
+    first and last _ids used to make sure the stream hasn't changed since.
+
+    Checkpoint is stored in the hub DB, within src_build document, as:
+        index.<index_name>.checkpoint = {
+            "target_name" : collection being indexed,
+            "done" : [[start,end,first_id,last_id],...], # contiguous ranges are merged
+            "launched" : offset up to which batches were sent to workers
+        }
+    """
+
+    def __init__(self, build_name, index_name, target_name=None):
+        self.build_name = build_name
+        self.index_name = index_name
+        self.target_name = target_name or build_name
+        self.done = []
+        self.launched = 0
+        self.valid = True
+
+    @property
+    def key(self):
+        return "index.%s.checkpoint" % self.index_name
+
+    def load(self):
+        """
+        Load checkpoint from hub DB. Return False if no checkpoint could
+        be found (or if it was about another collection)
+        """
+        build = get_src_build().find_one({"_id" : self.build_name}) or {}
+        ckpt = build.get("index",{}).get(self.index_name,{}).get("checkpoint")
+        if not ckpt or ckpt.get("target_name") != self.target_name:
+            self.done = []
+            self.launched = 0
+            return False
+        self.done = [list(r) for r in ckpt.get("done",[])]
+        self.launched = ckpt.get("launched",0)
+        return True
+
+    def save(self):
+        get_src_build().update_one({"_id" : self.build_name},
+                {"$set" : {self.key : {"target_name" : self.target_name,
+                                       "done" : self.done,
+                                       "launched" : self.launched}}})
+
+    def reset(self):
+        self.done = []
+        self.launched = 0
+        self.valid = True
+        self.save()
+
+    def clear(self):
+        get_src_build().update_one({"_id" : self.build_name}, {"$set" : {self.key : None}})
+
+    def mark_launched(self, start, ids):
+        end = start + len(ids)
+        if end > self.launched:
+            self.launched = end
+            self.save()
+
+    def mark_done(self, start, ids):
+        """
+        Register batch "ids", starting at offset "start" in the _id stream,
+        as successfully indexed
+        """
+        if not ids:
+            return
+        rng = [start,start + len(ids),ids[0],ids[-1]]
+        idx = bisect.bisect_left([r[0] for r in self.done],start)
+        self.done.insert(idx,rng)
+        if idx > 0:
+            idx -= 1
+        # merge overlapping or contiguous ranges so the checkpoint stays small
+        while idx + 1 < len(self.done):
+            cur,nxt = self.done[idx],self.done[idx+1]
+            if cur[1] >= nxt[0]:
+                self.done.pop(idx+1)
+                if nxt[1] > cur[1]:
+                    cur[1] = nxt[1]
+                    cur[3] = nxt[3]
+            elif self.done[idx+1][0] > start + len(ids):
+                break
+            else:
+                idx += 1
+        self.save()
+
+    def remaining(self, start, ids):
+        """
+        Given a batch of "ids" starting at offset "start", return a tuple
+        (todo_ids, verify) where todo_ids are the ids not yet indexed according
+        to the checkpoint and verify is True when those may have been partially
+        sent to ES (they were part of a batch launched before the interruption).
+        If checkpoint doesn't match the _id stream, it's invalidated and all
+        ids must be verified.
+        """
+        if not self.valid:
+            return (ids,True)
+        end = start + len(ids)
+        covered = [False] * len(ids)
+        for rstart,rend,first_id,last_id in self.done:
+            if rend <= start or rstart >= end:
+                continue
+            # check boundaries we can see from this batch
+            if (start <= rstart < end and ids[rstart - start] != first_id) or \
+                    (start <= rend - 1 < end and ids[rend - 1 - start] != last_id):
+                self.valid = False
+                return (ids,True)
+            for i in range(max(rstart,start),min(rend,end)):
+                covered[i - start] = True
+        todo = [_id for _id,cov in zip(ids,covered) if not cov]
+        return (todo,start < self.launched)
@@ -0,0 +1,98 @@
+class IndexingController(object):
+    """
+    Adjust indexing batch size and number of in-flight indexing jobs
+    according to how ES behaves. Each indexed batch reports its bulk latency
+    and number of rejected documents (429, ES queues are full) with record():
+    - when ES rejects documents or latency goes above max_latency, batch size is
+      divided by 2 and one less job is allowed to run at the same time
+      (multiplicative decrease),
+    - when ES responds below target_latency without rejecting anything, batch
+      size grows by increase_step and one more job is allowed every
+      "increase_every" healthy batches (additive increase).
+    """
+
+    def __init__(self, batch_size=10000, min_batch_size=500, max_batch_size=50000,
+                 max_inflight=4, min_inflight=1, target_latency=10.0, max_latency=60.0,
+                 max_rejection_rate=0.0, increase_step=None, increase_every=3):
+        self.min_batch_size = min(min_batch_size,batch_size)
+        self.max_batch_size = max(max_batch_size,batch_size)
+        self.batch_size = batch_size
+        self.min_inflight = max(1,min_inflight)
+        self.max_inflight = max(self.min_inflight,max_inflight)
+        # start optimistic, let's see how ES is doing
+        self.inflight = self.max_inflight
+        self.target_latency = target_latency
+        self.max_latency = max_latency
+        self.max_rejection_rate = max_rejection_rate
+        self.increase_step = increase_step or max(1,int(batch_size/10))
+        self.increase_every = increase_every
+        self.healthy = 0
+        self.stats = {"batches" : 0, "count" : 0, "rejected" : 0, "retried" : 0,
+                      "time" : 0.0, "slowdowns" : 0, "speedups" : 0}
+
+    def record(self, count, latency, rejected=0, retried=0):
+        """
+        Register results for one indexed batch: "count" documents sent,
+        taking "latency" seconds, "rejected" of them being rejected by ES
+        on first attempt, "retried" the number of documents sent again.
+        Adjust batch size and in-flight jobs accordingly.
+        """
+        self.stats["batches"] += 1
+        self.stats["count"] += count
+        self.stats["rejected"] += rejected
+        self.stats["retried"] += retried
+        self.stats["time"] += latency
+        rate = count and rejected / count or 0.0
+        if (rejected and rate > self.max_rejection_rate) or latency > self.max_latency:
+            self.slow_down()
+        elif latency < self.target_latency:
+            self.healthy += 1
+            if self.healthy >= self.increase_every:
+                self.speed_up()
+        else:
+            # within acceptable range, keep things as they are
+            self.healthy = 0
+
+    def slow_down(self):
+        self.healthy = 0
+        self.batch_size = max(self.min_batch_size,int(self.batch_size / 2))
+        self.inflight = max(self.min_inflight,self.inflight - 1)
+        self.stats["slowdowns"] += 1
+
+    def speed_up(self):
+        self.healthy = 0
+        self.batch_size = min(self.max_batch_size,self.batch_size + self.increase_step)
+        self.inflight = min(self.max_inflight,self.inflight + 1)
+        self.stats["speedups"] += 1
+
+    def record_result(self, res):
+        """
+        Register results returned by an indexer worker, a tuple like
+        (count, errors[, bulk_stats]). Nothing is recorded if the worker
+        didn't report any bulk stats.
+        """
+        if type(res) != tuple or len(res) < 3 or not isinstance(res[2],dict):
+            return
+        bstats = res[2]
+        self.record(bstats.get("count",res[0]), bstats.get("time",0.0),
+                    bstats.get("rejected",0), bstats.get("retried",0))
+
+    def rechunk(self, id_provider):
+        """
+        Re-batch ids coming from id_provider (iterable of list of ids) so
+        each yielded batch follows current batch size
+        """
+        buf = []
+        for ids in id_provider:
+            buf.extend(ids)
+            while len(buf) >= self.batch_size:
+                size = self.batch_size
+                yield buf[:size]
+                buf = buf[size:]
+        if buf:
+            yield buf
+
+    def summary(self):
+        return {"batch_size" : self.batch_size,
+                "inflight" : self.inflight,
+                "stats" : self.stats}
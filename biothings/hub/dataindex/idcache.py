@@ -1,22 +1,41 @@
-import biothings.utils.redis as redis
+import os, glob, heapq, mmap, zlib
+from array import array
+
+from biothings import config as btconfig
+from biothings.utils.common import iter_n, get_random_string
+
 
 class IDCache(object):
 
     def mark_done(self,_ids):
         raise NotImplementedError()
 
-    def load(self, name, id_provider, flush=True):
+    def load(self, id_provider, flush=True):
         """
-        name is the cache name
         id_provider returns batch of ids, ie. list(_ids)
         flush to delete existing cache
         """
         raise NotImplementedError()
 
+    def remaining(self, batch_size=10000):
+        """
+        Iterate over batches (list) of ids not marked as done yet
+        """
+        raise NotImplementedError()
+
+    def contains(self, _ids):
+        """
+        Return the set of ids, among _ids, found in the cache
+        and not marked as done yet
+        """
+        raise NotImplementedError()
+
 
 class RedisIDCache(IDCache):
 
     def __init__(self, name, connection_params):
+        # redis is optional, only required for this cache
+        import biothings.utils.redis as redis
         self.name = name
         self.redis_client = redis.RedisClient(connection_params)
         try:
@@ -37,4 +56,267 @@ class RedisIDCache(IDCache):
         db  = self.redis_client.get_db(self.name)
         db.delete(*_ids)
 
-        
+    def remaining(self, batch_size=10000):
+        db  = self.redis_client.get_db(self.name)
+        for _ids in iter_n(db.scan_iter(count=batch_size),batch_size):
+            yield [_id.decode() if type(_id) == bytes else _id for _id in _ids]
+
+    def contains(self, _ids):
+        # ids marked as done are deleted, remaining ones only can be found
+        _ids = list(_ids)
+        db  = self.redis_client.get_db(self.name)
+        return set([_id for _id,val in zip(_ids,db.mget(_ids)) if val is not None])
+
+
+class LocalIDCache(IDCache):
+    """
+    ID cache stored in local files, no server required. Ids are stored sorted
+    in "<name>.ids" (one per line), "<name>.idx" contains the offset of each id
+    in that file (so id at a given position can be read directly) and "<name>.done"
+    is a bitmap, one bit per id position, set when the id is marked as done.
+    "<name>.hash" is an open-addressing hash table (crc32 of the id, linear
+    probing) giving the position of an id in constant time, used by mark_done()
+    and contains().
+    Sorting is performed by chunks of "sort_buffer" ids merged at the end
+    so memory usage is bounded while loading. Ids must be strings (other
+    types would be read back as strings, and int 1 would be the same as "1",
+    so they're rejected with a TypeError) and can't contain "\n".
+    """
+
+    def __init__(self, name, cache_folder=None, sort_buffer=1000000):
+        self.name = name
+        self.cache_folder = cache_folder or os.path.join(btconfig.CACHE_FOLDER,"idcache")
+        self.sort_buffer = sort_buffer
+        self.ids_file = os.path.join(self.cache_folder,"%s.ids" % name)
+        self.idx_file = os.path.join(self.cache_folder,"%s.idx" % name)
+        self.done_file = os.path.join(self.cache_folder,"%s.done" % name)
+        self.hash_file = os.path.join(self.cache_folder,"%s.hash" % name)
+        self._ids = None
+        self._idx = None
+        self._done = None
+        self._done_fd = None
+        self._hash = None
+        self._hash_mm = None
+
+    def __len__(self):
+        self.open()
+        return len(self._idx)
+
+    def __getstate__(self):
+        # files can't be pickled, re-opened on first use
+        state = self.__dict__.copy()
+        for k in ("_ids","_idx","_done","_done_fd","_hash","_hash_mm"):
+            state[k] = None
+        return state
+
+    def open(self):
+        if self._idx is not None:
+            return
+        with open(self.idx_file,"rb") as fidx:
+            self._idx = array("Q")
+            self._idx.frombytes(fidx.read())
+        if not self._idx:
+            # empty cache, mmap can't map empty files
+            self._ids = b""
+            self._done = bytearray()
+            self._hash = []
+            return
+        with open(self.ids_file,"rb") as fids:
+            self._ids = mmap.mmap(fids.fileno(),0,access=mmap.ACCESS_READ)
+        # bitmap is updated in place, only touched pages are written back
+        self._done_fd = open(self.done_file,"r+b")
+        self._done = mmap.mmap(self._done_fd.fileno(),0)
+        if not os.path.exists(self.hash_file):
+            # cache created before hash tables were introduced
+            self.build_hash(self.hash_file)
+        with open(self.hash_file,"rb") as fhash:
+            self._hash_mm = mmap.mmap(fhash.fileno(),0,access=mmap.ACCESS_READ)
+        self._hash = memoryview(self._hash_mm).cast("Q")
+
+    def close(self):
+        if self._done_fd:
+            self.flush()
+            self._done.close()
+            self._done_fd.close()
+        if isinstance(self._ids,mmap.mmap):
+            self._ids.close()
+        if self._hash_mm is not None:
+            self._hash.release()
+            self._hash_mm.close()
+        self._ids = self._idx = self._done = self._done_fd = self._hash = self._hash_mm = None
+
+    def flush(self):
+        if isinstance(self._done,mmap.mmap):
+            self._done.flush()
+
+    def load(self, id_provider, flush=True):
+        if not flush and os.path.exists(self.idx_file):
+            return
+        self.close()
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        # sort ids by chunks, each sorted run is stored in a temp file
+        prefix = os.path.join(self.cache_folder,"%s._tmp_" % self.name)
+        for tmp in glob.glob("%s*" % prefix):
+            os.remove(tmp)
+        prefix = "%s%s" % (prefix,get_random_string())
+        runs = []
+        buf = []
+        def dump_run():
+            run = "%s_%d" % (prefix,len(runs))
+            # no newline translation, ids are exactly one line each
+            with open(run,"w",encoding="utf-8",newline="\n") as frun:
+                frun.writelines(["%s\n" % _id for _id in sorted(buf)])
+            runs.append(run)
+        for _ids in id_provider:
+            for _id in _ids:
+                self.check_id(_id)
+                if "\n" in _id:
+                    raise ValueError("Can't cache id containing a newline: %s" % repr(_id))
+            buf.extend(_ids)
+            if len(buf) >= self.sort_buffer:
+                dump_run()
+                buf = []
+        if buf or not runs:
+            dump_run()
+        # merge sorted runs into final ids file, recording offsets
+        idx = array("Q")
+        fruns = [open(run,encoding="utf-8",newline="\n") for run in runs]
+        try:
+            with open("%s.ids" % prefix,"wb") as fids:
+                offset = 0
+                prev = None
+                for _id in heapq.merge(*[(line[:-1] for line in frun) for frun in fruns]):
+                    if _id == prev:
+                        continue # duplicated ids
+                    prev = _id
+                    data = ("%s\n" % _id).encode()
+                    idx.append(offset)
+                    fids.write(data)
+                    offset += len(data)
+        finally:
+            for frun in fruns:
+                frun.close()
+            for run in runs:
+                os.remove(run)
+        with open("%s.idx" % prefix,"wb") as fidx:
+            idx.tofile(fidx)
+        with open("%s.done" % prefix,"wb") as fdone:
+            fdone.write(bytes((len(idx) + 7) // 8))
+        self._idx = idx
+        if idx:
+            with open("%s.ids" % prefix,"rb") as fids:
+                self._ids = mmap.mmap(fids.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+                self.build_hash("%s.hash" % prefix)
+            finally:
+                self._ids.close()
+                self._ids = self._idx = None
+        else:
+            self._idx = None
+            open("%s.hash" % prefix,"wb").close()
+        for tmp,final in (("%s.ids" % prefix,self.ids_file),("%s.idx" % prefix,self.idx_file),
+                          ("%s.done" % prefix,self.done_file),("%s.hash" % prefix,self.hash_file)):
+            os.rename(tmp,final)
+
+    def build_hash(self, hash_file):
+        """
+        Write hash table for ids currently opened (self._ids/self._idx) in
+        hash_file. Table size is a power of 2, at least twice the number of
+        ids, each slot contains an id position + 1 (0 means empty slot)
+        """
+        size = 2
+        while size < 2 * len(self._idx):
+            size *= 2
+        mask = size - 1
+        with open(hash_file,"w+b") as fhash:
+            fhash.truncate(size * 8)
+            mm = mmap.mmap(fhash.fileno(),0)
+            table = memoryview(mm).cast("Q")
+            try:
+                for pos in range(len(self._idx)):
+                    slot = zlib.crc32(self.get(pos).encode()) & mask
+                    while table[slot]:
+                        slot = (slot + 1) & mask
+                    table[slot] = pos + 1
+            finally:
+                table.release()
+                mm.close()
+
+    def get(self, pos):
+        """Return id at position "pos" """
+        start = self._idx[pos]
+        end = self._ids.find(b"\n",start)
+        return self._ids[start:end].decode()
+
+    def position(self, _id):
+        """
+        Return position of _id in the cache (hash table lookup),
+        or None if not found
+        """
+        self.open()
+        if not self._hash:
+            return None
+        mask = len(self._hash) - 1
+        slot = zlib.crc32(_id.encode()) & mask
+        while self._hash[slot]:
+            pos = self._hash[slot] - 1
+            if self.get(pos) == _id:
+                return pos
+            slot = (slot + 1) & mask
+        return None
+
+    def check_id(self, _id):
+        if type(_id) != str:
+            raise TypeError("Can't cache non-string id %s (type %s)" % (repr(_id),type(_id).__name__))
+
+    def is_done(self, pos):
+        return bool(self._done[pos >> 3] & (1 << (pos & 7)))
+
+    def mark_done(self, _ids):
+        self.open()
+        for _id in _ids:
+            self.check_id(_id)
+            pos = self.position(_id)
+            if pos is not None:
+                self._done[pos >> 3] |= 1 << (pos & 7)
+        self.flush()
+
+    def contains(self, _ids):
+        self.open()
+        found = set()
+        for _id in _ids:
+            self.check_id(_id)
+            pos = self.position(_id)
+            if pos is not None and not self.is_done(pos):
+                found.add(_id)
+        return found
+
+    def remaining(self, batch_size=10000):
+        self.open()
+        total = len(self._idx)
+        batch = []
+        chunk_size = 1024*1024
+        for chunk_start in range(0,len(self._done),chunk_size):
+            # bitmap is read by chunks (bytes), not byte per byte from mmap
+            chunk = self._done[chunk_start:chunk_start + chunk_size]
+            for byte_pos,byte in enumerate(chunk,chunk_start):
+                if byte == 0xFF:
+                    continue # all 8 ids done
+                for bit in range(8):
+                    pos = (byte_pos << 3) + bit
+                    if pos >= total:
+                        break
+                    if not byte & (1 << bit):
+                        batch.append(self.get(pos))
+                        if len(batch) >= batch_size:
+                            yield batch
+                            batch = []
+        if batch:
+            yield batch
+
+    def flushdb(self):
+        self.close()
+        for fn in (self.ids_file,self.idx_file,self.done_file,self.hash_file):
+            if os.path.exists(fn):
+                os.remove(fn)
@@ -23,6 +23,8 @@ from biothings.utils.hub import publish_data_version
 from biothings.hub.databuild.backend import generate_folder, create_backend, \
                                             merge_src_build_metadata
 from biothings.hub import INDEXER_CATEGORY, INDEXMANAGER_CATEGORY
+from biothings.hub.dataindex.controller import IndexingController
+from biothings.hub.dataindex.checkpoint import IndexCheckpoint
 
 
 def new_index_worker(col_name,ids,pindexer,batch_num):
@@ -31,7 +33,8 @@ def new_index_worker(col_name,ids,pindexer,batch_num):
         idxer = pindexer()
         cur = doc_feeder(col, step=len(ids), inbatch=False, query={'_id': {'$in': ids}})
         cnt = idxer.index_bulk(cur)
-        return cnt
+        # bulk stats are used by the indexing controller to adjust batch size
+        return cnt + (idxer.bulk_stats,)
 
 
 def merge_index_worker(col_name,ids,pindexer,batch_num):
@@ -53,12 +56,15 @@ def merge_index_worker(col_name,ids,pindexer,batch_num):
             dids.pop(_id)
         # updated docs (those existing in col *and* index)
         upd_cnt = idxer.index_bulk(dexistings.values(),len(dexistings))
+        upd_stats = idxer.bulk_stats
         logging.debug("%s documents updated in index" % repr(upd_cnt))
         # new docs (only in col, *not* in index)
         new_cnt = idxer.index_bulk(dids.values(),len(dids))
+        new_stats = idxer.bulk_stats
         logging.debug("%s new documents in index" % repr(new_cnt))
-        # need to return one: tuple(cnt,list)
-        ret = (upd_cnt[0] + new_cnt[0], upd_cnt[1] + new_cnt[1])
+        bulk_stats = dict([(k,upd_stats.get(k,0) + new_stats.get(k,0)) for k in new_stats])
+        # need to return one: tuple(cnt,list[,bulk_stats])
+        ret = (upd_cnt[0] + new_cnt[0], upd_cnt[1] + new_cnt[1], bulk_stats)
         return ret
 
 
@@ -573,8 +579,9 @@ class Indexer(object):
         values:
         - 'purge': will delete index if it exists
         - 'resume': will use existing index and add documents. "ids" can be passed as a list of missing IDs,
-                 or, if not pass, ES will be queried to identify which IDs are missing for each batch in
-                 order to complete the index.
+                 or, if not pass, batches registered as done in the index checkpoint (see IndexCheckpoint)
+                 are skipped, and ES is queried to identify which IDs are missing only for batches which were
+                 being indexed when the process was interrupted (or for all batches if no checkpoint is found).
         - 'merge': will merge data with existing index' documents, used when populated several distinct times (cold/hot merge for instance)
         - None (default): will create a new index, assuming it doesn't already exist
         """
@@ -603,6 +610,9 @@ class Indexer(object):
             _mapping = self.get_mapping()
             _extra = self.get_index_creation_settings()
             _meta = {}
+            # documents rejected by ES (overloaded) are re-sent by workers
+            idxkwargs = dict(self.kwargs)
+            idxkwargs.setdefault("bulk_max_retries",getattr(btconfig,"INDEX_BULK_MAX_RETRIES",5))
             # partially instantiated indexer instance for process workers
             partial_idxer = partial(ESIndexer,doc_type=self.doc_type,
                                  index=index_name,
@@ -610,7 +620,7 @@ class Indexer(object):
                                  step=batch_size,
                                  number_of_shards=self.num_shards,
                                  number_of_replicas=self.num_replicas,
-                                 **self.kwargs)
+                                 **idxkwargs)
             # instantiate one here for index creation
             es_idxer = partial_idxer()
             if es_idxer.exists_index():
@@ -624,6 +634,19 @@ class Indexer(object):
             if not mode in ["resume","merge"]:
                 es_idxer.create_index({self.doc_type:_mapping},_extra)
 
+            # keep track of indexed batches so we can resume efficiently if interrupted
+            checkpoint = None
+            if not ids and mode != "merge":
+                checkpoint = IndexCheckpoint(self.target_name,index_name)
+                if mode == "resume":
+                    if checkpoint.load():
+                        self.logger.info("Resuming from checkpoint, %d range(s) already indexed" % len(checkpoint.done))
+                    else:
+                        self.logger.info("No checkpoint found, ES will be queried to find missing documents in each batch")
+                        checkpoint.valid = False
+                else:
+                    checkpoint.reset()
+
             def clean_ids(ids):
                 # can't use a generator, it's going to be pickled
                 cleaned = []
@@ -638,17 +661,42 @@ class Indexer(object):
                 return cleaned
 
             jobs = []
+            # batch size and number of jobs sent to ES at the same time are
+            # adjusted according to bulk latency and rejections
+            controller = self.get_controller(batch_size,job_manager)
+            inflight = set()
             total = target_collection.count()
             btotal = math.ceil(total/batch_size) 
             bnum = 1
+            # position of current batch in the stream of _ids
+            offset = 0
             if ids:
                 self.logger.info("Indexing from '%s' with specific list of _ids, create indexer job with batch_size=%d" % (target_name, batch_size))
                 id_provider = [ids]
             else:
                 self.logger.info("Fetch _ids from '%s', and create indexer job with batch_size=%d" % (target_name, batch_size))
                 id_provider = id_feeder(target_collection, batch_size=batch_size,logger=self.logger)
-            for ids in id_provider:
+            for ids in controller.rechunk(id_provider):
                 yield from asyncio.sleep(0.0)
+                # backpressure: wait for some jobs to finish if ES is struggling
+                while len(inflight) >= controller.inflight:
+                    yield from asyncio.wait(inflight,return_when=asyncio.FIRST_COMPLETED)
+                batch_start = offset
+                batch_ids = ids
+                offset += len(ids)
+                batch_mode = mode
+                if mode == "resume" and checkpoint:
+                    was_valid = checkpoint.valid
+                    ids,verify = checkpoint.remaining(batch_start,batch_ids)
+                    if was_valid and not checkpoint.valid:
+                        self.logger.warning("Checkpoint doesn't match _ids from '%s' anymore, " % target_name + \
+                                            "ES will be queried to find missing documents in each batch")
+                    if not ids:
+                        self.logger.debug("Batch at offset %d already indexed, skipped" % batch_start)
+                        continue
+                    # only batches launched before the interruption may be partially indexed
+                    # and need to be checked against ES
+                    batch_mode = verify and "resume" or "index"
                 origcnt = len(ids)
                 ids = clean_ids(ids)
                 newcnt = len(ids)
@@ -657,15 +705,19 @@ class Indexer(object):
                                         "will be skipped (invalid _id)")
                 # progress count
                 cnt += len(ids)
+                # batch size may vary, estimate remaining number of batches
+                btotal = bnum + math.ceil(max(0,total - offset) / controller.batch_size)
                 pinfo = self.get_pinfo()
                 pinfo["step"] = self.target_name
                 try:
-                    descprogress = cnt/total*100
+                    descprogress = offset/total*100
                 except ZeroDivisionError:
                     descprogress = 0.0
                 pinfo["description"] = "#%d/%d (%.1f%%)" % (bnum,btotal,descprogress)
                 self.logger.info("Creating indexer job #%d/%d, to index '%s' %d/%d (%.1f%%)" % \
-                        (bnum,btotal,target_name,cnt,total,descprogress))
+                        (bnum,btotal,target_name,offset,total,descprogress))
+                if checkpoint:
+                    checkpoint.mark_launched(batch_start,batch_ids)
                 job = yield from job_manager.defer_to_process(
                         pinfo,
                         partial(indexer_worker,
@@ -673,16 +725,23 @@ class Indexer(object):
                             ids,
                             partial_idxer,
                             bnum,
-                            mode,
+                            batch_mode,
                             worker))
-                def batch_indexed(f,batch_num):
+                def batch_indexed(f,batch_num,batch_start,batch_ids):
                     nonlocal got_error
+                    inflight.discard(f)
                     res = f.result()
                     if type(res) != tuple or type(res[0]) != int:
                         got_error = Exception("Batch #%s failed while indexing collection '%s' [result:%s]" % \
                                 (batch_num,self.target_name,repr(res)))
-                job.add_done_callback(partial(batch_indexed,batch_num=bnum))
+                        return
+                    controller.record_result(res)
+                    if checkpoint:
+                        checkpoint.mark_done(batch_start,batch_ids)
+                job.add_done_callback(partial(batch_indexed,batch_num=bnum,
+                                              batch_start=batch_start,batch_ids=batch_ids))
                 jobs.append(job)
+                inflight.add(job)
                 bnum += 1
                 # raise error as soon as we know
                 if got_error:
@@ -698,7 +757,12 @@ class Indexer(object):
                 # compute overall inserted/updated records
                 # returned values looks like [(num,[]),(num,[]),...]
                 cnt = sum([val[0] for val in f.result()])
-                self.register_status("success",job={"step":"index"},index={"count":cnt})
+                self.logger.info("Indexing controller summary: %s" % controller.summary())
+                if checkpoint:
+                    # index is complete, nothing to resume anymore
+                    checkpoint.clear()
+                self.register_status("success",job={"step":"index","controller":controller.summary()},
+                                     index={"count":cnt})
                 self.logger.info("Index '%s' successfully created" % index_name,extra={"notify":True})
             tasks.add_done_callback(done)
             yield from tasks
@@ -733,6 +797,19 @@ class Indexer(object):
             self.register_status("success")
             return {"%s" % self.index_name : cnt}
 
+    def get_controller(self, batch_size, job_manager):
+        """
+        Return an IndexingController adjusting batch size and in-flight
+        jobs, starting from batch_size. Can be overridden to tune the
+        controller for a specific ES cluster.
+        """
+        max_inflight = getattr(btconfig,"INDEX_MAX_INFLIGHT",None) or \
+                job_manager.process_queue._max_workers
+        return IndexingController(batch_size=batch_size,
+                min_batch_size=getattr(btconfig,"INDEX_MIN_BATCH_SIZE",min(500,batch_size)),
+                max_batch_size=getattr(btconfig,"INDEX_MAX_BATCH_SIZE",batch_size*5),
+                max_inflight=max_inflight)
+
     def register_status(self,status,transient=False,init=False,**extra):
         assert self.build_doc
         src_build = get_src_build()
@@ -5,9 +5,10 @@ import asyncio
 from functools import partial
 import inspect
 import subprocess
+import itertools
 
 from biothings.utils.hub_db import get_src_dump, get_src_build, get_source_fullname
-from biothings.utils.common import timesofar
+from biothings.utils.common import timesofar, iter_n
 from biothings.utils.dataload import dict_walk
 from biothings.utils.mongo import id_feeder, doc_feeder
 from biothings.utils.loggers import get_logger
@@ -27,7 +28,14 @@ class InspectorError(Exception):
 def inspect_data(backend_provider,ids,mode,pre_mapping,**kwargs):
     col = create_backend(backend_provider).target_collection
     cur = doc_feeder(col, step=len(ids), inbatch=False, query={'_id': {'$in': ids}}) 
-    return btinspect.inspect_docs(cur,mode=mode,pre_mapping=pre_mapping,metadata=False,**kwargs)
+    # partial results, values are kept so results can be merged (post-processed once merged)
+    return btinspect.inspect_docs(cur,mode=mode,pre_mapping=pre_mapping,metadata=False,clean=False,**kwargs)
+
+
+def sample_ids(backend_provider,size):
+    col = create_backend(backend_provider).target_collection
+    ids = itertools.chain.from_iterable(id_feeder(col,batch_size=10000))
+    return btinspect.reservoir_sample(ids,size)
 
 
 class InspectorManager(BaseManager):
@@ -43,7 +51,7 @@ class InspectorManager(BaseManager):
         """Setup and return a logger instance"""
         self.logger, self.logfile = get_logger('inspect')
 
-    def inspect(self, data_provider, mode="type", batch_size=10000,**kwargs):
+    def inspect(self, data_provider, mode="type", batch_size=10000, sample_size=None, **kwargs):
         """
         Inspect given data provider:
         - backend definition, see bt.hub.dababuild.create_backend for
@@ -55,6 +63,10 @@ class InspectorManager(BaseManager):
           ElasticSearch mapping generation (see bt.utils.es.generate_es_mapping)
         - "stats": will inspect and report types + different counts found in
           data, giving a detailed overview of the volumetry of each fields and sub-fields
+        Documents are inspected by batches of batch_size _ids, in parallel, partial
+        results are merged at the end. If sample_size is set, only that number of
+        documents, uniformly sampled, are inspected. Results then contain sampling
+        information in "__metadata__" (see bt.utils.inspect.sample_confidence).
         """
         # /!\ attention: this piece of code is critical and not easy to understand...
         # Depending on the source of data to inspect, this method will create an
@@ -97,7 +109,8 @@ class InspectorManager(BaseManager):
                     self.logger.debug("Multiple uploaders found, running inspector for each of them: %s" % ups)
                     res = []
                     for up in ups:
-                        r = self.inspect((data_provider[0],"%s" % up.name),mode=mode, batch_size=batch_size,**kwargs)
+                        r = self.inspect((data_provider[0],"%s" % up.name),mode=mode, batch_size=batch_size,
+                                     sample_size=sample_size,**kwargs)
                         res.append(r)
                     return res
 
@@ -149,9 +162,22 @@ class InspectorManager(BaseManager):
                 inspected = {}
                 for m in mode:
                     inspected.setdefault(m,{})
+                clean = kwargs.pop("clean",True)
 
-                backend = create_backend(backend_provider).target_collection
-                for ids in id_feeder(backend,batch_size=batch_size):
+                sampling = None
+                if sample_size:
+                    # _ids are read once, a uniform sample is kept
+                    pinfo["description"] = "sampling %s documents" % sample_size
+                    job = yield from self.job_manager.defer_to_thread(pinfo,
+                            partial(sample_ids,backend_provider,sample_size))
+                    sampled_ids,total = yield from job
+                    self.logger.info("Inspecting %s documents sampled among %s" % (len(sampled_ids),total))
+                    sampling = btinspect.sample_confidence(len(sampled_ids),total)
+                    id_batches = (list(ids) for ids in iter_n(sampled_ids,batch_size))
+                else:
+                    backend = create_backend(backend_provider).target_collection
+                    id_batches = id_feeder(backend,batch_size=batch_size)
+                for ids in id_batches:
                     cnt += 1
                     pinfo["description"] = "batch #%s" % cnt
                     def batch_inspected(bnum,i,f):
@@ -160,8 +186,7 @@ class InspectorManager(BaseManager):
                         nonlocal mode
                         try:
                             res = f.result()
-                            for m in mode:
-                                inspected[m] = btinspect.merge_record(inspected[m],res[m],m)
+                            btinspect.merge_inspect_results(inspected,res,mode)
                         except Exception as e:
                             got_error = e
                             self.logger.error("Error while inspecting data from batch #%s: %s" % (bnum,e))
@@ -176,6 +201,9 @@ class InspectorManager(BaseManager):
 
                 yield from asyncio.gather(*jobs)
 
+                btinspect.post_inspect_results(inspected,mode,clean)
+                if inspected.get("errors"):
+                    inspected["errors"] = sorted(inspected["errors"])
                 # compute metadata (they were skipped before)
                 for m in mode:
                     if m == "mapping":
@@ -187,6 +215,11 @@ class InspectorManager(BaseManager):
                             inspected["mapping"] = {"pre-mapping" : inspected["mapping"], "errors" : e.args[1]}
                     else:
                         inspected = btinspect.compute_metadata(inspected,m)
+                if sampling:
+                    if not set(mode) & {"type","mapping"}:
+                        # confidence only makes sense for structure found in documents
+                        sampling = {"size" : sampling["size"], "total" : sampling["total"]}
+                    inspected.setdefault("__metadata__",{})["sample"] = sampling
 
                 def fully_inspected(res):
                     nonlocal got_error
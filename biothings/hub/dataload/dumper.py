@@ -7,7 +7,7 @@ import inspect
 import subprocess
 
 from biothings.utils.hub_db import get_src_dump, get_data_plugin
-from biothings.utils.common import timesofar, rmdashfr
+from biothings.utils.common import timesofar, rmdashfr, md5sum
 from biothings.utils.loggers import get_logger
 from biothings.hub import DUMPER_CATEGORY, UPLOADER_CATEGORY
 from config import logger as logging, LOG_FOLDER
@@ -38,6 +38,12 @@ class BaseDumper(object):
 
     SCHEDULE = None # crontab format schedule, if None, won't be scheduled
 
+    # record content hashes of files found in data folder ("download.files" in src_dump),
+    # along with files changed/removed since previous dump ("download.changed_files",
+    # "download.removed_files"). Uploaders can then only process what changed
+    # (see BaseSourceUploader.file_partitionable)
+    TRACK_FILE_CHANGES = False
+
     def __init__(self, src_name=None, src_root_folder=None, log_folder=None, archive=None):
         # unpickable attrs, grouped
         self.init_state()
@@ -193,6 +199,8 @@ class BaseDumper(object):
             data_folder = self.new_data_folder
         except DumperException:
             data_folder = self.current_data_folder
+        # files tracked during previous dump, kept until new ones are computed
+        files = self.src_doc.get("download",{}).get("files")
         release = getattr(self,self.__class__.SUFFIX_ATTR)
         if release is None:
             # it has not been set by the dumper before while exploring
@@ -216,6 +224,8 @@ class BaseDumper(object):
                    'started_at': datetime.now(),
                    'status': status}
                })
+        if files:
+            self.src_doc["download"]["files"] = files
         # only register time when it's a final state
         if transient:
             self.src_doc["download"]["pid"] = os.getpid()
@@ -292,8 +302,15 @@ class BaseDumper(object):
                 yield from job
                 if got_error:
                     raise got_error
+                changes = {}
+                if self.__class__.TRACK_FILE_CHANGES:
+                    pinfo["step"] = "track_changes"
+                    job = yield from job_manager.defer_to_thread(pinfo,
+                            partial(self.get_file_changes,self.current_data_folder))
+                    yield from job
+                    changes = job.result()
                 # set it to success at the very end
-                self.register_status("success")
+                self.register_status("success",download=changes)
                 if self.__class__.AUTO_UPLOAD:
                     set_pending_to_upload(self.src_name)
                 self.logger.info("success %s" % strargs,extra={"notify":True})
@@ -416,6 +433,49 @@ class BaseDumper(object):
         self.logger.info("%s successfully downloaded" % self.SRC_NAME)
         self.to_dump = []
 
+    def get_file_hashes(self,data_folder,previous={}):
+        """
+        Return content hashes for all files found in data_folder, as a dict
+        {relative_path : {"hash" : ..., "size" : ..., "mtime" : ...}}. Hashes found
+        in 'previous' (same structure) are re-used if size and modification time
+        didn't change.
+        """
+        hashes = {}
+        for root,dirs,files in os.walk(data_folder):
+            dirs[:] = [d for d in dirs if d != ".git"]
+            for fn in files:
+                path = os.path.join(root,fn)
+                relpath = os.path.relpath(path,data_folder)
+                st = os.stat(path)
+                info = {"size" : st.st_size, "mtime" : st.st_mtime}
+                prev = previous.get(relpath,{})
+                if prev.get("hash") and prev.get("size") == info["size"] and \
+                        prev.get("mtime") == info["mtime"]:
+                    info["hash"] = prev["hash"]
+                else:
+                    info["hash"] = md5sum(path)
+                hashes[relpath] = info
+        return hashes
+
+    def get_file_changes(self,data_folder):
+        """
+        Hash files in data_folder and compare with files registered during
+        previous dump. Return a dict with "files" (list of {"path","hash",...}),
+        "changed_files" (new or modified) and "removed_files" (list of paths)
+        """
+        previous = dict([(f["path"],f) for f in self.src_doc.get("download",{}).get("files") or []])
+        hashes = self.get_file_hashes(data_folder,previous)
+        changed = sorted([p for p in hashes if previous.get(p,{}).get("hash") != hashes[p]["hash"]])
+        removed = sorted([p for p in previous if not p in hashes])
+        self.logger.info("%d file(s) tracked, %d changed, %d removed since previous dump" % \
+                (len(hashes),len(changed),len(removed)))
+        files = []
+        for path in sorted(hashes):
+            info = {"path" : path}
+            info.update(hashes[path])
+            files.append(info)
+        return {"files" : files, "changed_files" : changed, "removed_files" : removed}
+
     def prepare_local_folders(self,localfile):
         localdir = os.path.dirname(localfile)
         if not os.path.exists(localdir):
@@ -427,51 +487,240 @@ class BaseDumper(object):
 
 
 from ftplib import FTP
+import ftplib, posixpath, threading
+
+def ftp_time(value):
+    """Convert FTP time value (MDTM response, MLSD "modify" fact) to a timestamp"""
+    # an example: 'last-modified': '20121128150000' (MLSD can add fractions of seconds)
+    return time.mktime(datetime.strptime(value[:14], '%Y%m%d%H%M%S').timetuple())
+
+
+class FTPSessionPool(object):
+    """
+    Keep logged-in FTP sessions so they can be re-used for subsequent files
+    instead of connecting/logging in for each of them. Sessions are kept per
+    process (a pool inherited from a parent process is ignored) and per
+    server/credentials/working directory. Idle sessions are checked before
+    being re-used, and closed after "idle_timeout" seconds (by a timer, so
+    they're not kept open in worker processes once downloads are over).
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self.sessions = {}
+        self.lock = threading.RLock()
+        self.reaper = None
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            # forked, sockets belong to the parent process, don't touch them
+            # (neither the lock, nor the timer, which isn't running here)
+            self.sessions = {}
+            self.lock = threading.RLock()
+            self.reaper = None
+            self.pid = os.getpid()
+
+    def get(self, key, factory):
+        """
+        Return an idle session for "key" or a new one, created
+        with "factory()"
+        """
+        self.check_pid()
+        while True:
+            with self.lock:
+                idle = self.sessions.get(key,[])
+                if not idle:
+                    break
+                client,home,last_used = idle.pop()
+            if time.time() - last_used > self.idle_timeout:
+                self.close(client)
+                continue
+            try:
+                # also checks the session is still alive
+                client.cwd(home)
+                return client
+            except ftplib.all_errors:
+                self.close(client)
+        client = factory()
+        client._pool_home = client.pwd()
+        return client
+
+    def put(self, key, client):
+        self.check_pid()
+        with self.lock:
+            idle = self.sessions.setdefault(key,[])
+            if client.sock is None or len(idle) >= self.max_idle or not hasattr(client,"_pool_home"):
+                self.close(client)
+            else:
+                idle.append((client,client._pool_home,time.time()))
+                self.schedule_reap()
+
+    def schedule_reap(self):
+        if self.reaper is None:
+            self.reaper = threading.Timer(self.idle_timeout,self.reap)
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    def reap(self):
+        """Close sessions idle for more than idle_timeout seconds"""
+        expired = []
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.reaper = None
+            limit = time.time() - self.idle_timeout
+            for key in list(self.sessions):
+                expired.extend([s[0] for s in self.sessions[key] if s[2] <= limit])
+                self.sessions[key] = [s for s in self.sessions[key] if s[2] > limit]
+                if not self.sessions[key]:
+                    self.sessions.pop(key)
+            if self.sessions:
+                self.schedule_reap()
+        for client in expired:
+            self.close(client)
+
+    def close(self, client):
+        try:
+            client.quit()
+        except ftplib.all_errors:
+            client.close()
+
+    def clear(self):
+        self.check_pid()
+        with self.lock:
+            sessions,self.sessions = self.sessions,{}
+            if self.reaper:
+                self.reaper.cancel()
+                self.reaper = None
+        for idle in sessions.values():
+            for client,_,_ in idle:
+                self.close(client)
+
+ftp_sessions = FTPSessionPool()
+
 
 class FTPDumper(BaseDumper):
+    """
+    Dumper using FTP protocol. Logged-in sessions are taken from a pool
+    (see FTPSessionPool) and given back once released, so downloading many
+    files doesn't require to connect for each of them. Files metadata
+    (modification time, size) are obtained from one MLSD listing per folder,
+    instead of MDTM/SIZE commands for each file (if server supports MLSD).
+    """
     FTP_HOST = ''
     CWD_DIR = ''
     FTP_USER = ''
     FTP_PASSWD = ''
     FTP_TIMEOUT = 10*60.0 # we want dumper to timout if necessary
+    # try to use MLSD command to get files metadata
+    USE_MLSD = True
 
-    # TODO: should we add a __del__ to make sure to close ftp connection ?
-    # ftplib has a context __enter__, but we don't use it that way ("with ...")
+    def __init__(self, *args, **kwargs):
+        super(FTPDumper,self).__init__(*args, **kwargs)
+        # MLSD listings per folder, {folder: {filename: facts}}
+        # (None if MLSD isn't supported)
+        self.remote_listing = {}
+
+    @asyncio.coroutine
+    def dump(self, *args, **kwargs):
+        try:
+            return (yield from super(FTPDumper,self).dump(*args,**kwargs))
+        finally:
+            # dump is over, don't keep hub's idle sessions open
+            # (workers' ones are closed by the pool's timer)
+            ftp_sessions.clear()
 
     def prepare_client(self):
+        self.client = ftp_sessions.get(self.session_key,self.new_client)
+
+    @property
+    def session_key(self):
+        return (self.FTP_HOST,self.FTP_USER,self.FTP_PASSWD,self.CWD_DIR)
+
+    def new_client(self):
         # FTP side
-        self.client = FTP(self.FTP_HOST,timeout=self.FTP_TIMEOUT)
-        self.client.login(self.FTP_USER,self.FTP_PASSWD)
+        client = FTP(self.FTP_HOST,timeout=self.FTP_TIMEOUT)
+        client.login(self.FTP_USER,self.FTP_PASSWD)
         if self.CWD_DIR:
-            self.client.cwd(self.CWD_DIR)
+            client.cwd(self.CWD_DIR)
+        return client
 
     def need_prepare(self):
         return not self.client or (self.client and not self.client.file)
 
     def release_client(self):
         assert self.client
-        self.client.close()
+        # give session back to the pool for next files
+        ftp_sessions.put(self.session_key,self.client)
         self.client = None
 
+    def discard_client(self):
+        """Close client, which can't be re-used (eg. after an error)"""
+        if self._state["client"]:
+            self._state["client"].close()
+            self.client = None
+
+    def get_remote_info(self,remotefile):
+        """
+        Return MLSD facts (dict with "modify", "size" keys) for remotefile,
+        path relative to current working dir. Whole folder is listed once,
+        or None if MLSD isn't supported (or file not found)
+        """
+        if not self.__class__.USE_MLSD:
+            return None
+        folder,filename = posixpath.split(remotefile)
+        if not folder in self.remote_listing:
+            try:
+                self.remote_listing[folder] = dict(self.client.mlsd(folder,facts=["type","size","modify"]))
+                self.logger.debug("Listed %d entries in '%s' using MLSD" % (len(self.remote_listing[folder]),folder))
+            except ftplib.error_perm as e:
+                self.logger.debug("Can't use MLSD command (%s), using MDTM/SIZE instead" % e)
+                self.remote_listing[folder] = None
+        listing = self.remote_listing[folder]
+        return listing and listing.get(filename) or None
+
+    def get_remote_lastmodified(self,remotefile):
+        facts = self.get_remote_info(remotefile)
+        if facts and facts.get("modify"):
+            return ftp_time(facts["modify"])
+        response = self.client.sendcmd('MDTM ' + remotefile)
+        code, lastmodified = response.split()
+        return ftp_time(lastmodified)
+
+    def get_remote_size(self,remotefile):
+        facts = self.get_remote_info(remotefile)
+        if facts and facts.get("size"):
+            return int(facts["size"])
+        self.client.sendcmd("TYPE I")
+        response = self.client.sendcmd('SIZE ' + remotefile)
+        code, remote_size= map(int,response.split())
+        return remote_size
+
     def download(self,remotefile,localfile):
+        """
+        Download remotefile as localfile, setting its modification time to
+        the remote one. Return the status code of the MDTM command ("213"),
+        which is the same when modification time comes from MLSD listing
+        """
         self.prepare_local_folders(localfile)
         self.logger.debug("Downloading '%s' as '%s'" % (remotefile,localfile))
         try:
             with open(localfile,"wb") as out_f:
                 self.client.retrbinary('RETR %s' % remotefile, out_f.write)
             # set the mtime to match remote ftp server
-            response = self.client.sendcmd('MDTM ' + remotefile)
-            code, lastmodified = response.split()
-            # an example: 'last-modified': '20121128150000'
-            lastmodified = time.mktime(datetime.strptime(lastmodified, '%Y%m%d%H%M%S').timetuple())
+            lastmodified = self.get_remote_lastmodified(remotefile)
             os.utime(localfile, (lastmodified, lastmodified))
-            return code
+            # MDTM errors are raised, it can only be successful
+            return "213"
         except Exception as e:
             self.logger.error("Error while downloading %s: %s" % (remotefile,e))
-            self.release_client()
+            self.discard_client()
             raise
         finally:
-            self.release_client()
+            if self._state["client"]:
+                self.release_client()
 
     def remote_is_better(self,remotefile,localfile):
         """'remotefile' is relative path from current working dir (CWD_DIR), 
@@ -483,18 +732,14 @@ class FTPDumper(BaseDumper):
             return True
         local_lastmodified = int(res.st_mtime)
         self.logger.info("Getting modification time for '%s'" % remotefile)
-        response = self.client.sendcmd('MDTM ' + remotefile)
-        code, remote_lastmodified = response.split()
-        remote_lastmodified = int(time.mktime(datetime.strptime(remote_lastmodified, '%Y%m%d%H%M%S').timetuple()))
+        remote_lastmodified = int(self.get_remote_lastmodified(remotefile))
 
         if remote_lastmodified > local_lastmodified:
             self.logger.debug("Remote file '%s' is newer (remote: %s, local: %s)" %
                     (remotefile,remote_lastmodified,local_lastmodified))
             return True
         local_size = res.st_size
-        self.client.sendcmd("TYPE I")
-        response = self.client.sendcmd('SIZE ' + remotefile)
-        code, remote_size= map(int,response.split())
+        remote_size = self.get_remote_size(remotefile)
         if remote_size > local_size:
             self.logger.debug("Remote file '%s' is bigger (remote: %s, local: %s)" % (remotefile,remote_size,local_size))
             return True
@@ -548,11 +793,16 @@ class LastModifiedFTPDumper(LastModifiedBaseDumper):
     See also LastModifiedHTTPDumper, working the same way but for HTTP
     protocol.
     Note: this dumper is a wrapper over FTPDumper, one URL will give
-    one FTPDumper instance.
+    one FTPDumper instance (sharing FTP sessions and MLSD listings).
     """
 
     RELEASE_FORMAT = "%Y-%m-%d"
 
+    def __init__(self, *args, **kwargs):
+        super(LastModifiedFTPDumper,self).__init__(*args, **kwargs)
+        # MLSD listings, per server and folder
+        self.remote_listing = {}
+
     def prepare_client(self):
         pass
     def release_client(self):
@@ -569,6 +819,7 @@ class LastModifiedFTPDumper(LastModifiedBaseDumper):
                 "SRC_ROOT_FOLDER" : self.__class__.SRC_ROOT_FOLDER,
                 })
         ftpdumper = klass()
+        ftpdumper.remote_listing = self.remote_listing.setdefault(ftpdumper.session_key,{})
         ftpdumper.prepare_client()
         return ftpdumper
 
@@ -581,9 +832,7 @@ class LastModifiedFTPDumper(LastModifiedBaseDumper):
         url = self.__class__.SRC_URLS[-1]
         ftpdumper = self.get_client_for_url(url)
         remotefile = self.get_remote_file(url)
-        response = ftpdumper.client.sendcmd('MDTM ' + remotefile)
-        code, lastmodified = response.split()
-        lastmodified = time.mktime(datetime.strptime(lastmodified, '%Y%m%d%H%M%S').timetuple())
+        lastmodified = ftpdumper.get_remote_lastmodified(remotefile)
         dt = datetime.fromtimestamp(lastmodified)
         self.release = dt.strftime(self.__class__.RELEASE_FORMAT)
         ftpdumper.release_client()
@@ -602,12 +851,33 @@ class LastModifiedFTPDumper(LastModifiedBaseDumper):
 
 
 import requests
+import hashlib, base64, json, threading
+from concurrent.futures import ThreadPoolExecutor
 
 class HTTPDumper(BaseDumper):
-    """Dumper using HTTP protocol and "requests" library"""
+    """
+    Dumper using HTTP protocol and "requests" library.
+    When server supports byte-range requests, large files are downloaded
+    in parallel segments (MAX_SEGMENTS connections, segments being at least
+    SEGMENT_MIN_SIZE bytes). Files smaller than SEGMENT_MIN_SIZE are streamed
+    from the initial response. Data is written to a "<localfile>.part" file,
+    along with a "<localfile>.part.state" file keeping track of downloaded
+    bytes for each segment, so an interrupted download (dropped connection,
+    or even a previous dump) resumes where it stopped. File is moved to its
+    final location once size and checksum (if known, see get_checksum())
+    have been verified.
+    """
 
     VERIFY_CERT = True
 
+    CHUNK_SIZE = 512 * 1024
+    MAX_SEGMENTS = 4
+    SEGMENT_MIN_SIZE = 32 * 1024 * 1024
+    # number of times a segment is retried (resumed) after a network error
+    DOWNLOAD_RETRIES = 5
+    # seconds between state file updates while downloading
+    STATE_SAVE_INTERVAL = 5
+
     def prepare_client(self):
         self.client = requests.Session()
         self.client.verify = self.__class__.VERIFY_CERT
@@ -622,10 +892,34 @@ class HTTPDumper(BaseDumper):
     def remote_is_better(self,remotefile,localfile):
         return True
 
+    def get_checksum(self,remoteurl,response):
+        """
+        Return expected checksum for remoteurl, as a tuple (hashlib algorithm
+        name, hex digest), or None if unknown. "response" is the response
+        from the initial GET request. By default, "Digest" (RFC 3230) and
+        "Content-MD5" headers are used. Override in sub-class if checksums
+        are published another way (eg. md5 files)
+        """
+        digests = {}
+        for digest in (response.headers.get("digest") or "").split(","):
+            algo,_,value = digest.strip().partition("=")
+            digests[algo.lower().replace("-","")] = value
+        if response.headers.get("content-md5"):
+            digests.setdefault("md5",response.headers["content-md5"])
+        for algo in ["sha512","sha256","sha1","md5"]:
+            if digests.get(algo):
+                try:
+                    return (algo,base64.b64decode(digests[algo]).hex())
+                except ValueError:
+                    self.logger.warning("Invalid %s digest for '%s': %s" % (algo,remoteurl,digests[algo]))
+        return None
+
     def download(self,remoteurl,localfile,headers={}):
         """kwargs will be passed to requests.Session.get()"""
         self.prepare_local_folders(localfile)
         self.logger.debug("Downloading '%s'" % remoteurl)
+        # we want actual bytes, so sizes and ranges match what's stored
+        headers = dict({"Accept-Encoding" : "identity"},**headers)
         res = self.client.get(remoteurl,stream=True,headers=headers)
         if not res.status_code == 200:
             raise DumperException("Error while downloading '%s' (status: %s, reason: %s)" % \
@@ -637,13 +931,165 @@ class HTTPDumper(BaseDumper):
             if parsed and parsed[0] == "attachment" and parsed[1].get("filename"):
                 # localfile is an absolute path, replace last part
                 localfile = os.path.join(os.path.dirname(localfile),parsed[1]["filename"])
-        fout = open(localfile, 'wb')
-        for chunk in res.iter_content(chunk_size=512 * 1024):
-            if chunk:
-                fout.write(chunk)
-        fout.close()
+        partfile = localfile + ".part"
+        statefile = partfile + ".state"
+        size = res.headers.get("content-length")
+        if res.headers.get("content-encoding","identity") != "identity":
+            # server encoded data anyway, content length isn't the actual file size
+            size = None
+        size = size and int(size) or None
+        ranges = res.headers.get("accept-ranges","").lower() == "bytes" and size
+        checksum = self.get_checksum(remoteurl,res)
+        validator = res.headers.get("etag") or res.headers.get("last-modified")
+        state = None
+        if ranges and os.path.exists(partfile) and os.path.exists(statefile):
+            try:
+                with open(statefile) as fin:
+                    state = json.load(fin)
+            except ValueError:
+                pass
+            if validator is None:
+                # no ETag/Last-Modified, same size doesn't mean same file
+                self.logger.info("Can't tell if remote file '%s' changed since partial download, " % remoteurl + \
+                        "downloading from scratch")
+                state = None
+            elif not state or state.get("url") != remoteurl or state.get("size") != size \
+                    or state.get("validator") != validator:
+                self.logger.info("Partial download for '%s' doesn't match remote file anymore, " % remoteurl + \
+                        "downloading from scratch")
+                state = None
+            else:
+                self.logger.info("Resuming download of '%s' (%s/%s bytes)" % \
+                        (remoteurl,sum([seg[2] for seg in state["segments"]]),size))
+        if not state and (not ranges or size < self.__class__.SEGMENT_MIN_SIZE):
+            # no resume or parallel segments possible (or worth it, for small files), stream that response
+            if not ranges:
+                self.logger.debug("Server doesn't support byte ranges, single download for '%s'" % remoteurl)
+            if os.path.exists(statefile):
+                os.unlink(statefile)
+            with open(partfile,"wb") as fout:
+                for chunk in res.iter_content(chunk_size=self.__class__.CHUNK_SIZE):
+                    if chunk:
+                        fout.write(chunk)
+            res.close()
+        else:
+            # we only needed headers, data will come from range requests
+            res.close()
+            if not state:
+                numseg = max(1,min(self.__class__.MAX_SEGMENTS,size // self.__class__.SEGMENT_MIN_SIZE))
+                segsize = -(-size // numseg) # ceil
+                state = {"url" : remoteurl, "size" : size, "validator" : validator,
+                         "segments" : [[start,min(start + segsize,size),0] for start in range(0,size,segsize)]}
+                # pre-allocate, segments are written at their offset
+                with open(partfile,"wb") as fout:
+                    fout.truncate(size)
+                self.save_download_state(statefile,state)
+            self.download_segments(remoteurl,partfile,statefile,state,headers)
+        self.verify_download(remoteurl,partfile,size,checksum)
+        os.rename(partfile,localfile)
+        if os.path.exists(statefile):
+            os.unlink(statefile)
         return res
 
+    def save_download_state(self,statefile,state):
+        with open(statefile + ".tmp","w") as fout:
+            json.dump(state,fout)
+        os.rename(statefile + ".tmp",statefile)
+
+    def download_segments(self,remoteurl,partfile,statefile,state,headers):
+        todo = [seg for seg in state["segments"] if seg[0] + seg[2] < seg[1]]
+        if not todo:
+            return
+        self.logger.debug("Downloading '%s' in %d segment(s)" % (remoteurl,len(todo)))
+        lock = threading.Lock()
+        def save_state():
+            with lock:
+                self.save_download_state(statefile,state)
+        try:
+            with ThreadPoolExecutor(max_workers=len(todo)) as executor:
+                futures = [executor.submit(self.download_segment,remoteurl,partfile,seg,headers,save_state)
+                           for seg in todo]
+                errors = [f.exception() for f in futures if f.exception()]
+        finally:
+            # keep track of what's been downloaded, whatever happened
+            save_state()
+        if errors:
+            raise errors[0]
+
+    def download_segment(self,remoteurl,partfile,segment,headers,save_state):
+        """
+        Download bytes [start+done,end[ for segment [start,end,done] into partfile
+        at corresponding offset, "done" being updated as data is written.
+        Download is resumed on network errors, up to DOWNLOAD_RETRIES times
+        """
+        # sessions aren't thread-safe, one per segment
+        client = requests.Session()
+        client.verify = self.__class__.VERIFY_CERT
+        retries = 0
+        last_save = time.time()
+        try:
+            with open(partfile,"r+b") as fout:
+                while segment[0] + segment[2] < segment[1]:
+                    offset = segment[0] + segment[2]
+                    try:
+                        hdrs = dict(headers,Range="bytes=%d-%d" % (offset,segment[1] - 1))
+                        res = client.get(remoteurl,stream=True,headers=hdrs)
+                        if res.status_code != 206:
+                            raise DumperException("Error while downloading range %s of '%s' (status: %s, reason: %s)" % \
+                                    (hdrs["Range"],remoteurl,res.status_code,res.reason))
+                        fout.seek(offset)
+                        for chunk in res.iter_content(chunk_size=self.__class__.CHUNK_SIZE):
+                            chunk = chunk[:segment[1] - segment[0] - segment[2]]
+                            fout.write(chunk)
+                            # data must be flushed before being declared as done
+                            fout.flush()
+                            segment[2] += len(chunk)
+                            if time.time() - last_save > self.__class__.STATE_SAVE_INTERVAL:
+                                save_state()
+                                last_save = time.time()
+                        res.close()
+                        if segment[0] + segment[2] < segment[1]:
+                            raise requests.exceptions.ConnectionError("Connection closed before end of range " + \
+                                    "(%s/%s bytes)" % (segment[2],segment[1] - segment[0]))
+                    except requests.exceptions.RequestException as e:
+                        # only count consecutive errors, without any progress
+                        retries = offset == segment[0] + segment[2] and retries + 1 or 1
+                        if retries > self.__class__.DOWNLOAD_RETRIES:
+                            raise
+                        self.logger.warning("Error while downloading '%s' (%s), resuming at offset %d (retry %d/%d)" % \
+                                (remoteurl,e,segment[0] + segment[2],retries,self.__class__.DOWNLOAD_RETRIES))
+                        time.sleep(min(retries,10))
+        finally:
+            client.close()
+
+    def verify_download(self,remoteurl,partfile,size,checksum):
+        """
+        Check downloaded file "partfile" against expected size and checksum
+        (if known). Raise DumperException and delete the file (and its download
+        state) if not valid
+        """
+        def discard():
+            for fn in (partfile,partfile + ".state"):
+                if os.path.exists(fn):
+                    os.unlink(fn)
+        actual_size = os.path.getsize(partfile)
+        if size is not None and actual_size != size:
+            discard()
+            raise DumperException("Size mismatch for '%s' (expected: %s, got: %s)" % \
+                    (remoteurl,size,actual_size))
+        if checksum:
+            algo,expected = checksum
+            h = hashlib.new(algo)
+            with open(partfile,"rb") as fin:
+                for chunk in iter(lambda: fin.read(self.__class__.CHUNK_SIZE),b""):
+                    h.update(chunk)
+            if h.hexdigest() != expected.lower():
+                discard()
+                raise DumperException("Checksum mismatch for '%s' (%s expected: %s, got: %s)" % \
+                        (remoteurl,algo,expected,h.hexdigest()))
+            self.logger.debug("Checksum %s verified for '%s'" % (algo,remoteurl))
+
+
 class LastModifiedHTTPDumper(HTTPDumper,LastModifiedBaseDumper):
     """Given a list of URLs, check Last-Modified header to see
     whether the file should be downloaded. Sub-class should only have
@@ -730,6 +1176,7 @@ class FilesystemDumper(BaseDumper):
     """
 
     FS_OP = "cp" # or 'mv' if file needs to be delete from original folder
+    TRACK_FILE_CHANGES = True
 
     def prepare_client(self):
         """Check if 'cp' and 'mv' executable exists..."""
@@ -745,6 +1192,8 @@ class FilesystemDumper(BaseDumper):
         pass
 
     def remote_is_better(self,remotefile,localfile):
+        if not os.path.exists(localfile):
+            return True
         res = os.stat(remotefile)
         remote_lastmodified = int(res.st_mtime)
         res = os.stat(localfile)
@@ -930,6 +1379,7 @@ class GitDumper(BaseDumper):
 
     GIT_REPO_URL = None
     BRANCH = "master"
+    TRACK_FILE_CHANGES = True
 
     def _clone(self,repourl,localdir):
         self.logger.info("git clone '%s' into '%s'" % (repourl,localdir))
@@ -990,13 +1440,16 @@ class GitDumper(BaseDumper):
             if do_clone:
                 self._clone(self.__class__.GIT_REPO_URL,self.src_root_folder)
             self._pull(self.src_root_folder,release)
+            if self.__class__.TRACK_FILE_CHANGES:
+                return self.get_file_changes(self.src_root_folder)
+            return {}
         pinfo = self.get_pinfo()
         job = yield from job_manager.defer_to_thread(pinfo,partial(do))
         def done(f):
             nonlocal got_error
             try:
                 res = f.result()
-                self.register_status("success")
+                self.register_status("success",download=res)
             except Exception as e:
                 got_error = e
                 self.logger.exception("failed: %s" % e,extra={"notify":True})
@@ -1005,6 +1458,17 @@ class GitDumper(BaseDumper):
         job.add_done_callback(done)
         yield from job
 
+    def get_file_hashes(self,data_folder,previous={}):
+        """Use blob hashes from git index, files don't need to be read"""
+        out = subprocess.check_output(["git","ls-files","-s","-z"],cwd=data_folder)
+        hashes = {}
+        for entry in out.decode().split("\0"):
+            if not entry:
+                continue
+            info,path = entry.split("\t",1)
+            hashes[path] = {"hash" : info.split()[1]}
+        return hashes
+
     def prepare_client(self):
         """Check if 'git' executable exists"""
         ret = os.system("type git 2>&1 > /dev/null")
@@ -1139,7 +1603,12 @@ class DumperManager(BaseSourceManager):
             logging.warning("Found errors while scheduling:\n%s" % pprint.pformat(errors))
             return errors
 
-    def source_info(self,source=None):
+    def source_info(self,source=None,projection=None):
+        """
+        Return src_dump documents of registered dumpers (or only "source"),
+        completed with dumper class information. An optional projection
+        can be passed to only fetch some of src_dump fields.
+        """
         src_dump = get_src_dump()
         src_ids = list(self.register.keys())
         if source:
@@ -1149,7 +1618,7 @@ class DumperManager(BaseSourceManager):
                 return None
         res = []
         for _id in src_ids:
-            src = src_dump.find_one({"_id":_id}) or {}
+            src = src_dump.find_one({"_id":_id},projection) or {}
             assert len(self.register[_id]) == 1, "Found more than one dumper for source '%s': %s" % (_id,self.register[_id])
             dumper = self.register[_id][0]
             src.setdefault("download",{})
@@ -8,13 +8,16 @@ from biothings.utils.hub_db import get_data_plugin
 from biothings.utils.dataload import to_boolean
 from biothings.utils.manager import BaseSourceManager
 from biothings.utils.hub_db import get_src_master, get_source_fullname, \
-                                   get_src_dump
+                                   get_src_dump, ChangeListener, ChangeWatcher
+import biothings.utils.inspect as btinspect
 
 
-class SourceManager(BaseSourceManager):
+class SourceManager(BaseSourceManager, ChangeListener):
     """
     Helper class to get information about a datasource,
     whether it has a dumper and/or uploaders associated.
+    Sources' summaries are cached and invalidated when
+    hub db changes are published (see read()).
     """
 
     def __init__(self, source_list, dump_manager, upload_manager, data_plugin_manager):
@@ -23,13 +26,26 @@ class SourceManager(BaseSourceManager):
         self.dump_manager = dump_manager
         self.upload_manager = upload_manager
         self.data_plugin_manager = data_plugin_manager
+        self.summaries = {} # cached sources' summaries, per source _id
         self.reload()
         self.src_master = get_src_master()
         self.src_dump = get_src_dump()
         # honoring BaseSourceManager interface (gloups...-
         self.register = {}
+        ChangeWatcher.add(self)
+
+    def read(self, event):
+        """Invalidate cached summaries impacted by a hub db change event"""
+        if not event.get("obj") in ("source","data_plugin"):
+            return
+        if type(event.get("_id")) == str:
+            self.summaries.pop(event["_id"],None)
+        else:
+            # general event, or not specific enough
+            self.summaries.clear()
 
     def reload(self):
+        self.summaries.clear()
         # clear registers
         self.dump_manager.register.clear()
         self.upload_manager.register.clear()
@@ -182,6 +198,86 @@ class SourceManager(BaseSourceManager):
 
         return mini
 
+    def summary_projection(self, _id, detailed=False):
+        """
+        Return a projection excluding src_dump fields not needed to summarize
+        source _id: tracked files and, unless detailed, inspection results
+        (can be several MB, only errors are kept, see inspect_errors())
+        """
+        proj = {"download.files" : 0}
+        for klass in self.upload_manager.register.get(_id,[]):
+            proj["upload.jobs.%s.files" % klass.name] = 0
+            if not detailed:
+                proj["inspect.jobs.%s.inspect.results" % klass.name] = 0
+        return proj
+
+    def inspect_errors(self, _id, jobs):
+        """Return inspection errors found in source _id, per job and mode"""
+        modes = ["type","mapping"] + list(btinspect.MODES_MAP)
+        proj = dict([("inspect.jobs.%s.inspect.results.%s.errors" % (job,mode),1) \
+                for job in jobs for mode in modes])
+        doc = self.src_dump.find_one({"_id":_id},proj) or {}
+        errors = {}
+        for job,info in doc.get("inspect",{}).get("jobs",{}).items():
+            # projection keeps (empty) parent of missing fields
+            for mode,res in info.get("inspect",{}).get("results",{}).items():
+                if res.get("errors"):
+                    errors.setdefault(job,{})[mode] = res
+        return errors
+
+    def summarize_source(self, _id, debug=False, detailed=False):
+        """
+        Return information about source _id, from dumper, uploaders and
+        data plugin, fetching only required fields from hub db (all of them
+        if debug). Return None if source can't be found.
+        """
+        dm = self.dump_manager
+        um = self.upload_manager
+        dpm = self.data_plugin_manager
+        proj = None
+        if not debug:
+            proj = self.summary_projection(_id,detailed)
+        summary = None
+        # start with dumper info
+        if dm and _id in dm.register:
+            src = dm.source_info(_id,proj)
+            if debug:
+                summary = src
+            else:
+                summary = self.sumup_source(src,detailed)
+        # complete with uploader info
+        if um and _id in um.register:
+            src = um.source_info(_id,proj)
+            # collection-only source don't have dumpers and only exist in
+            # the uploader manager
+            if summary is None:
+                summary = self.sumup_source(src,detailed)
+            if src.get("upload"):
+                for subname in src["upload"].get("jobs",{}):
+                    try:
+                        summary.setdefault("upload",{"sources" : {}})["sources"].setdefault(subname,{})
+                        summary["upload"]["sources"][subname]["uploader"] = src["upload"]["jobs"][subname].get("uploader")
+                    except Exception as e:
+                        logging.error("Source is invalid: %s\n%s" % (e,pformat(src)))
+        if summary and not debug and not detailed and summary.get("inspect"):
+            errors = self.inspect_errors(_id,list(summary["inspect"]["sources"]))
+            for job,info in summary["inspect"]["sources"].items():
+                if "inspect" in info:
+                    info["inspect"].setdefault("results",{}).update(errors.get(job,{}))
+        # deal with plugin info if any
+        if dpm and _id in dpm.register:
+            src = get_data_plugin().find_one({"_id":_id},not debug and {"download.files":0,"manifest":0} or None)
+            if src:
+                assert len(dpm[_id]) == 1, "Expected only one uploader, got: %s" % dpm[_id]
+                src.pop("_id")
+                summary = summary or {"data_plugin": {}}
+                if src.get("download",{}).get("err"):
+                    src["download"]["error"] = src["download"].pop("err")
+                summary["data_plugin"] = src
+                summary["_id"] = _id
+                summary["name"] = _id
+        return summary
+
     def get_sources(self,id=None,debug=False,detailed=False):
         dm = self.dump_manager
         um = self.upload_manager
@@ -200,53 +296,27 @@ class SourceManager(BaseSourceManager):
             ids = set(dm.register)
             ids.update(um.register)
             ids.update(dpm.register)
+        # only summaries for all sources are cached (what's regularly polled),
+        # single source results are completed below
+        use_cache = not id and not debug and not detailed
         sources = {}
-        bydsrcs = {}
-        byusrcs = {}
-        bydpsrcs = {}
-        plugins = get_data_plugin().find()
-        [bydsrcs.setdefault(src["_id"],src) for src in dm.source_info() if dm]
-        [byusrcs.setdefault(src["_id"],src) for src in um.source_info() if um]
-        [bydpsrcs.setdefault(src["_id"],src) for src in plugins]
         for _id in ids:
-            # start with dumper info
-            if dm:
-                src = bydsrcs.get(_id)
-                if src:
-                    if debug:
-                        sources[src["name"]] = src
-                    else:
-                        sources[src["name"]] = self.sumup_source(src,detailed)
-            # complete with uploader info
-            if um:
-                src = byusrcs.get(_id)
-                if src:
-                    # collection-only source don't have dumpers and only exist in
-                    # the uploader manager
-                    if not src["_id"] in sources:
-                        sources[src["_id"]] = self.sumup_source(src,detailed)
-                    if src.get("upload"):
-                        for subname in src["upload"].get("jobs",{}):
-                            try:
-                                sources[src["name"]].setdefault("upload",{"sources" : {}})["sources"].setdefault(subname,{})
-                                sources[src["name"]]["upload"]["sources"][subname]["uploader"] = src["upload"]["jobs"][subname].get("uploader")
-                            except Exception as e:
-                                logging.error("Source is invalid: %s\n%s" % (e,pformat(src)))
-            # deal with plugin info if any
-            if dpm:
-                src = bydpsrcs.get(_id)
-                if src:
-                    assert len(dpm[_id]) == 1, "Expected only one uploader, got: %s" % dpm[_id]
-                    klass = dpm[_id][0]
-                    src.pop("_id")
-                    if hasattr(klass,"data_plugin_error"):
-                        src["error"] = klass.data_plugin_error
-                    sources.setdefault(_id,{"data_plugin": {}})
-                    if src.get("download",{}).get("err"):
-                        src["download"]["error"] = src["download"].pop("err")
-                    sources[_id]["data_plugin"] = src
-                    sources[_id]["_id"] = _id
-                    sources[_id]["name"] = _id
+            if use_cache and _id in self.summaries:
+                summary = self.summaries[_id]
+            else:
+                summary = self.summarize_source(_id,debug,detailed)
+                if use_cache:
+                    self.summaries[_id] = summary
+            if not summary:
+                continue
+            if "data_plugin" in summary and _id in dpm.register:
+                # errors are set on plugin's class, not in hub db
+                klass = dpm[_id][0]
+                if hasattr(klass,"data_plugin_error"):
+                    # summary may be cached, don't modify it
+                    summary = dict(summary,data_plugin=dict(summary["data_plugin"],
+                                                            error=klass.data_plugin_error))
+            sources[_id] = summary
         if id:
             src = list(sources.values()).pop()
             # enrich with metadata (uploader > dumper)
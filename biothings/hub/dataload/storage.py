@@ -1,12 +1,15 @@
 import types, copy, datetime, time
 import logging
+import psutil, bson
 
 import asyncio
+from pymongo import ReplaceOne
 from pymongo.errors import DuplicateKeyError, BulkWriteError
 
-from biothings.utils.common import timesofar, iter_n
+from biothings.utils.common import timesofar, iter_n, sizeof_fmt
 from biothings.utils.dataload import merge_struct, merge_root_keys
 from biothings.utils.mongo import get_src_db, check_document_size
+from biothings import config
 
 
 class StorageException(Exception):
@@ -14,10 +17,24 @@ class StorageException(Exception):
 
 class BaseStorage(object):
 
+    # documents are batched by count (batch_size) and by estimated size, so a
+    # batch stays within the worker memory budget (config.UPLOAD_WORKER_MEMORY_BUDGET,
+    # bytes, None for no limit). Estimation is based on BSON size, python objects
+    # taking about BATCH_MEMORY_RATIO times more memory. Encoding is costly, only
+    # one document every SIZE_SAMPLE_RATE is encoded, batch size is extrapolated
+    # from the average size of these samples
+    BATCH_MEMORY_RATIO = 4
+    SIZE_SAMPLE_RATE = 100
+
     def __init__(self,db,dest_col_name,logger=logging):
         db = db or get_src_db()
         self.temp_collection = db[dest_col_name]
         self.logger = logger
+        budget = getattr(config,"UPLOAD_WORKER_MEMORY_BUDGET",1024**3)
+        self.max_batch_bytes = budget and budget // self.__class__.BATCH_MEMORY_RATIO
+        # filled while batching, see doc_iterator(): one entry per stored batch
+        self.stats = {"batches" : []}
+        self.process_info = psutil.Process()
 
     def process(self,iterable,*args,**kwargs):
         """
@@ -43,32 +60,64 @@ class CheckSizeStorage(BaseStorage):
 
 class BasicStorage(BaseStorage):
 
+    def doc_size(self,doc):
+        """Estimated size of a document (bytes), used to bound batches"""
+        return len(bson.BSON.encode(doc))
+
+    def register_batch(self,num_docs,batch_bytes,rss):
+        """
+        Record stats about a batch once stored: number of documents, estimated size,
+        and peak RSS (rss being measured before storing it, compared to current one)
+        """
+        rss = max(rss,self.process_info.memory_info().rss)
+        self.stats["batches"].append({"docs" : num_docs, "est_bytes" : batch_bytes, "peak_rss" : rss})
+        if self.max_batch_bytes and batch_bytes >= self.max_batch_bytes:
+            self.logger.info("Batch limited to %d documents (estimated size: %s, RSS: %s)" % \
+                    (num_docs,sizeof_fmt(batch_bytes),sizeof_fmt(rss)))
+
     def doc_iterator(self, doc_d, batch=True, batch_size=10000):
-        if isinstance(doc_d, types.GeneratorType) and batch:
-            for doc_li in iter_n(doc_d, n=batch_size):
-                doc_li = [d for d in doc_li if self.check_doc_func(d)]
+        if not isinstance(doc_d, types.GeneratorType):
+            # dict, _id as key
+            doc_d = self.dict_doc_iterator(doc_d)
+        if not batch:
+            for doc in doc_d:
+                if self.check_doc_func(doc):
+                    yield doc
+            return
+        doc_li = []
+        max_batch_bytes = batch_size > 1 and self.max_batch_bytes
+        sample_rate = self.__class__.SIZE_SAMPLE_RATE
+        # docs seen, sampled docs size and count, average sampled size
+        num_docs = sampled_bytes = num_sampled = 0
+        avg_size = 0
+        for doc in doc_d:
+            if not self.check_doc_func(doc):
+                continue
+            doc_li.append(doc)
+            if max_batch_bytes:
+                if num_docs % sample_rate == 0:
+                    sampled_bytes += self.doc_size(doc)
+                    num_sampled += 1
+                    avg_size = sampled_bytes / num_sampled
+                num_docs += 1
+            if len(doc_li) >= batch_size or \
+                    max_batch_bytes and len(doc_li) * avg_size >= max_batch_bytes:
+                num,rss = len(doc_li),self.process_info.memory_info().rss
                 yield doc_li
-        else:
-            if batch:
+                # back here once batch is stored
+                self.register_batch(num,int(num * avg_size),rss)
                 doc_li = []
-                i = 0
-            for _id, doc in doc_d.items():
-                doc['_id'] = _id
-                _doc = {}
-                _doc.update(doc)
-                if batch:
-                    doc_li.append(_doc)
-                    i += 1
-                    if i % batch_size == 0:
-                        doc_li = [d for d in doc_li if self.check_doc_func(d)]
-                        yield doc_li
-                        doc_li = []
-                else:
-                    yield self.check_doc_func(_doc)
-
-            if batch:
-                doc_li = [d for d in doc_li if self.check_doc_func(d)]
-                yield doc_li
+        if doc_li:
+            num,rss = len(doc_li),self.process_info.memory_info().rss
+            yield doc_li
+            self.register_batch(num,int(num * avg_size),rss)
+
+    def dict_doc_iterator(self, doc_d):
+        for _id, doc in doc_d.items():
+            doc['_id'] = _id
+            _doc = {}
+            _doc.update(doc)
+            yield _doc
 
     def process(self, doc_d, batch_size):
         self.logger.info("Uploading to the DB...")
@@ -87,54 +136,67 @@ class MergerStorage(BasicStorage):
     It's useful when data is parsed using iterator. A record can be stored in database,
     then later, another record with the same ID is sent to the db, raising a duplicated error.
     These two documents would have been merged before using a 'put all in memory' parser. 
-    Since data is here read line by line, the merge is done while storing
+    Since data is here read line by line, the merge is done while storing: documents
+    with the same ID within a batch are first merged in memory, then documents
+    colliding with already stored ones are fetched at once, merged and replaced
+    with one bulk operation.
     """
 
     merge_func = merge_struct
 
+    def premerge_batch(self, doc_li):
+        """
+        Merge documents sharing the same _id within doc_li. Return the list of
+        merged documents and a dict of "__aslistofdict__" values per _id
+        """
+        docs = {}
+        aslistofdict = {}
+        for d in doc_li:
+            _id = d["_id"]
+            aslist = d.pop("__aslistofdict__",None)
+            aslistofdict[_id] = aslist
+            if _id in docs:
+                d.pop("_id")
+                docs[_id] = self.__class__.merge_func(d, docs[_id], aslistofdict=aslist)
+            else:
+                docs[_id] = d
+        return list(docs.values()), aslistofdict
+
     def process(self, doc_d, batch_size):
         self.logger.info("Uploading to the DB...")
         t0 = time.time()
         tinner = time.time()
-        aslistofdict = None
         total = 0
         for doc_li in self.doc_iterator(doc_d, batch=True, batch_size=batch_size):
             toinsert = len(doc_li)
-            nbinsert = 0
+            docs, aslistofdict = self.premerge_batch(doc_li)
+            # merged within batch
+            nbinsert = toinsert - len(docs)
             self.logger.info("Inserting %s records ... " % toinsert)
             try:
-                bob = self.temp_collection.initialize_unordered_bulk_op()
-                for d in doc_li:
-                    aslistofdict = d.pop("__aslistofdict__",None)
-                    bob.insert(d)
-                res = bob.execute()
-                nbinsert += res["nInserted"]
+                res = self.temp_collection.insert_many(docs, ordered=False)
+                nbinsert += len(res.inserted_ids)
                 self.logger.info("OK [%s]" % timesofar(tinner))
             except BulkWriteError as e:
-                inserted = e.details["nInserted"]
-                nbinsert += inserted
-                self.logger.info("Fixing %d records " % len(e.details["writeErrors"]))
-                ids = [d["op"]["_id"] for d in e.details["writeErrors"]]
+                nbinsert += e.details["nInserted"]
+                errors = [err for err in e.details["writeErrors"] if err["code"] != 11000]
+                if errors:
+                    raise StorageException("%d error(s) while inserting documents, first one: %s" % \
+                            (len(errors),errors[0]["errmsg"]))
+                conflicts = [docs[err["index"]] for err in e.details["writeErrors"]]
+                self.logger.info("Fixing %d records " % len(conflicts))
                 # build hash of existing docs
-                docs = self.temp_collection.find({"_id" : {"$in" : ids}})
-                hdocs = {}
-                for doc in docs:
-                    hdocs[doc["_id"]] = doc
-                bob2 = self.temp_collection.initialize_unordered_bulk_op()
-                for err in e.details["writeErrors"]:
-                    errdoc = err["op"]
-                    existing = hdocs[errdoc["_id"]]
-                    assert "_id" in existing
+                existings = self.temp_collection.find({"_id" : {"$in" : [d["_id"] for d in conflicts]}})
+                hdocs = dict([(doc["_id"],doc) for doc in existings])
+                ops = []
+                for errdoc in conflicts:
                     _id = errdoc.pop("_id")
-                    merged = self.__class__.merge_func(errdoc, existing, aslistofdict=aslistofdict)
-                    bob2.find({"_id" : _id}).update_one({"$set" : merged})
-                    # update previously fetched doc. if several errors are about the same doc id,
-                    # we would't merged things properly without an updated document
-                    assert "_id" in merged
-                    hdocs[_id] = merged
+                    existing = hdocs[_id]
+                    merged = self.__class__.merge_func(errdoc, existing, aslistofdict=aslistofdict[_id])
+                    assert merged["_id"] == _id
+                    ops.append(ReplaceOne({"_id" : _id}, merged))
                     nbinsert += 1
-                
-                res = bob2.execute()
+                self.temp_collection.bulk_write(ops, ordered=False)
                 self.logger.info("OK [%s]" % timesofar(tinner))
             assert nbinsert == toinsert, "nb %s to %s" % (nbinsert,toinsert)
             # end of loop so it counts the time spent in doc_iterator
@@ -172,6 +234,38 @@ class RootKeyMergerStorage(MergerStorage):
 
 
 class IgnoreDuplicatedStorage(BasicStorage):
+    """
+    Store documents, ignoring the ones with an _id already stored. Duplicates
+    are first removed from each batch (first document is kept) and, if id_cache
+    is set (an IDCache containing _ids already found in the destination
+    collection, see biothings.hub.dataindex.idcache, _ids must then be strings),
+    documents found in it are skipped before reaching the database. Remaining
+    duplicates are reported by the server and ignored.
+    id_cache can be passed to an uploader along with the storage class, eg.:
+      storage_class = partial(IgnoreDuplicatedStorage,id_cache=LocalIDCache("mysrc"))
+    """
+
+    id_cache = None
+
+    def __init__(self,db,dest_col_name,logger=logging,id_cache=None):
+        super(IgnoreDuplicatedStorage,self).__init__(db,dest_col_name,logger)
+        if id_cache is not None:
+            self.id_cache = id_cache
+
+    def dedup_batch(self, doc_li):
+        """Return documents from doc_li with unique _ids, not found in id_cache"""
+        seen = set()
+        docs = []
+        for d in doc_li:
+            if d["_id"] in seen:
+                continue
+            seen.add(d["_id"])
+            docs.append(d)
+        if self.id_cache is not None:
+            found = self.id_cache.contains(seen)
+            if found:
+                docs = [d for d in docs if not d["_id"] in found]
+        return docs
 
     def process(self, iterable, batch_size):
         self.logger.info("Uploading to the DB...")
@@ -179,21 +273,25 @@ class IgnoreDuplicatedStorage(BasicStorage):
         tinner = time.time()
         total = 0
         for doc_li in self.doc_iterator(iterable, batch=True, batch_size=batch_size):
-            try:
-                bob = self.temp_collection.initialize_unordered_bulk_op()
-                for d in doc_li:
-                    bob.insert(d)
-                res = bob.execute()
-                total += res['nInserted']
-                self.logger.info("Inserted %s records [%s]" % (res['nInserted'], timesofar(tinner)))
-            except BulkWriteError as e:
-                self.logger.info("Inserted %s records, ignoring %d [%s]" % (e.details['nInserted'],len(e.details["writeErrors"]),timesofar(tinner)))
-            except Exception as e:
-                raise
+            docs = self.dedup_batch(doc_li)
+            inserted = len(docs)
+            if docs:
+                try:
+                    self.temp_collection.insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    inserted = e.details["nInserted"]
+                    # only duplicated key errors (11000) can be ignored
+                    errors = [err for err in e.details["writeErrors"] if err["code"] != 11000]
+                    if errors:
+                        raise StorageException("%d error(s) while inserting documents, first one: %s" % \
+                                (len(errors),errors[0]["errmsg"]))
+            total += inserted
+            self.logger.info("Inserted %s records, ignoring %d [%s]" % \
+                    (inserted,len(doc_li) - inserted,timesofar(tinner)))
             tinner = time.time()
         self.logger.info('Done[%s]' % timesofar(t0))
 
-        return total 
+        return total
 
 class NoBatchIgnoreDuplicatedStorage(BasicStorage):
     """
@@ -4,11 +4,13 @@ import asyncio
 import logging as loggingmod
 from functools import wraps, partial
 import inspect
+from pymongo import IndexModel
 
-from biothings.utils.common import get_timestamp, get_random_string, timesofar, iter_n
+from biothings.utils.common import get_timestamp, get_random_string, timesofar, iter_n, \
+                                   COMPRESSED_EXTENSIONS, sizeof_fmt
 from biothings.utils.hub_db import get_src_dump, get_src_master
-from biothings.utils.mongo import get_src_conn
-from biothings.utils.dataload import merge_struct
+from biothings.utils.mongo import get_src_conn, get_src_db
+from biothings.utils.dataload import merge_struct, file_byte_ranges
 from biothings.utils.manager import BaseSourceManager, \
                                     ManagerError, ResourceNotFound
 from .storage import IgnoreDuplicatedStorage, MergerStorage, \
@@ -32,7 +34,8 @@ def upload_worker(name, storage_class, loaddata_func, col_name,
     Pickable job launcher, typically running from multiprocessing.
     storage_class will instanciate with col_name, the destination 
     collection name. loaddata_func is the parsing/loading function,
-    called with *args
+    called with *args. Return a tuple (number of stored documents, batching
+    stats from storage, see BaseStorage.doc_iterator())
     """
     data = []
     try:
@@ -42,7 +45,8 @@ def upload_worker(name, storage_class, loaddata_func, col_name,
             storage = type(klass_name,storage_class,{})(None,col_name,loggingmod)
         else:
             storage = storage_class(None,col_name,loggingmod)
-        return storage.process(data,batch_size)
+        cnt = storage.process(data,batch_size)
+        return (cnt,getattr(storage,"stats",None) or {})
     except Exception as e:
         logger_name = "%s_batch_%s" % (name,batch_num)
         logger,logfile = get_logger(logger_name, config.LOG_FOLDER)
@@ -65,6 +69,48 @@ def upload_worker(name, storage_class, loaddata_func, col_name,
         raise
 
 
+def worker_result(res):
+    """
+    Return a tuple (count,stats) from upload_worker() result "res" (a count
+    alone is accepted too, stats are then empty), None if it's not a valid result
+    """
+    if type(res) == int:
+        return (res,{})
+    if type(res) == tuple and len(res) == 2 and type(res[0]) == int:
+        return res
+
+
+# number of _id per document in file map collections
+FILEMAP_CHUNK_SIZE = 10000
+
+def filemap_collection_name(col_name):
+    """
+    Name of the collection holding, for a file-partitionable source, which
+    documents (_id) come from which file (see BaseSourceUploader.file_partitionable).
+    Prefixed so it doesn't match source collection name patterns.
+    """
+    return "filemap_%s" % col_name
+
+
+def track_file_ids(loaddata_func, filemap_col_name, filename, *args):
+    """
+    Pickable loading function wrapper: call loaddata_func(*args) and record
+    _id of returned documents as coming from filename, into filemap_col_name
+    collection (one doc per chunk of ids: {"file" : filename, "ids" : [...]})
+    """
+    data = loaddata_func(*args)
+    filemap = get_src_db()[filemap_col_name]
+    if isinstance(data, dict):
+        for ids in iter_n(data.keys(), FILEMAP_CHUNK_SIZE):
+            filemap.insert_one({"file" : filename, "ids" : list(ids)})
+        return data
+    def tracked():
+        for docs in iter_n(data, FILEMAP_CHUNK_SIZE):
+            filemap.insert_one({"file" : filename, "ids" : [d["_id"] for d in docs]})
+            yield from docs
+    return tracked()
+
+
 class BaseSourceUploader(object):
     '''
     Default datasource uploader. Database storage can be done
@@ -92,6 +138,19 @@ class BaseSourceUploader(object):
 
     keep_archive = 10 # number of archived collection to keep. Oldest get dropped first.
 
+    # if True, files in data folder can be parsed independently, documents found
+    # in one file are not found in any other one. Coupled with a dumper tracking file
+    # changes (see BaseDumper.TRACK_FILE_CHANGES), only new/modified files are parsed
+    # again, documents from unchanged files being copied from the current collection.
+    # Requires a ParallelizedSourceUploader, with the file path as first element of
+    # each job's arguments (see jobs())
+    file_partitionable = False
+
+    # indexes built on temp collection, concurrently, before it's renamed (see build_indexes()).
+    # Each element is either passed to pymongo's create_index() (key name or list
+    # of (key,direction) tuples, built in background) or is a pymongo.IndexModel
+    indexes = []
+
     def __init__(self, db_conn_info, data_root, collection_name=None, log_folder=None, *args, **kwargs):
         """db_conn_info is a database connection info tuple (host,port) to fetch/store 
         information about the datasource's state data_root is the root folder containing
@@ -114,6 +173,8 @@ class BaseSourceUploader(object):
         self.data_folder = None
         self.prepared = False
         self.src_doc = {} # will hold src_dump's doc
+        self.batch_stats = {} # aggregated from upload workers
+        self.index_stats = [] # see build_indexes()
 
     @property
     def fullname(self):
@@ -257,8 +318,8 @@ class BaseSourceUploader(object):
         # archived collections look like...
         prefix = "%s_archive_" % self.name
         cols = [c for c in self.db.collection_names() if c.startswith(prefix)]
-        tmp_prefix = "%s_temp_" % self.name
-        tmp_cols = [c for c in self.db.collection_names() if c.startswith(tmp_prefix)]
+        tmp_prefixes = ("%s_temp_" % self.name,filemap_collection_name("%s_temp_" % self.name))
+        tmp_cols = [c for c in self.db.collection_names() if c.startswith(tmp_prefixes)]
         # timestamp is what's after _archive_, YYYYMMDD, so we can sort it safely
         cols = sorted(cols,reverse=True)
         to_drop = cols[self.keep_archive:] + tmp_cols
@@ -270,16 +331,50 @@ class BaseSourceUploader(object):
         '''after a successful loading, rename temp_collection to regular collection name,
            and renaming existing collection to a temp name for archiving purpose.
         '''
-        if self.temp_collection_name and self.db[self.temp_collection_name].count() > 0:
+        if self.temp_collection_name and \
+                self.db[self.temp_collection_name].find_one({},{"_id" : 1}) is not None:
             if self.collection_name in self.db.collection_names():
                 # renaming existing collections
                 new_name = '_'.join([self.collection_name, 'archive', get_timestamp(), get_random_string()])
                 self.collection.rename(new_name, dropTarget=True)
             self.logger.info("Renaming collection '%s' to '%s'" % (self.temp_collection_name,self.collection_name))
             self.db[self.temp_collection_name].rename(self.collection_name)
+            temp_filemap = filemap_collection_name(self.temp_collection_name)
+            if temp_filemap in self.db.collection_names():
+                self.db[temp_filemap].rename(filemap_collection_name(self.collection_name),dropTarget=True)
         else:
             raise ResourceError("No temp collection (or it's empty)")
 
+    def create_index(self, col, spec):
+        """Create index from spec (see indexes) on collection col,
+        return build information"""
+        t0 = time.time()
+        if isinstance(spec,IndexModel):
+            name = col.create_indexes([spec])[0]
+        else:
+            name = col.create_index(spec,background=True)
+        self.logger.info("Index '%s' created on '%s' [%s]" % (name,col.name,timesofar(t0)))
+        return {"name" : name, "time" : timesofar(t0), "time_in_s" : round(time.time() - t0,0)}
+
+    @asyncio.coroutine
+    def build_indexes(self, job_manager):
+        """
+        Build indexes declared in "indexes" on temp collection, concurrently
+        (one thread each), so the collection is indexed when it's renamed.
+        """
+        self.index_stats = []
+        if not self.__class__.indexes:
+            return
+        col = self.db[self.temp_collection_name]
+        jobs = []
+        for spec in self.__class__.indexes:
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "index"
+            pinfo["description"] = str(spec)
+            job = yield from job_manager.defer_to_thread(pinfo,partial(self.create_index,col,spec))
+            jobs.append(job)
+        self.index_stats = yield from asyncio.gather(*jobs)
+
     def post_update_data(self, steps, force, batch_size, job_manager, **kwargs):
         """Override as needed to perform operations after
            data has been uploaded"""
@@ -309,14 +404,30 @@ class BaseSourceUploader(object):
                 )
         def uploaded(f):
             nonlocal got_error
-            if type(f.result()) != int:
+            if worker_result(f.result()) is None:
                 got_error = Exception("upload error (should have a int as returned value got %s" % repr(f.result()))
         job.add_done_callback(uploaded)
-        yield from job
+        res = yield from job
         if got_error:
             raise got_error
+        self.update_batch_stats(worker_result(res)[1],1)
+        yield from self.build_indexes(job_manager)
         self.switch_collection()
 
+    def update_batch_stats(self, stats, batch_num):
+        """
+        Aggregate batching stats returned by upload worker for job batch_num:
+        stats for each stored batch, along with max values over all of them
+        """
+        batches = [dict(b,job=batch_num) for b in stats.get("batches",[])]
+        if not batches:
+            return
+        self.batch_stats.setdefault("batches",[]).extend(batches)
+        self.batch_stats["num_batches"] = len(self.batch_stats["batches"])
+        self.batch_stats["peak_rss"] = max([self.batch_stats.get("peak_rss",0)] + [b["peak_rss"] for b in batches])
+        self.batch_stats["max_batch_bytes"] = max([self.batch_stats.get("max_batch_bytes",0)] + \
+                                                  [b["est_bytes"] for b in batches])
+
     def generate_doc_src_master(self):
         _doc = {"_id": str(self.name),
                 "name": self.regex_name and self.regex_name or str(self.name),
@@ -359,6 +470,10 @@ class BaseSourceUploader(object):
             upload_info['pid'] = os.getpid()
             upload_info['logfile'] = self.logfile
             upload_info['started_at'] = datetime.datetime.now()
+            # files processed during previous upload, kept until this one succeeds
+            files = self.src_doc.get(subkey,{}).get("jobs",{}).get(self.name,{}).get("files")
+            if files:
+                upload_info["files"] = files
             self.src_dump.update_one({"_id":self.main_source},{"$set" : {job_key : upload_info}})
         else:
             # get release that's been uploaded from download part
@@ -411,6 +526,7 @@ class BaseSourceUploader(object):
             if update_data:
                 # unsync to make it pickable
                 state = self.unprepare()
+                self.batch_stats = {}
                 cnt = yield from self.update_data(batch_size, job_manager, **kwargs)
                 self.prepare(state)
             if update_master:
@@ -433,7 +549,18 @@ class BaseSourceUploader(object):
             cnt = cnt or self.db[self.collection_name].count()
             if clean_archives:
                 self.clean_archived_collections()
-            self.register_status("success",count=cnt)
+            extra = {}
+            if update_data and self.__class__.file_partitionable:
+                # files the collection now reflects
+                extra["files"] = self.src_doc.get("download",{}).get("files")
+            if self.batch_stats:
+                self.logger.info("Batch stats: %s batches, peak RSS %s, max batch size %s (estimated)" % \
+                        (self.batch_stats["num_batches"],sizeof_fmt(self.batch_stats["peak_rss"]),
+                         sizeof_fmt(self.batch_stats["max_batch_bytes"])))
+                extra["batch_stats"] = self.batch_stats
+            if update_data and self.index_stats:
+                extra["indexes"] = self.index_stats
+            self.register_status("success",count=cnt,**extra)
             self.logger.info("success %s" % strargs,extra={"notify":True})
         except Exception as e:
             self.logger.exception("failed %s: %s" % (strargs,e),extra={"notify":True})
@@ -530,11 +657,82 @@ class ParallelizedSourceUploader(BaseSourceUploader):
         """
         raise NotImplementedError("implement me in subclass")
 
+    def job_file(self, args):
+        """
+        Return the file processed by a job (see jobs()), relative to data folder.
+        Used by file-partitionable uploaders, default to job's first argument.
+        """
+        path = args[0]
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.data_folder)
+        return os.path.normpath(path)
+
+    def get_file_changes(self):
+        """
+        Compare files from latest dump with the ones processed during previous
+        upload. Return a tuple (unchanged,removed) of sets of paths, or None if
+        all files need to be processed.
+        """
+        current = self.src_doc.get("download",{}).get("files")
+        uploaded = self.src_doc.get("upload",{}).get("jobs",{}).get(self.name,{}).get("files")
+        if not self.__class__.file_partitionable or not current or not uploaded:
+            return None
+        cols = self.db.collection_names()
+        if not self.collection_name in cols or \
+                not filemap_collection_name(self.collection_name) in cols:
+            return None
+        current = dict([(f["path"],f["hash"]) for f in current])
+        uploaded = dict([(f["path"],f["hash"]) for f in uploaded])
+        unchanged = set([p for p in current if uploaded.get(p) == current[p]])
+        removed = set(uploaded) - set(current)
+        return (unchanged,removed)
+
+    def copy_unchanged_documents(self, purged):
+        """
+        Copy current collection and its file map to temp ones (server-side),
+        except documents coming from files listed in purged. Indexes aren't
+        copied ($out), declared ones (see indexes) are built on temp collection
+        by build_indexes() before it's switched.
+        """
+        filemap = self.db[filemap_collection_name(self.collection_name)]
+        temp_col = self.db[self.temp_collection_name]
+        self.collection.aggregate([{"$out" : self.temp_collection_name}])
+        filemap.aggregate([{"$match" : {"file" : {"$nin" : list(purged)}}},
+                           {"$out" : filemap_collection_name(self.temp_collection_name)}])
+        cnt = 0
+        for doc in filemap.find({"file" : {"$in" : list(purged)}}):
+            cnt += temp_col.delete_many({"_id" : {"$in" : doc["ids"]}}).deleted_count
+        self.logger.info("%d document(s) copied from '%s', %d removed from changed files" % \
+                (temp_col.count(),self.collection_name,cnt))
+
     @asyncio.coroutine
     def update_data(self, batch_size, job_manager=None):
         jobs = []
         job_params = self.jobs()
         got_error = False
+        # file processed by each job, if tracked
+        job_files = [None] * len(job_params)
+        changes = None
+        if self.__class__.file_partitionable:
+            job_files = [self.job_file(args) for args in job_params]
+            changes = self.get_file_changes()
+            if changes:
+                unchanged,removed = changes
+                todo = [i for i,f in enumerate(job_files) if not f in unchanged]
+                self.logger.info("Incremental upload: %d file(s) to process, " % len(todo) + \
+                        "%d unchanged, %d removed" % (len(job_params) - len(todo),len(removed)))
+                if not todo and not removed:
+                    self.logger.info("No file changed, current collection is kept")
+                    return
+                # server-side copy can be long, don't block the hub
+                pinfo = self.get_pinfo()
+                pinfo["step"] = "copy_unchanged"
+                job = yield from job_manager.defer_to_thread(pinfo,
+                        partial(self.copy_unchanged_documents,set([job_files[i] for i in todo]) | removed))
+                yield from job
+                job_params = [job_params[i] for i in todo]
+                job_files = [job_files[i] for i in todo]
+            self.db[filemap_collection_name(self.temp_collection_name)].create_index("file")
         # make sure we don't use any of self reference in the following loop
         fullname = copy.deepcopy(self.fullname)
         storage_class = copy.deepcopy(self.__class__.storage_class)
@@ -548,10 +746,14 @@ class ParallelizedSourceUploader(BaseSourceUploader):
         # subtmitted to job_manager causing a error due to that logger attribute)
         # in other words: once unprepared, self should never be changed until all 
         # jobs are submitted
-        for bnum,args in enumerate(job_params):
+        for bnum,(args,job_file) in enumerate(zip(job_params,job_files)):
             pinfo = self.get_pinfo()
             pinfo["step"] = "update_data"
             pinfo["description"] = "%s" % str(args)
+            loading_func = load_data
+            if job_file:
+                loading_func = partial(track_file_ids,load_data,
+                        filemap_collection_name(temp_collection_name),job_file)
             job = yield from job_manager.defer_to_process(
                     pinfo,
                     partial(
@@ -562,7 +764,7 @@ class ParallelizedSourceUploader(BaseSourceUploader):
                         # storage class
                         storage_class,
                         # loading func
-                        load_data,
+                        loading_func,
                         # dest collection name
                         temp_collection_name,
                         # batch size
@@ -584,20 +786,61 @@ class ParallelizedSourceUploader(BaseSourceUploader):
                 # (see comment above, before loop)
                 nonlocal got_error
                 try:
-                    if type(f.result()) != int:
+                    if worker_result(f.result()) is None:
                         got_error = Exception("Batch #%s failed while uploading source '%s' [%s]" % (batch_num, name, f.result()))
                 except Exception as e:
                     got_error = e
 
             job.add_done_callback(partial(batch_uploaded,name=fullname,batch_num=bnum))
         if jobs:
-            yield from asyncio.gather(*jobs)
+            results = yield from asyncio.gather(*jobs)
             if got_error:
                 raise got_error
+            for bnum,res in enumerate(results):
+                self.update_batch_stats(worker_result(res)[1],bnum)
+        if jobs or changes:
+            yield from self.build_indexes(job_manager)
             self.switch_collection()
             self.clean_archived_collections()
 
 
+class ChunkedFileSourceUploader(ParallelizedSourceUploader):
+    """
+    Parse big line-oriented files using multiple workers: each file is split
+    in byte ranges aligned on lines, parsed in parallel and stored in the same
+    temp collection. load_data(infile, byte_range) is called for each chunk,
+    byte_range being a (start, end) tuple (or None if the whole file must be
+    parsed, eg. compressed files), which can be passed to tabfile_feeder().
+    Records must be line-oriented: tabfile_feeder() raises an error (and the
+    upload fails) if a quoted field spans lines.
+    """
+
+    # approximate size of chunks (bytes)
+    chunk_size = 64 * 1024 * 1024
+
+    def input_files(self):
+        """Return list of files (path) to parse"""
+        raise NotImplementedError("implement me in subclass")
+
+    def jobs(self):
+        jobs = []
+        for infile in self.input_files():
+            # compressed files can't be split (see anyfile())
+            if not isinstance(infile, str) or not os.path.exists(infile) or \
+                    os.path.splitext(infile)[1] in COMPRESSED_EXTENSIONS + [".zip"]:
+                jobs.append((infile, None))
+                continue
+            num_chunks = max(1, os.path.getsize(infile) // self.__class__.chunk_size)
+            for byte_range in file_byte_ranges(infile, num_chunks):
+                jobs.append((infile, byte_range))
+        self.logger.info("%d chunk(s) to parse from %d file(s)" % \
+                (len(jobs), len(set([j[0] for j in jobs]))))
+        return jobs
+
+    def load_data(self, infile, byte_range):
+        raise NotImplementedError("implement me in subclass")
+
+
 class NoDataSourceUploader(BaseSourceUploader):
     """
     This uploader won't upload any data and won't even assume
@@ -700,7 +943,12 @@ class UploaderManager(BaseSourceManager):
     def poll(self,state,func):
         super(UploaderManager,self).poll(state,func,col=get_src_dump())
 
-    def source_info(self,source=None):
+    def source_info(self,source=None,projection=None):
+        """
+        Return src_dump documents of registered uploaders (or only "source"),
+        completed with uploader classes information. An optional projection
+        can be passed to only fetch some of src_dump fields.
+        """
         src_dump = get_src_dump()
         src_ids = list(self.register.keys())
         if source:
@@ -709,7 +957,7 @@ class UploaderManager(BaseSourceManager):
             else:
                 return None
         res = []
-        cur = src_dump.find({"_id":{"$in":src_ids}})
+        cur = src_dump.find({"_id":{"$in":src_ids}},projection)
         bysrcs = {}
         [bysrcs.setdefault(src["_id"],src) for src in cur]
         for _id in src_ids:
@@ -63,6 +63,7 @@ class BaseAssistant(object):
     def __init__(self, url):
         self.url = url
         self._plugin_name = None
+        self.requirements_installed = False
         self.logfile = None
         self.setup_log()
 
@@ -88,6 +89,14 @@ class BaseAssistant(object):
         """Return true if assistant can handle the code"""
         raise NotImplementedError("implement in subclass")
 
+    def manifest_key(self, data_folder):
+        """
+        Return a key identifying the version of the manifest found in data_folder
+        (here, manifest file's mtime). A cached manifest is used as long as
+        this key doesn't change.
+        """
+        return os.path.getmtime(os.path.join(data_folder,"manifest.json"))
+
     def load_manifest(self):
         dp = get_data_plugin()
         p = dp.find_one({"_id":self.plugin_name})
@@ -100,7 +109,15 @@ class BaseAssistant(object):
             mf = os.path.join(df,"manifest.json")
             if os.path.exists(mf):
                 try:
-                    manifest = json.load(open(mf))
+                    key = self.manifest_key(df)
+                    cached = p.get("manifest") or {}
+                    if cached.get("key") == key:
+                        manifest = cached["content"]
+                    else:
+                        manifest = json.load(open(mf))
+                        self.validate_manifest(manifest)
+                        dp.update({"_id":self.plugin_name},
+                                  {"$set":{"manifest":{"key":key,"content":manifest}}})
                     self.logger.debug("Loading manifest: %s" % pprint.pformat(manifest))
                     self.interpret_manifest(manifest)
                 except Exception as e:
@@ -118,19 +135,19 @@ class BaseAssistant(object):
             klass.data_plugin_error = error
         pass
 
-    def interpret_manifest(self, manifest):
-        # dumper section: generate 
-        dumper_class = None
-        assisted_dumper_class = None
-        assisted_uploader_class = None
-        # start with requirements before importing anything
-        if manifest.get("requires"):
-            reqs = manifest["requires"]
-            if not type(reqs) == list:
-                reqs = [reqs]
-            for req in reqs:
-                self.logger.info("Install requirement '%s'" % req)
-                subprocess.check_call([sys.executable, '-m', 'pip', 'install', req])
+    def check_func_path(self, section, key):
+        try:
+            mod,func = section[key].split(":")
+        except ValueError as e:
+            raise AssistantException("'%s' must be defined as 'module:func' but got: '%s'" % \
+                    (key,section[key]))
+
+    def validate_manifest(self, manifest):
+        """
+        Check manifest's structure, without importing anything from the plugin
+        (it's done when generated classes are first used, see materialize_dumper()
+        and materialize_uploader())
+        """
         if manifest.get("dumper"):
             if manifest["dumper"].get("data_url"):
                 if not type(manifest["dumper"]["data_url"]) is list:
@@ -143,113 +160,165 @@ class BaseAssistant(object):
                     raise AssistantException("Manifest specifies URLs of different types (%s), " % schemes + \
                             "expecting only one")
                 scheme = schemes.pop()
-                klass = manifest["dumper"].get("class")
-                if klass:
-                    dumper_class = get_class_from_classpath(klass)
-                else:
-                    dumper_class = self.dumper_registry.get(scheme)
-                if not dumper_class:
+                if not manifest["dumper"].get("class") and not self.dumper_registry.get(scheme):
                     raise AssistantException("No dumper class registered to handle scheme '%s'" % scheme)
-                confdict = getattr(self,"_dict_for_%s" % scheme)(durls)
-                if manifest.get("__metadata__"):
-                    confdict["__metadata__"] = {"src_meta" : manifest.get("__metadata__")}
-                assisted_dumper_class = type("AssistedDumper_%s" % self.plugin_name,(AssistedDumper,dumper_class,),confdict)
-                if manifest["dumper"].get("uncompress"):
-                    assisted_dumper_class.UNCOMPRESS = True
-                self.__class__.dumper_manager.register_classes([assisted_dumper_class])
-                # register class in module so it can be pickled easily
-                sys.modules["biothings.hub.dataplugin.assistant"].__dict__["AssistedDumper_%s" % self.plugin_name] = assisted_dumper_class
             else:
                 raise AssistantException("Invalid manifest, expecting 'data_url' key in 'dumper' section")
-
-            assert assisted_dumper_class
             if manifest["dumper"].get("release"):
-                try:
-                    mod,func = manifest["dumper"].get("release").split(":")
-                except ValueError as e:
-                    raise AssistantException("'release' must be defined as 'module:parser_func' but got: '%s'" % \
-                            manifest["dumper"]["release"])
-                try:
-                    modpath = self.plugin_name + "." + mod
-                    pymod = importlib.import_module(modpath)
-                    # reload in case we need to refresh plugin's code
-                    importlib.reload(pymod)
-                    assert func in dir(pymod), "%s not found in module %s" % (func,pymod)
-                    get_release_func = getattr(pymod,func)
-                    # replace existing method to connect custom release setter
-                    def set_release(self):
-                        self.release = get_release_func(self)
-                    assisted_dumper_class.set_release = set_release
-                except Exception as e:
-                    self.logger.exception("Error loading plugin: %s" % e)
-                    raise AssistantException("Can't interpret manifest: %s" % e)
+                self.check_func_path(manifest["dumper"],"release")
         if manifest.get("uploader"):
             if manifest["uploader"].get("parser"):
-                try:
-                    mod,func = manifest["uploader"].get("parser").split(":")
-                except ValueError as e:
-                    raise AssistantException("'parser' must be defined as 'module:parser_func' but got: '%s'" % \
-                            manifest["uploader"]["parser"])
-                try:
-                    modpath = self.plugin_name + "." + mod
-                    pymod = importlib.import_module(modpath)
-                    # reload in case we need to refresh plugin's code
-                    importlib.reload(pymod)
-                    assert func in dir(pymod)
-                    parser_func = getattr(pymod,func)
-                    ondups = manifest["uploader"].get("on_duplicates")
-                    if ondups and ondups != "error":
-                        if ondups == "merge":
-                            storage_class = MergerStorage
-                        elif ondups == "ignore":
-                            storage_class= IgnoreDuplicatedStorage
-                    else:
-                        storage_class = BasicStorage
-                    if manifest["uploader"].get("ignore_duplicates"):
-                        raise AssistantException("'ignore_duplicates' key not supported anymore, " +
-                                                 "use 'on_duplicates' : 'error|ignore|merge'")
-                    confdict = {"name":self.plugin_name,"storage_class":storage_class, "parser_func":parser_func}
-                    if manifest["uploader"].get("keylookup"):
-                        assert self.__class__.keylookup, "Plugin %s needs _id conversion " % self.plugin_name + \
-                                                         "but no keylookup instance was found"
-                        self.logger.info("Keylookup conversion required: %s" % manifest["uploader"]["keylookup"])
-                        confdict["idconverter"] = self.__class__.keylookup(**manifest["uploader"]["keylookup"])
-                    if manifest.get("__metadata__"):
-                        confdict["__metadata__"] = {"src_meta" : manifest.get("__metadata__")}
-
-                    if manifest["uploader"].get("parallelizer"):
-                        assisted_uploader_class = type("AssistedUploader_%s" % self.plugin_name,(AssistedUploader,ParallelizedSourceUploader,),confdict)
-                        try:
-                            mod,func = manifest["uploader"].get("parallelizer").split(":")
-                        except ValueError as e:
-                            raise AssistantException("'parallelizer' must be defined as 'module:parallelizer_func' but got: '%s'" % \
-                                    manifest["uploader"]["parallelizer"])
-                        try:
-                            modpath = self.plugin_name + "." + mod
-                            pymod = importlib.import_module(modpath)
-                            # reload in case we need to refresh plugin's code
-                            importlib.reload(pymod)
-                            assert func in dir(pymod), "%s not found in module %s" % (func,pymod)
-                            jobs_func = getattr(pymod,func)
-                            # replace existing method to connect jobs parallelized func
-                            assisted_uploader_class.jobs = jobs_func
-                        except Exception as e:
-                            self.logger.exception("Error loading plugin: %s" % e)
-                            raise AssistantException("Can't interpret manifest: %s" % e)
-                    else:
-                        assisted_uploader_class = type("AssistedUploader_%s" % self.plugin_name,(AssistedUploader,),confdict)
-                    self.__class__.uploader_manager.register_classes([assisted_uploader_class])
-                    # register class in module so it can be pickled easily
-                    sys.modules["biothings.hub.dataplugin.assistant"].__dict__["AssistedUploader_%s" % self.plugin_name] = assisted_uploader_class
-                except Exception as e:
-                    self.logger.exception("Error loading plugin: %s" % e)
-                    raise AssistantException("Can't interpret manifest: %s" % e)
+                self.check_func_path(manifest["uploader"],"parser")
+                if manifest["uploader"].get("ignore_duplicates"):
+                    raise AssistantException("'ignore_duplicates' key not supported anymore, " +
+                                             "use 'on_duplicates' : 'error|ignore|merge'")
+                ondups = manifest["uploader"].get("on_duplicates")
+                if ondups and not ondups in ("error","ignore","merge"):
+                    raise AssistantException("Invalid 'on_duplicates' value '%s', " % ondups + \
+                                             "expecting 'error|ignore|merge'")
+                if manifest["uploader"].get("keylookup"):
+                    assert self.__class__.keylookup, "Plugin %s needs _id conversion " % self.plugin_name + \
+                                                     "but no keylookup instance was found"
+                if manifest["uploader"].get("parallelizer"):
+                    self.check_func_path(manifest["uploader"],"parallelizer")
             else:
                 raise AssistantException("Invalid manifest, expecting 'parser' key in 'uploader' section")
 
+    def interpret_manifest(self, manifest):
+        """
+        Generate and register dumper/uploader classes from a validated manifest.
+        Plugin's code isn't imported yet, classes are materialized on first use,
+        so the cost of loading a plugin doesn't depend on its code.
+        """
+        if manifest.get("dumper"):
+            durls = manifest["dumper"]["data_url"]
+            if not type(durls) is list:
+                durls = [durls]
+            scheme = urllib.parse.urlsplit(durls[0]).scheme
+            klass = manifest["dumper"].get("class")
+            if klass:
+                # custom dumper class is needed right now (it's a base class),
+                # and may depend on requirements
+                self.install_requirements(manifest)
+                dumper_class = get_class_from_classpath(klass)
+            else:
+                dumper_class = self.dumper_registry[scheme]
+            confdict = getattr(self,"_dict_for_%s" % scheme)(durls)
+            if manifest.get("__metadata__"):
+                confdict["__metadata__"] = {"src_meta" : manifest.get("__metadata__")}
+            confdict["assistant"] = self
+            confdict["manifest"] = manifest
+            assisted_dumper_class = type("AssistedDumper_%s" % self.plugin_name,(AssistedDumper,dumper_class,),confdict)
+            if manifest["dumper"].get("uncompress"):
+                assisted_dumper_class.UNCOMPRESS = True
+            self.__class__.dumper_manager.register_classes([assisted_dumper_class])
+            # register class in module so it can be pickled easily
+            sys.modules["biothings.hub.dataplugin.assistant"].__dict__["AssistedDumper_%s" % self.plugin_name] = assisted_dumper_class
+        if manifest.get("uploader"):
+            ondups = manifest["uploader"].get("on_duplicates")
+            if ondups == "merge":
+                storage_class = MergerStorage
+            elif ondups == "ignore":
+                storage_class = IgnoreDuplicatedStorage
+            else:
+                storage_class = BasicStorage
+            confdict = {"name":self.plugin_name,"storage_class":storage_class,
+                        "assistant":self,"manifest":manifest}
+            if manifest.get("__metadata__"):
+                confdict["__metadata__"] = {"src_meta" : manifest.get("__metadata__")}
+            if manifest["uploader"].get("parallelizer"):
+                assisted_uploader_class = type("AssistedUploader_%s" % self.plugin_name,(AssistedUploader,ParallelizedSourceUploader,),confdict)
+            else:
+                assisted_uploader_class = type("AssistedUploader_%s" % self.plugin_name,(AssistedUploader,),confdict)
+            self.__class__.uploader_manager.register_classes([assisted_uploader_class])
+            # register class in module so it can be pickled easily
+            sys.modules["biothings.hub.dataplugin.assistant"].__dict__["AssistedUploader_%s" % self.plugin_name] = assisted_uploader_class
+
+    def install_requirements(self, manifest):
+        if self.requirements_installed or not manifest.get("requires"):
+            return
+        reqs = manifest["requires"]
+        if not type(reqs) == list:
+            reqs = [reqs]
+        for req in reqs:
+            self.logger.info("Install requirement '%s'" % req)
+            subprocess.check_call([sys.executable, '-m', 'pip', 'install', req])
+        self.requirements_installed = True
+
+    def get_plugin_func(self, func_path, reload=True):
+        mod,func = func_path.split(":")
+        modpath = self.plugin_name + "." + mod
+        pymod = importlib.import_module(modpath)
+        if reload:
+            # reload in case we need to refresh plugin's code
+            importlib.reload(pymod)
+        assert func in dir(pymod), "%s not found in module %s" % (func,pymod)
+        return getattr(pymod,func)
+
+    def materialize_dumper(self, klass):
+        """
+        Install requirements and import plugin's code needed by dumper class
+        'klass' generated from manifest (called on first use)
+        """
+        try:
+            self.install_requirements(klass.manifest)
+            if klass.manifest["dumper"].get("release"):
+                get_release_func = self.get_plugin_func(klass.manifest["dumper"]["release"])
+                # replace existing method to connect custom release setter
+                def set_release(self):
+                    self.release = get_release_func(self)
+                klass.set_release = set_release
+        except Exception as e:
+            self.logger.exception("Error loading plugin: %s" % e)
+            self.invalidate_plugin("Error loading plugin: %s" % e)
+            raise AssistantException("Can't interpret manifest: %s" % e)
+
+    def materialize_uploader(self, klass):
+        """
+        Install requirements and import plugin's code needed by uploader class
+        'klass' generated from manifest (called on first use, in the hub process)
+        """
+        try:
+            self.install_requirements(klass.manifest)
+            self.resolve_parser(klass,reload=True)
+            upmanifest = klass.manifest["uploader"]
+            if upmanifest.get("parallelizer"):
+                # replace existing method to connect jobs parallelized func
+                klass.jobs = self.get_plugin_func(upmanifest["parallelizer"])
+        except Exception as e:
+            self.logger.exception("Error loading plugin: %s" % e)
+            self.invalidate_plugin("Error loading plugin: %s" % e)
+            raise AssistantException("Can't interpret manifest: %s" % e)
+
+    def resolve_parser(self, klass, reload=False):
+        """
+        Set parser function (and _id converter if any) to uploader class 'klass'.
+        This is all a worker process needs: requirements were installed (and plugin
+        validated) by the hub process, when the class was materialized.
+        """
+        upmanifest = klass.manifest["uploader"]
+        klass.parser_func = self.get_plugin_func(upmanifest["parser"],reload=reload)
+        if upmanifest.get("keylookup"):
+            self.logger.info("Keylookup conversion required: %s" % upmanifest["keylookup"])
+            klass.idconverter = self.__class__.keylookup(**upmanifest["keylookup"])
+
 
 class AssistedDumper(object):
     UNCOMPRESS = False
+    assistant = None # assistant which generated this class
+    manifest = None
+    materialized = False
+
+    @classmethod
+    def materialize(klass):
+        if not klass.materialized and klass.assistant:
+            klass.assistant.materialize_dumper(klass)
+            klass.materialized = True
+
+    def __init__(self, *args, **kwargs):
+        self.__class__.materialize()
+        super(AssistedDumper,self).__init__(*args,**kwargs)
+
     def post_dump(self, *args, **kwargs):
         if self.__class__.UNCOMPRESS:
             self.logger.info("Uncompress all archive files in '%s'" % self.new_data_folder)
@@ -263,8 +332,27 @@ class AssistedUploader(BaseSourceUploader):
     storage_class = None
     parser_func = None
     idconverter = transparent
+    assistant = None # assistant which generated this class
+    manifest = None
+    materialized = False
+
+    @classmethod
+    def materialize(klass):
+        if not klass.materialized and klass.assistant:
+            klass.assistant.materialize_uploader(klass)
+            klass.materialized = True
+
+    def __init__(self, *args, **kwargs):
+        self.__class__.materialize()
+        super(AssistedUploader,self).__init__(*args,**kwargs)
 
     def load_data(self,data_folder):
+        # class may not be materialized in this process (worker forked before
+        # class was first used): the hub did it, only parser is missing here
+        if self.__class__.parser_func is None and self.__class__.assistant:
+            # requirements may have been installed after worker was forked
+            importlib.invalidate_caches()
+            self.__class__.assistant.resolve_parser(self.__class__)
         self.logger.info("Load data from directory: '%s'" % data_folder)
         return self.__class__.idconverter(self.__class__.parser_func)(data_folder)
 
@@ -291,6 +379,27 @@ class GithubAssistant(BaseAssistant):
         k = type("AssistedGitDataPlugin_%s" % self.plugin_name,(GitDataPlugin,),confdict)
         return k
 
+    def manifest_key(self, data_folder):
+        """
+        Return current commit hash of the plugin's repository, read from git
+        files directly (no need to run git for each plugin while loading them)
+        """
+        gitdir = os.path.join(data_folder,".git")
+        try:
+            head = open(os.path.join(gitdir,"HEAD")).read().strip()
+            if not head.startswith("ref:"):
+                return head # detached HEAD, already a commit
+            ref = head.split(":",1)[1].strip()
+            if os.path.exists(os.path.join(gitdir,ref)):
+                return open(os.path.join(gitdir,ref)).read().strip()
+            for line in open(os.path.join(gitdir,"packed-refs")):
+                if line.strip().endswith(" %s" % ref):
+                    return line.split()[0]
+        except FileNotFoundError:
+            pass
+        self.logger.debug("Can't find current commit in '%s', using manifest's mtime" % data_folder)
+        return super(GithubAssistant,self).manifest_key(data_folder)
+
     def handle(self):
         assert self.__class__.data_plugin_manager, "Please set data_plugin_manager attribute"
         klass = self.get_classdef()
@@ -39,6 +39,14 @@ class IDStruct(object):
         """add a (original_id, current_id) pair to the list"""
         if not left or not right:
             return  # identifiers cannot be None
+        if type(left) not in (list, tuple) and type(right) not in (list, tuple):
+            # most common case, single ids
+            rights = self.forward.get(left, ())
+            if right in rights:
+                return
+            self.forward[left] = rights + (right,)
+            self.inverse[right] = self.inverse.get(right, ()) + (left,)
+            return
         if self.lookup(left, right):
             return  # tuple already in the list
         # ensure it's hashable
@@ -100,7 +108,7 @@ class IDStruct(object):
     def side(self,_id,where):
         if type(_id) == list:
             _id = tuple(_id)
-        return _id in where.keys()
+        return _id in where
 
     def left(self, id):
         """Determine if the id (left, _) is registered"""
@@ -112,7 +120,7 @@ class IDStruct(object):
         if not type(ids) in (list,tuple):
             ids = [ids]
         for id in ids:
-            if id in where.keys():
+            if id in where:
                 for i in where[id]:
                     yield i
 
@@ -287,6 +295,22 @@ class DataTransformEdge(object):
         """
         yield NotImplemented("This method must be overridden by the base class.")
 
+    def edge_lookup_batch(self, keylookup_obj, ids):
+        """
+        Look up a batch of ids at once, return a dict id => list of
+        ids found following the edge (ids not found can be omitted).
+        Default implementation relies on edge_lookup(), subclasses
+        should override it when ids can be resolved in bulk.
+        :param keylookup_obj:
+        :param ids: list of (current) ids
+        :return:
+        """
+        id_strct = IDStruct()
+        for _id in ids:
+            id_strct.add(_id, _id)
+        res_id_strct = self.edge_lookup(keylookup_obj, id_strct)
+        return dict([(k, list(v)) for (k, v) in res_id_strct.forward.items()])
+
     def init_state(self):
         self._state = {
             "logger": None
@@ -334,6 +358,8 @@ class RegExEdge(DataTransformEdge):
     """
     The RegExEdge allows an identifier to be transformed using a regular expression. POSIX regular expressions are supported.
     """
+    # substitution is cheaper than a cache lookup
+    cacheable = False
 
     def __init__(self, from_regex, to_regex, weight=1):
         """
@@ -366,6 +392,9 @@ def nested_lookup(doc, field):
     :param field: period delimited list of fields
     :return:
     """
+    if type(doc) == dict and '.' not in field:
+        # not nested
+        return doc.get(field)
     value = doc
     keys = field.split('.')
     try:
@@ -4,6 +4,7 @@ from itertools import islice, chain
 import logging
 import re
 from biothings.hub.datatransform.datatransform import DataTransform, DataTransformEdge, IDStruct, nested_lookup
+from biothings.hub.datatransform.lookupcache import lookup_many
 from biothings.utils.loggers import get_logger
 from biothings import config as btconfig
 
@@ -36,20 +37,29 @@ class DataTransformAPI(DataTransform):
     Additional Options:
     - skip_on_failure:  Do not include a document where key lookup fails in the results
     - skip_w_regex:  skip key lookup if the provided regex matches
+    - lookup_cache: LookupCache instance (see lookupcache module) where API
+      lookups are cached, so ids aren't queried again by later uploads
     """
     batch_size = 10
     default_source = '_id'
     lookup_fields = {}
+    # ids missing from the lookup cache are queried by chunks, concurrently
+    lookup_chunk_size = 1000
+    lookup_workers = 4
 
-    def __init__(self, input_types, output_types, skip_on_failure=False, skip_w_regex=None):
+    def __init__(self, input_types, output_types, skip_on_failure=False, skip_w_regex=None,
+                 lookup_cache=None):
         """
         Initialize the IDLookupAPI object.
         """
+        # needed by _generate_return_fields(), reset by DataTransform
+        self.logger,_ = get_logger('keylookup_api')
         self._generate_return_fields()
         super().__init__(input_types, output_types, skip_on_failure, skip_w_regex)
 
         # default value of None for client
         self.client = None
+        self.lookup_cache = lookup_cache
 
         # Keep track of one_to_many relationships
         self.one_to_many_cnt = 0
@@ -96,10 +106,21 @@ class DataTransformAPI(DataTransform):
 
         id_lst, doc_cache = self._build_cache(batchiter)
         self.logger.info("key_lookup_batch num. id_lst items:  {}".format(len(id_lst)))
-        qr = self._query_many(id_lst)
-        qm_struct = self._parse_querymany(qr)
+        qm_struct = self._lookup(id_lst)
         return self._replace_keys(qm_struct, doc_cache)
 
+    def _lookup(self, id_lst):
+        """
+        Look up identifiers, from the lookup cache or querying the API,
+        and return the structure used for key replacement (see _parse_querymany)
+        """
+        scope = ",".join(self._get_scopes())
+        # the first matching output field is used, cached results depend on their order
+        field = ",".join([f for output_type in self.output_types for f in self._get_lookup_field(output_type)])
+        results = lookup_many(lambda ids: self._parse_querymany(self._query_many(ids)), id_lst,
+                              scope, field, self.lookup_cache, self.lookup_chunk_size, self.lookup_workers)
+        return dict([(k, v) for (k, v) in results.items() if v])
+
     def _build_cache(self, batchiter):
         """
         Build an id list and document cache for documents read from the
@@ -118,7 +139,7 @@ class DataTransformAPI(DataTransform):
                 for input_type in self.input_types:
                     val = DataTransformAPI._nested_lookup(doc, input_type[1])
                     if val:
-                        id_lst.append('"{}"'.format(val))
+                        id_lst.append(val)
 
             # always place the document in the cache
             doc_cache.append(doc)
@@ -133,19 +154,23 @@ class DataTransformAPI(DataTransform):
         """
         # Query MyGene.info
         # self.logger.debug("query_many scopes:  {}".format(self.lookup_fields[self.input_type]))
-        scopes = []
-        for input_type in self.input_types:
-            for field in self._get_lookup_field(input_type[0]):
-                scopes.append(field)
+        scopes = self._get_scopes()
         client = self._get_client()
 
-        return client.querymany(id_lst,
+        return client.querymany(['"{}"'.format(_id) for _id in id_lst],
                                 scopes=scopes,
                                 fields=self.return_fields,
                                 as_generator=True,
                                 returnall=True,
                                 size=self.batch_size)
 
+    def _get_scopes(self):
+        scopes = []
+        for input_type in self.input_types:
+            for field in self._get_lookup_field(input_type[0]):
+                scopes.append(field)
+        return scopes
+
     def _parse_querymany(self, qr):
         """
         Parse the querymany results from the biothings_client into a structure
@@ -259,12 +284,14 @@ class DataTransformMyChemInfo(DataTransformAPI):
     def __init__(self, input_types,
                  output_types=None,
                  skip_on_failure=False,
-                 skip_w_regex=None):
+                 skip_w_regex=None,
+                 lookup_cache=None):
         """
         Initialize the class by seting up the client object.
         """
         _output_types = output_types or self.output_types
-        super(DataTransformMyChemInfo, self).__init__(input_types, _output_types, skip_on_failure, skip_w_regex)
+        super(DataTransformMyChemInfo, self).__init__(input_types, _output_types, skip_on_failure, skip_w_regex,
+                                                      lookup_cache)
 
     def _get_client(self):
         """
@@ -284,12 +311,17 @@ class BiothingsAPIEdge(DataTransformEdge):
     """
     APIEdge - IDLookupEdge object for API calls
     """
-    def __init__(self, lookup, field, weight=1):
+    # ids missing from the lookup cache are queried by chunks, concurrently
+    lookup_chunk_size = 1000
+    lookup_workers = 4
+
+    def __init__(self, lookup, field, weight=1, lookup_cache=None):
         super().__init__()
         self.init_state()
         self.scope = lookup
         self.field = field
         self.weight = weight
+        self.lookup_cache = lookup_cache
 
     def init_state(self):
         self._state = {
@@ -320,20 +352,31 @@ class BiothingsAPIEdge(DataTransformEdge):
         :param key:
         :return:
         """
-        qr = self._query_many(keylookup_obj, id_strct)
-        new_id_strct = self._parse_querymany(keylookup_obj, qr, id_strct, self.field)
+        if not isinstance(id_strct, IDStruct):
+            raise TypeError("id_strct shouldb be of type IDStruct")
+        results = self.edge_lookup_batch(keylookup_obj, id_strct.id_lst)
+        new_id_strct = IDStruct()
+        for (orig_id, curr_id) in id_strct:
+            for val in results.get(curr_id, []):
+                new_id_strct.add(orig_id, val)
         return new_id_strct
 
-    def _query_many(self, keylookup_obj, id_strct):
+    def edge_lookup_batch(self, keylookup_obj, ids):
+        """
+        Look up ids from the lookup cache, or querying the API
+        :return: dict id => list of values found
+        """
+        return lookup_many(lambda chunk: self._parse_querymany(self._query_many(keylookup_obj, chunk)),
+                           ids, self.scope, self.field, self.lookup_cache,
+                           self.lookup_chunk_size, self.lookup_workers)
+
+    def _query_many(self, keylookup_obj, id_lst):
         """
         Call the biothings_client querymany function with a list of identifiers
         and output fields that will be returned.
         :param id_lst: list of identifiers to query
         :return:
         """
-        if not isinstance(id_strct, IDStruct):
-            raise TypeError("id_strct shouldb be of type IDStruct")
-        id_lst = id_strct.id_lst
         return self.client.querymany(id_lst,
                                      scopes=self.scope,
                                      fields=self.field,
@@ -341,22 +384,19 @@ class BiothingsAPIEdge(DataTransformEdge):
                                      returnall=True,
                                      size=keylookup_obj.batch_size)
 
-    def _parse_querymany(self, keylookup_obj, qr, id_strct, field):
+    def _parse_querymany(self, qr):
         """
-        Parse the querymany results from the biothings_client into a structure
-        that will later be used for document key replacement.
+        Parse the querymany results from the biothings_client into a
+        dict query => list of values found for the edge field.
         :param qr: querymany results
         :return:
         """
         self.logger.debug("QueryMany Structure:  {}".format(qr))
-        qm_struct = IDStruct()
+        qm_struct = {}
         for q in qr['out']:
-            query = q['query']
-            val = nested_lookup(q, field)
+            val = nested_lookup(q, self.field)
             if val:
-                for (orig_id, curr_id) in id_strct:
-                    if query == curr_id:
-                        qm_struct.add(orig_id, val)
+                qm_struct.setdefault(q['query'], []).append(val)
         return qm_struct
 
 class MyChemInfoEdge(BiothingsAPIEdge):
@@ -364,7 +404,7 @@ class MyChemInfoEdge(BiothingsAPIEdge):
     The MyChemInfoEdge uses the MyChem.info API to convert identifiers.
     """
 
-    def __init__(self, lookup, field, weight=1):
+    def __init__(self, lookup, field, weight=1, lookup_cache=None):
         """
         :param lookup: The field in the API to search with the input identifier.
         :type lookup: str
@@ -372,8 +412,10 @@ class MyChemInfoEdge(BiothingsAPIEdge):
         :type field: str
         :param weight: Weights are used to prefer one path over another. The path with the lowest weight is preferred. The default weight is 1.
         :type weight: int
+        :param lookup_cache: Cache where lookups are stored, so identifiers aren't queried again (optional).
+        :type lookup_cache: LookupCache
         """
-        super().__init__(lookup, field, weight)
+        super().__init__(lookup, field, weight, lookup_cache)
 
     def prepare_client(self):
         """
@@ -389,7 +431,7 @@ class MyGeneInfoEdge(BiothingsAPIEdge):
     The MyGeneInfoEdge uses the MyGene.info API to convert identifiers.
     """
 
-    def __init__(self, lookup, field, weight=1):
+    def __init__(self, lookup, field, weight=1, lookup_cache=None):
         """
         :param lookup: The field in the API to search with the input identifier.
         :type lookup: str
@@ -397,8 +439,10 @@ class MyGeneInfoEdge(BiothingsAPIEdge):
         :type field: str
         :param weight: Weights are used to prefer one path over another. The path with the lowest weight is preferred. The default weight is 1.
         :type weight: int
+        :param lookup_cache: Cache where lookups are stored, so identifiers aren't queried again (optional).
+        :type lookup_cache: LookupCache
         """
-        super().__init__(lookup, field, weight)
+        super().__init__(lookup, field, weight, lookup_cache)
 
     def prepare_client(self):
         """
@@ -422,11 +466,13 @@ class DataTransformMyGeneInfo(DataTransformAPI):
     def __init__(self, input_types,
                  output_types=['entrezgene'],
                  skip_on_failure=False,
-                 skip_w_regex=None):
+                 skip_w_regex=None,
+                 lookup_cache=None):
         """
         Initialize the class by seting up the client object.
         """
-        super(DataTransformMyGeneInfo, self).__init__(input_types, output_types, skip_on_failure, skip_w_regex)
+        super(DataTransformMyGeneInfo, self).__init__(input_types, output_types, skip_on_failure, skip_w_regex,
+                                                      lookup_cache)
 
     def _get_client(self):
         """
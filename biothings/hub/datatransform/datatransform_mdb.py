@@ -1,7 +1,11 @@
 import copy
+import hashlib
+import json
+import os
 import re
+from collections import OrderedDict
 
-from networkx import all_simple_paths, all_shortest_paths, nx
+from networkx import all_shortest_paths, nx
 from biothings.utils.common import iter_n
 from biothings.hub.datatransform import DataTransform
 from biothings.hub.datatransform import DataTransformEdge
@@ -9,6 +13,11 @@ from biothings.hub.datatransform import IDStruct
 from biothings.hub.datatransform import nested_lookup
 import biothings.utils.mongo as mongo
 from biothings.utils.loggers import get_logger
+from biothings import config as btconfig
+
+
+# path tables already computed or loaded in this process, per graph hash
+_path_tables = {}
 
 
 class MongoDBEdge(DataTransformEdge):
@@ -77,16 +86,38 @@ class MongoDBEdge(DataTransformEdge):
 
         # Build up a new_id_strct from the results
         res_id_strct = IDStruct()
-
-        id_lst = id_strct.id_lst
-        if len(id_lst):
-            find_lst = self.collection.find({self.lookup: {"$in": id_lst}}, {self.lookup: 1, self.field: 1})
-
-            for d in find_lst:
-                for orig_id in id_strct.find_right(nested_lookup(d, self.lookup)):
-                    res_id_strct.add(orig_id, nested_lookup(d, self.field))
+        results = self.edge_lookup_batch(keylookup_obj, id_strct.id_lst)
+        for (orig_id, curr_id) in id_strct:
+            for new_id in results.get(curr_id, ()):
+                res_id_strct.add(orig_id, new_id)
         return res_id_strct
 
+    def edge_lookup_batch(self, keylookup_obj, ids):
+        """
+        Look up all ids with one mongodb query.
+        :param keylookup_obj:
+        :param ids: list of ids
+        :return: dict id => list of ids found
+        """
+        results = {}
+        if not len(ids):
+            return results
+        wanted = set(ids)
+        find_lst = self.collection.find({self.lookup: {"$in": list(wanted)}}, {self.lookup: 1, self.field: 1})
+        for d in find_lst:
+            new_ids = nested_lookup(d, self.field)
+            if not new_ids:
+                continue
+            if type(new_ids) not in (list, tuple):
+                new_ids = [new_ids]
+            lookup_ids = nested_lookup(d, self.lookup)
+            if type(lookup_ids) not in (list, tuple):
+                lookup_ids = [lookup_ids]
+            for _id in wanted.intersection(lookup_ids):
+                found = results.setdefault(_id, [])
+                found.extend([new_id for new_id in new_ids if new_id and new_id not in found])
+        return results
+
 
 class DataTransformMDB(DataTransform):
     """
@@ -95,8 +126,14 @@ class DataTransformMDB(DataTransform):
     # Constants
     batch_size = 1000
     default_source = '_id'
-
-    def __init__(self, G, *args, **kwargs):
+    # max number of ids kept in the lookup cache of each edge
+    edge_cache_size = 100000
+    # paths longer (number of edges) or heavier (sum of edge weights)
+    # are not considered (None for no limit)
+    max_path_hops = 6
+    max_path_weight = None
+
+    def __init__(self, G, *args, max_path_hops=None, max_path_weight=None, **kwargs):
         """
         The DataTransform MDB module was written as a decorator class
         which should be applied to the load_data function of a
@@ -116,16 +153,34 @@ class DataTransformMDB(DataTransform):
         :type idstruct_class: class
         :param copy_from_doc: If true then an identifier is copied from the input source document regardless as to weather it matches an edge or not. (advanced usage)
         :type copy_from_doc: bool
+        :param max_path_hops: Maximum number of edges in a path (default to class attribute max_path_hops).
+        :type max_path_hops: int
+        :param max_path_weight: Maximum weight of a path (default to class attribute max_path_weight).
+        :type max_path_weight: int
         """
         if not isinstance(G, nx.DiGraph):
             raise ValueError("key_lookup configuration error:  G must be of type nx.DiGraph")
         self._validate_graph(G)
         self.G = G
+        if max_path_hops is not None:
+            self.max_path_hops = max_path_hops
+        if max_path_weight is not None:
+            self.max_path_weight = max_path_weight
         self.logger,_ = get_logger('datatransform')
+        # edge lookup results, per edge object, shared across batches of the same upload
+        self.edge_cache = {}
 
         super().__init__(*args,**kwargs)
         self._precompute_paths()
 
+    def __call__(self, f):
+        wrapped_f = super().__call__(f)
+        def cached_f(*args):
+            # new upload, lookups from previous ones could be outdated
+            self.edge_cache = {}
+            yield from wrapped_f(*args)
+        return cached_f
+
     def _valid_input_type(self, input_type):
         return input_type.lower() in self.G.nodes()
 
@@ -149,16 +204,82 @@ class DataTransformMDB(DataTransform):
             if not isinstance(edge_object, DataTransformEdge):
                 raise ValueError("edge_object for ({}, {}) is of the wrong type".format(v1, v2))
 
+    def graph_hash(self):
+        """
+        Hash of everything the path table depends on: graph structure,
+        edge weights, input/output types and path limits.
+        """
+        desc = {
+            "nodes": list(self.G.nodes()),
+            "edges": [[v1, v2, self.G.edges[v1, v2]['object'].weight] for (v1, v2) in self.G.edges()],
+            "input_types": [input_type[0] for input_type in self.input_types],
+            "output_types": list(self.output_types),
+            "max_path_hops": self.max_path_hops,
+            "max_path_weight": self.max_path_weight,
+        }
+        return hashlib.sha1(json.dumps(desc).encode()).hexdigest()
+
+    def path_table_file(self, graph_hash):
+        """
+        File where the path table is persisted, None if no cache folder is configured
+        """
+        cache_folder = getattr(btconfig, "CACHE_FOLDER", None)
+        if not cache_folder:
+            return None
+        return os.path.join(cache_folder, "datatransform", "paths_%s.json" % graph_hash)
+
     def _precompute_paths(self):
         """
         Precompute all paths from the given key_type to all target key types
-        provided on initialization.
+        provided on initialization. Path tables are computed once per graph
+        definition (see graph_hash()) and persisted in CACHE_FOLDER so other
+        processes (eg. upload workers) only have to load them.
         :return:
         """
-        self.paths = {}
+        graph_hash = self.graph_hash()
+        if graph_hash not in _path_tables:
+            paths = self._load_paths(graph_hash)
+            if paths is None:
+                paths = self._compute_paths()
+                self._save_paths(graph_hash, paths)
+            _path_tables[graph_hash] = paths
+        self.paths = _path_tables[graph_hash]
+        self.logger.debug("All Pre-Computed DataTransform Paths:  {}".format(self.paths))
+
+    def _load_paths(self, graph_hash):
+        path_file = self.path_table_file(graph_hash)
+        if not path_file or not os.path.exists(path_file):
+            return None
+        try:
+            with open(path_file) as fin:
+                return dict([((start, target), paths) for (start, target, paths) in json.load(fin)])
+        except (ValueError, OSError) as e:
+            self.logger.warning("Can't load path table from '%s', recomputing: %s" % (path_file, e))
+            return None
+
+    def _save_paths(self, graph_hash, paths):
+        path_file = self.path_table_file(graph_hash)
+        if not path_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(path_file), exist_ok=True)
+            # other processes may read it at the same time, only complete files are visible
+            tmp_file = "%s.%s" % (path_file, os.getpid())
+            with open(tmp_file, "w") as fout:
+                json.dump([[start, target, p] for ((start, target), p) in paths.items()], fout)
+            os.replace(tmp_file, path_file)
+        except OSError as e:
+            self.logger.warning("Can't save path table to '%s': %s" % (path_file, e))
+
+    def _compute_paths(self):
+        """
+        Search paths from input types to output types, sorted by weight.
+        :return: dict (input_type, output_type) => list of paths
+        """
+        paths_table = {}
         for output_type in self.output_types:
             for input_type in self.input_types:
-                paths = [p for p in all_simple_paths(self.G, input_type[0], output_type)]
+                paths = [p for p in self._bounded_paths(input_type[0], output_type)]
                 if not paths:
                     try:
                         # this will try to find self-loops. all_shortest_paths() return one element,
@@ -173,8 +294,37 @@ class DataTransformMDB(DataTransform):
                         pass
                 # Sort by path length - try the shortest paths first
                 paths = sorted(paths, key=self._compute_path_weight)
-                self.paths[(input_type[0], output_type)] = paths
-        self.logger.debug("All Pre-Computed DataTransform Paths:  {}".format(self.paths))
+                paths_table[(input_type[0], output_type)] = paths
+        return paths_table
+
+    def _bounded_paths(self, source, target):
+        """
+        Simple paths from source to target, in the same order as
+        networkx all_simple_paths(), but search is pruned as soon
+        as max_path_hops or max_path_weight is exceeded.
+        """
+        if source == target:
+            return
+        visited = [source]
+        weights = [0]
+        stack = [iter(self.G[source])]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                visited.pop()
+                weights.pop()
+                continue
+            weight = weights[-1] + self.G.edges[visited[-1], child]['object'].weight
+            if self.max_path_weight is not None and weight > self.max_path_weight:
+                continue
+            if child == target:
+                yield visited + [target]
+            elif child not in visited and \
+                    (self.max_path_hops is None or len(visited) < self.max_path_hops):
+                visited.append(child)
+                weights.append(weight)
+                stack.append(iter(self.G[child]))
 
     def key_lookup_batch(self, batchiter):
         """
@@ -272,17 +422,18 @@ class DataTransformMDB(DataTransform):
             """
             hit_lst = []
             miss_lst = []
-            for d in doc_lst:
-                hit_flag = False
-                value = nested_lookup(d, input_type[1])
-                for lookup_id in id_strct.find_left(value):
-                    new_doc = copy.deepcopy(d)
+            for d, value in zip(doc_lst, values):
+                lookup_ids = list(id_strct.find_left(value))
+                if not lookup_ids:
+                    miss_lst.append(d)
+                    continue
+                # only copy when the document fans out to multiple ids,
+                # the original one is used for the first id
+                docs = [d] + [copy.deepcopy(d) for _ in lookup_ids[1:]]
+                for new_doc, lookup_id in zip(docs, lookup_ids):
                     # ensure _id is always a str
                     new_doc['_id'] = str(lookup_id)
                     hit_lst.append(new_doc)
-                    hit_flag = True
-                if not hit_flag:
-                    miss_lst.append(d)
             return hit_lst, miss_lst
 
         #self.logger.debug("Travel From '{}' To '{}'".format(input_type[0], target))
@@ -292,27 +443,32 @@ class DataTransformMDB(DataTransform):
 
         # Build the path structure, which will save results
         path_strct = _build_path_strct(input_type, doc_lst)
+        # input ids, read once per document
+        values = [nested_lookup(doc, input_type[1]) for doc in doc_lst]
 
         for path in map(nx.utils.misc.pairwise, self.paths[(input_type[0], target)]):
+            if not len(path_strct):
+                # all ids found
+                break
             for (v1, v2) in path:
                 edge = self.G.edges[v1, v2]['object']
                 num_input_ids = len(path_strct)
                 path_strct = self._edge_lookup(edge, path_strct)
                 num_output_ids = len(path_strct)
-                if num_input_ids:
-                    # self.logger.debug("Edge {} - {}, {} searched returned {}".format(v1, v2, num_input_ids, num_output_ids))
-                    self.histogram.update_edge(v1, v2, num_output_ids)
+                # self.logger.debug("Edge {} - {}, {} searched returned {}".format(v1, v2, num_input_ids, num_output_ids))
+                self.histogram.update_edge(v1, v2, num_output_ids, num_input_ids - num_output_ids)
+                if not num_output_ids:
+                    # nothing left to follow on this path
+                    break
 
             if len(path_strct):
                 saved_hits += path_strct
 
             # reset the state to lookup misses
             path_strct = self.idstruct_class()
-            for doc in doc_lst:
-                val = nested_lookup(doc, input_type[1])
-                if val:
-                    if not saved_hits.left(val):
-                        path_strct.add(val, val)
+            for val in values:
+                if val and not saved_hits.left(val):
+                    path_strct.add(val, val)
 
         # Return a list of documents that have had their identifiers replaced
         # also return a list of documents that were not changed
@@ -326,6 +482,31 @@ class DataTransformMDB(DataTransform):
 
         This method uses the data in the edge_object
         to find one key to another key using one of
-        several types of lookup functions.
+        several types of lookup functions. Results are
+        cached per edge (LRU, see edge_cache_size), so
+        only ids not seen before are actually looked up.
         """
-        return edge_obj.edge_lookup(self, id_strct)
+        if not getattr(edge_obj, "cacheable", True):
+            return edge_obj.edge_lookup(self, id_strct)
+        cache = self.edge_cache.setdefault(edge_obj, OrderedDict())
+        results = {}
+        missing = []
+        for _id in id_strct.id_lst:
+            if _id in cache:
+                cache.move_to_end(_id)
+                results[_id] = cache[_id]
+            else:
+                missing.append(_id)
+        if missing:
+            found = edge_obj.edge_lookup_batch(self, missing)
+            for _id in missing:
+                # ids not found are cached too
+                results[_id] = cache[_id] = found.get(_id, ())
+            while len(cache) > self.edge_cache_size:
+                cache.popitem(last=False)
+
+        res_id_strct = IDStruct()
+        for (left, right) in id_strct:
+            for out in results.get(right, ()):
+                res_id_strct.add(left, out)
+        return res_id_strct
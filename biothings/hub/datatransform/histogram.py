@@ -5,20 +5,24 @@ class Histogram(object):
     def __init__(self):
         self.io_histogram = {}
         self.edge_histogram = {}
+        self.edge_miss_histogram = {}
 
     def __str__(self):
         res = {
             'io_report': self.io_histogram,
-            'edge_report': self.edge_histogram
+            'edge_report': self.edge_histogram,
+            'edge_miss_report': self.edge_miss_histogram
             }
         return str(res)
 
-    def update_edge(self, v1, v2, size):
+    def update_edge(self, v1, v2, size, misses=0):
         """
-        Update the edge histogram
+        Update the edge histogram, with the number of ids found
+        following the edge and the number of ids not found (misses)
         """
         key = self._construct_key(v1, v2)
         self._increment(self.edge_histogram, key, size)
+        self._increment(self.edge_miss_histogram, key, misses)
 
     def update_io(self, input_type, output_type, size):
         """
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from biothings import config as btconfig
+from biothings.utils.common import iter_n
+
+
+class LookupCache(object):
+    """
+    Cache for identifier lookups, keyed by (scope, field, value): results
+    are the list of values found for "field" when "value" is searched in
+    "scope". Lookups returning nothing are cached too (empty list), but
+    only for "miss_ttl" seconds, as ids can be added to the looked up
+    source. Other entries older than "ttl" seconds are ignored.
+    """
+
+    def __init__(self, ttl=30 * 24 * 3600, miss_ttl=24 * 3600):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, scope, field, values):
+        """
+        Return a dict value => results, for values found in the cache
+        (and not expired)
+        """
+        now = time.time()
+        found = self._get_many(scope, field, values, now - self.ttl, now - min(self.ttl, self.miss_ttl))
+        self.hits += len(found)
+        self.misses += len(values) - len(found)
+        return found
+
+    def _get_many(self, scope, field, values, min_ts, min_miss_ts):
+        raise NotImplementedError()
+
+    def set_many(self, scope, field, results):
+        """
+        Store results, a dict value => list of results
+        """
+        raise NotImplementedError()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return total and self.hits / total or 0.0
+
+
+class MemoryLookupCache(LookupCache):
+    """
+    Lookup cache kept in memory, for the lifetime of the process.
+    """
+
+    def __init__(self, ttl=30 * 24 * 3600, miss_ttl=24 * 3600):
+        super().__init__(ttl, miss_ttl)
+        self.entries = {}
+
+    def _get_many(self, scope, field, values, min_ts, min_miss_ts):
+        found = {}
+        for value in values:
+            entry = self.entries.get((scope, field, value))
+            if entry and entry[0] >= (entry[1] and min_ts or min_miss_ts):
+                found[value] = entry[1]
+        return found
+
+    def set_many(self, scope, field, results):
+        now = time.time()
+        for value, res in results.items():
+            self.entries[(scope, field, value)] = (now, res)
+
+
+class SqliteLookupCache(LookupCache):
+    """
+    Lookup cache stored in a sqlite database, so it persists across
+    uploads and processes. Values are stored as strings, results as JSON.
+    Database is shared by concurrent workers: it's in WAL mode, so reads
+    don't wait for writes, and a write waits up to "timeout" seconds for
+    another one. If the database is still locked, lookups aren't cached.
+    """
+    # max number of values per SELECT (sqlite limits number of parameters)
+    query_size = 500
+    # seconds waiting for a lock
+    timeout = 30
+
+    def __init__(self, db_file=None, ttl=30 * 24 * 3600, miss_ttl=24 * 3600):
+        super().__init__(ttl, miss_ttl)
+        self.db_file = db_file or os.path.join(btconfig.CACHE_FOLDER, "datatransform", "lookup_cache.sqlite")
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # connection can't be pickled, re-opened on first use
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_file, timeout=self.timeout, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lookup (scope TEXT, field TEXT, value TEXT, " +
+                               "results TEXT, ts REAL, PRIMARY KEY (scope, field, value))")
+            self._conn.commit()
+        return self._conn
+
+    def _get_many(self, scope, field, values, min_ts, min_miss_ts):
+        strvals = dict([(str(value), value) for value in values])
+        found = {}
+        with self._lock:
+            try:
+                for chunk in iter_n(strvals, self.query_size):
+                    cur = self.conn.execute("SELECT value, results FROM lookup WHERE scope = ? AND field = ? " +
+                                            "AND ts >= (CASE results WHEN '[]' THEN ? ELSE ? END) " +
+                                            "AND value IN (%s)" % ",".join("?" * len(chunk)),
+                                            [scope, field, min_miss_ts, min_ts] + list(chunk))
+                    for strval, res in cur:
+                        found[strvals[strval]] = json.loads(res)
+            except sqlite3.OperationalError as e:
+                # values not found will be looked up
+                logging.warning("Can't read lookup cache '%s': %s" % (self.db_file, e))
+        return found
+
+    def set_many(self, scope, field, results):
+        now = time.time()
+        with self._lock:
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO lookup VALUES (?, ?, ?, ?, ?)",
+                                      [(scope, field, str(value), json.dumps(res), now)
+                                       for value, res in results.items()])
+                self.conn.commit()
+            except sqlite3.OperationalError as e:
+                self.conn.rollback()
+                logging.warning("Can't write lookup cache '%s', results not cached: %s" % (self.db_file, e))
+
+    def purge(self):
+        """
+        Delete expired entries
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.execute("DELETE FROM lookup WHERE ts < ? OR (results = '[]' AND ts < ?)",
+                              [now - self.ttl, now - self.miss_ttl])
+            self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def lookup_many(lookup_func, values, scope=None, field=None, cache=None, chunk_size=1000, num_workers=4):
+    """
+    Look up values, returning a dict value => list of results. Values found
+    in cache (if any) are not looked up, others are split in chunks of
+    "chunk_size", each passed to lookup_func(chunk) in a thread pool of
+    "num_workers" threads. lookup_func must return a dict value => list of
+    results, values not returned are considered not found.
+    Results are then stored in cache.
+    """
+    values = list(set(values))
+    results = cache.get_many(scope, field, values) if cache is not None else {}
+    missing = [v for v in values if v not in results]
+    if not missing:
+        return results
+    chunks = [list(chunk) for chunk in iter_n(missing, chunk_size)]
+    if len(chunks) == 1 or num_workers <= 1:
+        found = [lookup_func(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(num_workers, len(chunks))) as executor:
+            found = list(executor.map(lookup_func, chunks))
+    looked_up = dict([(v, []) for v in missing])
+    for res in found:
+        looked_up.update(res)
+    if cache is not None:
+        cache.set_many(scope, field, looked_up)
+    results.update(looked_up)
+    return results
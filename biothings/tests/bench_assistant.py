@@ -0,0 +1,108 @@
+"""
+Data plugins loading time and memory at hub startup, with synthetic plugins
+(each one with a manifest declaring a dumper and an uploader, its parser
+module building a sizeable lookup table when imported). Reports first load
+(manifests parsed and cached), restart (cached manifests) and the same loading
+when all generated classes are materialized (plugins' code imported, as it
+was done before classes were materialized on first use). Plugins are
+registered in the configured hub database (data_plugin collection) and
+removed afterwards. Not collected by test runners, run with:
+
+    python -m biothings.tests.bench_assistant [num_plugins]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import config, biothings
+biothings.config_for_app(config)
+
+from biothings.utils.common import get_random_string
+from biothings.utils.hub_db import get_data_plugin
+from biothings.hub.dataload.dumper import DumperManager
+from biothings.hub.dataload.uploader import UploaderManager
+from biothings.hub.dataplugin.manager import DataPluginManager
+from biothings.hub.dataplugin.assistant import AssistantManager, LocalAssistant
+
+PARSER = """
+import csv, decimal, fractions
+
+LOOKUP = dict([("key%d" % i, [i, str(i) * 4]) for i in range(5000)])
+
+def load_data(data_folder):
+    for row in csv.reader(open(data_folder + "/data.tsv"), delimiter="\\t"):
+        yield {"_id" : row[0], "value" : LOOKUP.get(row[1])}
+"""
+
+
+def create_plugins(folder, num):
+    names = []
+    prefix = "benchplugin_%s" % get_random_string()
+    dp = get_data_plugin()
+    for i in range(num):
+        name = "%s_%d" % (prefix, i)
+        pfolder = os.path.join(folder, name)
+        os.makedirs(pfolder)
+        with open(os.path.join(pfolder, "parser.py"), "w") as fout:
+            fout.write(PARSER)
+        with open(os.path.join(pfolder, "manifest.json"), "w") as fout:
+            json.dump({"__metadata__" : {"url" : "http://localhost/%s" % name, "license" : "CC0"},
+                       "dumper" : {"data_url" : ["http://localhost/%s/data%d.tsv" % (name, j) for j in range(3)],
+                                   "uncompress" : True},
+                       "uploader" : {"parser" : "parser:load_data", "on_duplicates" : "ignore"}}, fout)
+        dp.insert_one({"_id" : name,
+                       "plugin" : {"url" : "local://%s" % name, "type" : "local", "active" : True},
+                       "download" : {"data_folder" : pfolder}})
+        names.append(name)
+    return names
+
+
+def load(names, materialize=False):
+    manager = AssistantManager(data_plugin_manager=DataPluginManager(None),
+                               dumper_manager=DumperManager(None),
+                               uploader_manager=UploaderManager(job_manager=None),
+                               job_manager=None)
+    manager.configure(klasses=[LocalAssistant])
+    dp = get_data_plugin()
+    plugins = [dp.find_one({"_id" : name}) for name in names]
+    tracemalloc.start()
+    t0 = time.time()
+    for plugin in plugins:
+        manager.load_plugin(plugin)
+    if materialize:
+        for register in (manager.dumper_manager.register, manager.uploader_manager.register):
+            for klasses in register.values():
+                for klass in klasses:
+                    klass.materialize()
+    elapsed = time.time() - t0
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    sys.path.remove(config.DATA_PLUGIN_FOLDER)
+    assert len(manager.uploader_manager.register) == len(names)
+    return elapsed, mem
+
+
+def main(num=200):
+    folder = tempfile.mkdtemp()
+    config.DATA_PLUGIN_FOLDER = folder
+    dp = get_data_plugin()
+    names = []
+    try:
+        names = create_plugins(folder, num)
+        for label, materialize in (("first load (manifests parsed)", False),
+                                   ("restart (cached manifests)", False),
+                                   ("all classes materialized", True)):
+            elapsed, mem = load(names, materialize)
+            print("%d plugins, %-32s %8.3fs  %8.1f MiB" % (num, label, elapsed, mem / 1024**2))
+    finally:
+        for name in names:
+            dp.remove({"_id" : name})
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
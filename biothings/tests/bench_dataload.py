@@ -0,0 +1,54 @@
+"""
+Per-document throughput for dict_sweep, value_convert_to_number and dict_walk,
+on wide (many keys, lists) and deep (nested dicts) documents.
+Not collected by test runners, run with:
+
+    python -m biothings.tests.bench_dataload
+"""
+import time
+
+from biothings.utils.dataload import dict_sweep, value_convert_to_number, dict_walk
+
+
+def wide_doc(width=500):
+    doc = {}
+    for i in range(width):
+        doc["key%d" % i] = ["%d" % i, "NA", "NA", "value", {"sub" : "1.5", "empty" : "-"}]
+        doc["str%d" % i] = i % 3 and "%d" % i or "NA"
+        doc["dict%d" % i] = {"a" : "%d" % i, "b" : {"c" : "."}}
+    return doc
+
+
+def deep_doc(depth=500):
+    doc = {"leaf" : "1", "na" : "NA"}
+    for i in range(depth):
+        doc = {"level%d" % i : doc, "val%d" % i : ["1", "NA", "x"]}
+    return doc
+
+
+def dict_walk_upper(d):
+    return dict_walk(d, str.upper)
+
+
+def bench(name, func, doc_func, num=200, repeat=5):
+    elapsed = None
+    for _ in range(repeat):
+        # documents are built from scratch (copy.deepcopy would hit recursion limit)
+        docs = [doc_func() for _ in range(num)]
+        t0 = time.time()
+        for d in docs:
+            func(d)
+        # keep best run, less sensitive to noise
+        elapsed = min(elapsed or float("inf"), time.time() - t0)
+    print("%-25s %-6s %10.1f docs/s" % (func.__name__, name, num / elapsed))
+
+
+def main():
+    for name, doc_func in (("wide", wide_doc), ("deep", deep_doc)):
+        bench(name, dict_sweep, doc_func)
+        bench(name, value_convert_to_number, doc_func)
+        bench(name, dict_walk_upper, doc_func)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Key lookup throughput (documents/sec) of DataTransformMDB on a two-hop
+conversion (ensembl -> entrez -> symbol), with the edge lookup cache and
+without it. Collections are in-memory fakes adding a fixed latency per
+query, as a round-trip to MongoDB would. Ids are repeated across batches,
+as in uploads where several documents share the same identifiers. Not
+collected by test runners, run with:
+
+    python -m biothings.tests.bench_datatransform [num_docs] [num_ids] [latency]
+
+(with a latency of 0, lookups themselves are measured, eg. on 100k-id batches:
+python -m biothings.tests.bench_datatransform 100000 100000 0)
+"""
+import sys
+import time
+
+import config, biothings
+biothings.config_for_app(config)
+
+import networkx as nx
+
+from biothings.hub.datatransform import DataTransformMDB, MongoDBEdge
+
+QUERY_LATENCY = .002
+
+
+class FakeCollection(object):
+
+    def __init__(self, lookup, field, mapping):
+        self.lookup = lookup
+        self.field = field
+        self.mapping = mapping
+        self.num_queries = 0
+
+    def find(self, query, projection=None):
+        time.sleep(QUERY_LATENCY)
+        self.num_queries += 1
+        res = []
+        for _id in query[self.lookup]["$in"]:
+            for out in self.mapping.get(_id, []):
+                res.append({self.lookup : _id, self.field : out})
+        return res
+
+
+def make_graph(num_ids):
+    ensembl2entrez = dict([("ENSG%d" % i, [str(i)] + (i % 10 == 0 and [str(i + num_ids)] or []))
+                           for i in range(num_ids)])
+    entrez2symbol = dict([(str(i), ["SYM%d" % i]) for i in range(0, 2 * num_ids, 2)])
+    G = nx.DiGraph()
+    G.add_edge("ensembl", "entrez", object=MongoDBEdge("ensembl2entrez", "ensembl", "entrez"))
+    G.add_edge("entrez", "symbol", object=MongoDBEdge("entrez2symbol", "entrez", "symbol"))
+    G.edges["ensembl", "entrez"]["object"]._state["collection"] = \
+            FakeCollection("ensembl", "entrez", ensembl2entrez)
+    G.edges["entrez", "symbol"]["object"]._state["collection"] = \
+            FakeCollection("entrez", "symbol", entrez2symbol)
+    return G
+
+
+class UncachedDataTransformMDB(DataTransformMDB):
+
+    def _edge_lookup(self, edge_obj, id_strct):
+        return edge_obj.edge_lookup(self, id_strct)
+
+
+def load_data(num, num_ids):
+    for i in range(num):
+        yield {"_id" : "ENSG%d" % (i * 7919 % num_ids), "value" : i, "sub" : {"list" : list(range(10))}}
+
+
+def main(num=50000, num_ids=10000, latency=QUERY_LATENCY):
+    global QUERY_LATENCY
+    QUERY_LATENCY = latency
+    for klass in (UncachedDataTransformMDB, DataTransformMDB):
+        G = make_graph(num_ids)
+        dt = klass(G, input_types=["ensembl"], output_types=["symbol", "entrez"])
+        t0 = time.time()
+        cnt = 0
+        for _ in dt(load_data)(num, num_ids):
+            cnt += 1
+        elapsed = time.time() - t0
+        queries = sum([G.edges[e]["object"].collection.num_queries for e in G.edges()])
+        print("%-26s %8d docs -> %8d  %6d queries  %10.0f docs/s" % \
+              (klass.__name__, num, cnt, queries, num / elapsed))
+
+
+if __name__ == "__main__":
+    main(*[float(arg) if "." in arg or i == 2 else int(arg) for i, arg in enumerate(sys.argv[1:])])
@@ -0,0 +1,84 @@
+"""
+Compare, for gzip and xz compressed tab files, "post_dump" decompression on
+disk followed by parsing (gunzip/unxz then csv reader), with parsing while
+decompressing (anyfile(), single-threaded or threaded). Reports time and
+disk usage peak for each. Not collected by test runners, run with:
+
+    python -m biothings.tests.bench_decompress [num_lines]
+"""
+import csv
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from biothings.utils.common import anyfile, gunzip, sizeof_fmt
+
+
+def generate(folder, num_lines):
+    plain = os.path.join(folder, "data.tsv")
+    with open(plain, "w") as fout:
+        for i in range(num_lines):
+            fout.write("id%d\tchr%d\t%d\t%s\t%.3f\n" % (i, i % 23, i * 37, "ACGT"[i % 4] * 10, i / 7))
+    for ext, opener in ((".gz", gzip.open), (".xz", lzma.open)):
+        with open(plain, "rb") as fin, opener(plain + ext, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+    os.unlink(plain)
+    return plain
+
+
+def disk_usage(folder):
+    return sum([os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)])
+
+
+def parse(filename, **kwargs):
+    cnt = 0
+    with anyfile(filename, **kwargs) as in_f:
+        for ld in csv.reader(in_f, delimiter="\t"):
+            cnt += 1
+    return cnt
+
+
+def unxz(f):
+    with lzma.open(f) as fin, open(f[:-3], "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+
+
+def bench(folder, plain, ext):
+    compressed = plain + ext
+    results = []
+    # decompress on disk in post-dump step, then upload
+    t0 = time.time()
+    gunzip(compressed, ext) if ext == ".gz" else unxz(compressed)
+    peak = disk_usage(folder)
+    cnt = parse(plain)
+    results.append(("uncompress+parse", time.time() - t0, peak, cnt))
+    os.unlink(plain)
+    # keep compressed, decompress while parsing ("plain" resolves to compressed file)
+    for threaded in (False, True):
+        t0 = time.time()
+        cnt = parse(plain, threaded=threaded)
+        results.append(("stream%s" % (threaded and " (threaded)" or ""), time.time() - t0, disk_usage(folder), cnt))
+    for name, elapsed, peak, cnt in results:
+        print("%-3s %-22s %8.2fs  disk peak: %-10s (%d lines)" % (ext, name, elapsed, sizeof_fmt(peak), cnt))
+
+
+def main(num_lines=2000000):
+    for ext in (".gz", ".xz"):
+        folder = tempfile.mkdtemp()
+        try:
+            plain = generate(folder, num_lines)
+            # only keep the one we're testing
+            for other in (".gz", ".xz"):
+                if other != ext:
+                    os.unlink(plain + other)
+            bench(folder, plain, ext)
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
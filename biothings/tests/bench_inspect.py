@@ -0,0 +1,56 @@
+"""
+Inspection throughput (documents/sec) for each mode, over synthetic nested
+documents sharing a few structures (as documents from a given source do),
+with lists of varying lengths and values. Not collected by test runners,
+run with:
+
+    python -m biothings.tests.bench_inspect [num_docs]
+"""
+import random
+import sys
+import time
+
+import config, biothings
+biothings.config_for_app(config)
+
+from biothings.utils.inspect import inspect_docs
+
+
+def make_docs(num, seed=42):
+    rand = random.Random(seed)
+    docs = []
+    for i in range(num):
+        doc = {"_id" : "gene%d" % i,
+               "symbol" : "SYM%d" % rand.randint(0,100000),
+               "name" : "some gene name %d" % i,
+               "taxid" : rand.choice([9606,10090,10116]),
+               "genomic_pos" : {"chr" : str(rand.randint(1,22)), "start" : rand.randint(1,10 ** 8),
+                                "end" : rand.randint(1,10 ** 8), "strand" : rand.choice([1,-1])},
+               "go" : {"BP" : [{"id" : "GO:%07d" % rand.randint(0,10 ** 6), "term" : "biological process term",
+                                "evidence" : rand.choice(["IEA","IBA","TAS"]),
+                                "pubmed" : [rand.randint(1,10 ** 7) for _ in range(rand.randint(1,3))]}
+                               for _ in range(rand.randint(1,5))]},
+               "summary" : "a longer free text summary " * rand.randint(1,5),
+               "score" : rand.random()}
+        if i % 3 == 0:
+            doc["alias"] = ["AL%d" % j for j in range(rand.randint(1,4))]
+        if i % 5 == 0:
+            # scalar instead of list for some docs
+            doc["go"]["BP"] = doc["go"]["BP"][0]
+        if i % 50 == 0:
+            doc["refseq"] = {"rna" : ["NM_%d" % i], "protein" : "NP_%d" % i}
+        docs.append(doc)
+    return docs
+
+
+def main(num=20000):
+    docs = make_docs(num)
+    for mode in ("type","mapping","stats","deepstats"):
+        t0 = time.time()
+        inspect_docs(docs,mode=mode,pre_mapping=True)
+        elapsed = time.time() - t0
+        print("%-10s %8d docs  %10.0f docs/s" % (mode,num,num / elapsed))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+"""
+API key lookups (MyGeneInfoEdge, ensembl -> entrez) against a local stub
+BioThings API adding a fixed latency per request: two uploads of the same
+ids, without lookup cache and sequential queries (as before), with
+concurrent queries only, then with a sqlite lookup cache, reporting time
+per upload, number of API requests and cache hit ratio. Not collected by
+test runners, run with:
+
+    python -m biothings.tests.bench_lookupcache [num_ids] [latency]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import config, biothings
+biothings.config_for_app(config)
+
+import networkx as nx
+
+from biothings.hub.datatransform import DataTransformMDB
+from biothings.hub.datatransform.datatransform_api import MyGeneInfoEdge
+from biothings.hub.datatransform.lookupcache import SqliteLookupCache
+from biothings.tests.stub_biothings_api import StubBiothingsAPI
+from biothings.tests.test_lookupcache import make_genes, stub_client
+
+
+def upload(api, ids, cache, workers):
+    edge = MyGeneInfoEdge("ensembl.gene", "entrezgene", lookup_cache=cache)
+    edge.lookup_chunk_size = 100
+    edge.lookup_workers = workers
+    edge._state["client"] = stub_client(api)
+    G = nx.DiGraph()
+    G.add_edge("ensembl", "entrez", object=edge)
+    dt = DataTransformMDB(G, input_types=["ensembl"], output_types=["entrez"])
+    num_requests = api.num_requests
+    hits, misses = cache and (cache.hits, cache.misses) or (0, 0)
+    t0 = time.time()
+    for _ in dt(lambda: ({"_id" : _id} for _id in ids))():
+        pass
+    elapsed = time.time() - t0
+    hits, misses = cache and (cache.hits - hits, cache.misses - misses) or (0, 0)
+    return elapsed, api.num_requests - num_requests, hits / ((hits + misses) or 1)
+
+
+def main(num=5000, latency=.05):
+    folder = tempfile.mkdtemp()
+    ids = ["ENSG%d" % i for i in range(num)]
+    try:
+        with StubBiothingsAPI(make_genes(num // 2), latency=latency) as api:
+            for name, workers, cache in (("no cache, sequential", 1, None),
+                                         ("no cache, concurrent", 4, None),
+                                         ("sqlite cache, concurrent", 4,
+                                          SqliteLookupCache(os.path.join(folder, "cache.sqlite")))):
+                for run in (1, 2):
+                    elapsed, requests, hit_ratio = upload(api, ids, cache, workers)
+                    print("%-26s upload %d  %6d ids  %7.3fs  %4d requests  hit ratio %.2f" % \
+                          (name, run, num, elapsed, requests, hit_ratio))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[float(arg) if "." in arg else int(arg) for arg in sys.argv[1:]])
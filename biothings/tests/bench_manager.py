@@ -0,0 +1,75 @@
+"""
+Job tracking overhead in JobManager: many short jobs are run in the thread
+and process queues, time per job is compared to the same calls made
+directly on executors (no tracking). Also reports the time needed to
+summarize (top()) and list finished jobs (top("done")) once all jobs are done. Not
+collected by test runners, run with:
+
+    python -m biothings.tests.bench_manager [num_jobs]
+"""
+import asyncio
+import concurrent.futures
+import sys
+import time
+
+import config, biothings
+biothings.config_for_app(config)
+
+from biothings.utils.manager import JobManager
+
+
+def noop(i):
+    return i
+
+
+def bench(loop, job_manager, num, ptype):
+    executor = ptype == "thread" and job_manager.thread_queue or job_manager.process_queue
+    defer = ptype == "thread" and job_manager.defer_to_thread or job_manager.defer_to_process
+
+    @asyncio.coroutine
+    def untracked():
+        yield from asyncio.gather(*[loop.run_in_executor(executor,noop,i) for i in range(num)],loop=loop)
+
+    @asyncio.coroutine
+    def tracked():
+        jobs = []
+        for i in range(num):
+            pinfo = {"category" : "bench", "source" : "bench", "step" : ptype,
+                     "description" : "job %d" % i}
+            job = yield from defer(pinfo,noop,i)
+            jobs.append(job)
+        yield from asyncio.gather(*jobs,loop=loop)
+
+    # warm up (processes started)
+    loop.run_until_complete(untracked())
+    t0 = time.time()
+    loop.run_until_complete(untracked())
+    base = time.time() - t0
+    t0 = time.time()
+    loop.run_until_complete(tracked())
+    total = time.time() - t0
+    t0 = time.time()
+    job_manager.top()
+    top = time.time() - t0
+    t0 = time.time()
+    job_manager.top("done") # also purges finished jobs
+    dones = time.time() - t0
+    print("%-8s %6d jobs  untracked %7.1f us/job  tracked %7.1f us/job  overhead %7.1f us/job  top() %.3fs  top(done) %.3fs" % \
+          (ptype,num,base / num * 1e6,total / num * 1e6,(total - base) / num * 1e6,top,dones))
+
+
+def main(num=2000):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    job_manager = JobManager(loop,num_workers=2,num_threads=2)
+    try:
+        bench(loop,job_manager,num,"thread")
+        bench(loop,job_manager,num,"process")
+    finally:
+        job_manager.process_queue.shutdown()
+        job_manager.thread_queue.shutdown()
+        loop.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
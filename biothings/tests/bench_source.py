@@ -0,0 +1,70 @@
+"""
+Response time of SourceManager.get_sources() (sources summaries polled by
+the hub UI) as sources' inspection results grow. First call fetches summary
+fields from hub db, following calls are answered from cached summaries (until
+sources change). Uses the configured hub database (temporary sources are
+removed afterwards). Not collected by test runners, run with:
+
+    python -m biothings.tests.bench_source [num_sources]
+"""
+import sys
+import time
+from unittest import mock
+
+import config, biothings
+biothings.config_for_app(config)
+
+from biothings.utils.common import get_random_string
+from biothings.utils.hub_db import get_src_dump
+from biothings.hub.dataload.dumper import DumperManager, BaseDumper
+from biothings.hub.dataload.uploader import UploaderManager, BaseSourceUploader
+from biothings.hub.dataplugin.manager import DataPluginManager
+from biothings.hub.dataload.source import SourceManager
+
+
+def create_sources(num, inspect_size):
+    dm = DumperManager(None)
+    um = UploaderManager(job_manager=None)
+    src_dump = get_src_dump()
+    names = []
+    prefix = "bench_source_%s" % get_random_string()
+    for i in range(num):
+        name = "%s_%d" % (prefix, i)
+        dm.register_classes([type("Dumper", (BaseDumper,), {"SRC_NAME" : name})])
+        um.register_classes([type("Uploader", (BaseSourceUploader,), {"name" : name})])
+        # one field per inspected key, ~100 bytes each
+        results = dict([("field%d" % j, {"_type" : "str", "_count" : j, "_stats" : "x" * 60}) \
+                for j in range(inspect_size // 100)])
+        src_dump.insert_one({
+            "_id" : name,
+            "download" : {"status" : "success", "release" : "1"},
+            "upload" : {"jobs" : {name : {"status" : "success", "count" : 1000}}},
+            "inspect" : {"jobs" : {name : {"status" : "success", "inspect" : {"results" : {
+                "type" : results, "mapping" : results}}}}}})
+        names.append(name)
+    with mock.patch.object(SourceManager, "reload"):
+        manager = SourceManager([], dm, um, DataPluginManager(None))
+    return manager, names
+
+
+def main(num=30):
+    src_dump = get_src_dump()
+    for inspect_size in (10000, 100000, 1000000):
+        manager, names = create_sources(num, inspect_size)
+        try:
+            t0 = time.time()
+            manager.get_sources()
+            first = time.time() - t0
+            t0 = time.time()
+            for i in range(10):
+                manager.get_sources()
+            cached = (time.time() - t0) / 10
+            print("%d sources, inspect results %7d bytes: first call %8.3fs, cached %8.4fs" % \
+                    (num, inspect_size * 2, first, cached))
+        finally:
+            for name in names:
+                src_dump.remove({"_id" : name})
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
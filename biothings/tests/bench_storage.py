@@ -0,0 +1,98 @@
+"""
+Throughput of duplicate-tolerant storages, at different duplicate rates
+(documents with an _id already found in the destination collection).
+Compares a plain unordered bulk insert (previous IgnoreDuplicatedStorage
+implementation), IgnoreDuplicatedStorage, and IgnoreDuplicatedStorage with
+an id cache pre-filtering known _ids. Requires a MongoDB server (configured
+source database, a temporary collection is used). Not collected by test
+runners, run with:
+
+    python -m biothings.tests.bench_storage [num_docs]
+"""
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import config, biothings
+biothings.config_for_app(config)
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from biothings.hub.dataload.storage import IgnoreDuplicatedStorage
+from biothings.hub.dataindex.idcache import LocalIDCache
+from biothings.utils.common import get_random_string
+from biothings.utils.mongo import get_src_db, get_src_conn, DummyDatabase
+
+
+class BulkOpStorage(IgnoreDuplicatedStorage):
+    """Unordered bulk op, duplicates reported by server only"""
+
+    def process(self, iterable, batch_size):
+        total = 0
+        for doc_li in self.doc_iterator(iterable, batch=True, batch_size=batch_size):
+            try:
+                bob = self.temp_collection.initialize_unordered_bulk_op()
+                for d in doc_li:
+                    bob.insert(d)
+                total += bob.execute()["nInserted"]
+            except BulkWriteError as e:
+                total += e.details["nInserted"]
+        return total
+
+
+def docs(num, dup_rate):
+    # ids < num * dup_rate are already stored
+    ids = list(range(num))
+    random.shuffle(ids)
+    for i in ids:
+        yield {"_id" : "id%d" % i, "name" : "document %d" % i, "values" : list(range(i % 20))}
+
+
+def bench(num, dup_rate, name, klass, id_cache=None, batch_size=10000):
+    db = get_src_db()
+    col_name = "bench_storage_%s" % get_random_string()
+    existing = int(num * dup_rate)
+    try:
+        if existing:
+            db[col_name].insert_many([d for d in docs(existing, 0)])
+        storage = klass(db, col_name, id_cache=id_cache)
+        t0 = time.time()
+        inserted = storage.process(docs(num, dup_rate), batch_size)
+        elapsed = time.time() - t0
+        assert db[col_name].count() == num, "%s != %s" % (db[col_name].count(), num)
+        print("dups %3d%%  %-28s %10.0f docs/s  (%d inserted)" % \
+              (dup_rate * 100, name, num / elapsed, inserted))
+    finally:
+        db[col_name].drop()
+
+
+def check_server():
+    # without a configured server, connection is silently a dummy one
+    conn = get_src_conn()
+    if isinstance(conn, DummyDatabase):
+        sys.exit("No MongoDB source server configured (DATA_SRC_SERVER, ...), can't benchmark")
+    try:
+        conn.admin.command("ping")
+    except PyMongoError as e:
+        sys.exit("MongoDB server not reachable, can't benchmark: %s" % e)
+
+
+def main(num=200000):
+    check_server()
+    folder = tempfile.mkdtemp()
+    try:
+        for dup_rate in (0, .1, .5):
+            bench(num, dup_rate, "bulk op", BulkOpStorage)
+            bench(num, dup_rate, "IgnoreDuplicatedStorage", IgnoreDuplicatedStorage)
+            cache = LocalIDCache("bench", cache_folder=folder)
+            cache.load([["id%d" % i for i in range(int(num * dup_rate))]])
+            bench(num, dup_rate, "IgnoreDuplicatedStorage+cache", IgnoreDuplicatedStorage, cache)
+            cache.close()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,110 @@
+"""
+Local HTTP server standing for a BioThings API (eg. MyGene.info), answering
+querymany POST requests from documents kept in memory, with an optional
+latency per request. Used by tests and benchmarks, so they don't depend on
+remote APIs:
+
+    with StubBiothingsAPI(docs, latency=.05) as api:
+        client = biothings_client.get_client("gene", url=api.url)
+"""
+import json
+import socketserver
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+from biothings.hub.datatransform import nested_lookup
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubBiothingsAPI(object):
+
+    def __init__(self, docs, latency=0):
+        """
+        docs: list of documents searched by querymany requests
+        latency: seconds added to each request
+        """
+        self.docs = docs
+        self.latency = latency
+        # scope => value => docs
+        self.indices = {}
+        self.num_requests = 0
+        self.queried = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.url = "http://127.0.0.1:%d/v1" % self.server.server_address[1]
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def index(self, scope):
+        if scope not in self.indices:
+            index = {}
+            for doc in self.docs:
+                val = nested_lookup(doc, scope)
+                for v in isinstance(val, list) and val or [val]:
+                    if v is not None:
+                        index.setdefault(str(v), []).append(doc)
+            self.indices[scope] = index
+        return self.indices[scope]
+
+    def search(self, term, scopes):
+        hits = []
+        for scope in scopes:
+            for doc in self.index(scope).get(term, []):
+                if doc not in hits:
+                    hits.append(doc)
+        return hits
+
+    def querymany(self, terms, scopes, fields):
+        res = []
+        for term in terms:
+            hits = self.search(term, scopes)
+            if not hits:
+                res.append({"query" : term, "notfound" : True})
+            for hit in hits:
+                out = {"query" : term, "_id" : hit["_id"]}
+                for field in fields:
+                    val = nested_lookup(hit, field)
+                    if val is not None:
+                        out[field] = val
+                res.append(out)
+        return res
+
+    def handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                params = parse_qs(self.rfile.read(length).decode())
+                terms = [t.strip().strip('"') for t in params.get("q", [""])[0].split(",") if t.strip()]
+                scopes = params.get("scopes", [""])[0].split(",")
+                fields = [f for f in params.get("fields", [""])[0].split(",") if f]
+                time.sleep(api.latency)
+                with api.lock:
+                    api.num_requests += 1
+                    api.queried.extend(terms)
+                    body = json.dumps(api.querymany(terms, scopes, fields)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
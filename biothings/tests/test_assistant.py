@@ -0,0 +1,120 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from biothings.utils.common import get_random_string
+from biothings.utils.hub_db import get_data_plugin
+from biothings.hub.dataload.dumper import DumperManager
+from biothings.hub.dataload.uploader import UploaderManager
+from biothings.hub.dataplugin.manager import DataPluginManager
+from biothings.hub.dataplugin.assistant import AssistantManager, LocalAssistant
+
+PARSER = """
+IMPORTED = True
+
+def load_data(data_folder):
+    yield {"_id" : "doc1", "folder" : data_folder}
+"""
+
+
+class TestLazyPluginLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.patcher = mock.patch.object(biothings.config.conf, "DATA_PLUGIN_FOLDER", self.folder, create=True)
+        self.patcher.start()
+        self.name = "testplugin_%s" % get_random_string()
+        self.plugin_folder = os.path.join(self.folder, self.name)
+        os.makedirs(self.plugin_folder)
+        with open(os.path.join(self.plugin_folder, "parser.py"), "w") as fout:
+            fout.write(PARSER)
+        self.write_manifest({"dumper" : {"data_url" : "http://localhost/data.tsv"},
+                             "uploader" : {"parser" : "parser:load_data"}})
+        self.plugin = {"_id" : self.name,
+                       "plugin" : {"url" : "local://%s" % self.name, "type" : "local", "active" : True},
+                       "download" : {"data_folder" : self.plugin_folder}}
+        get_data_plugin().insert_one(self.plugin)
+        self.manager = AssistantManager(data_plugin_manager=DataPluginManager(None),
+                                        dumper_manager=DumperManager(None),
+                                        uploader_manager=UploaderManager(job_manager=None),
+                                        job_manager=None)
+        self.manager.configure(klasses=[LocalAssistant])
+
+    def tearDown(self):
+        get_data_plugin().remove({"_id" : self.name})
+        sys.path.remove(self.folder)
+        self.patcher.stop()
+        shutil.rmtree(self.folder)
+
+    def write_manifest(self, manifest):
+        with open(os.path.join(self.plugin_folder, "manifest.json"), "w") as fout:
+            json.dump(manifest, fout)
+
+    def load(self):
+        for manager in (self.manager.data_plugin_manager, self.manager.dumper_manager,
+                        self.manager.uploader_manager):
+            manager.register.clear()
+        self.manager.load_plugin(get_data_plugin().find_one({"_id" : self.name}))
+
+    def test_classes_materialized_on_first_use(self):
+        self.load()
+        klass = self.manager.uploader_manager.register[self.name][0]
+        self.assertIn(self.name, self.manager.dumper_manager.register)
+        self.assertFalse(klass.materialized)
+        self.assertNotIn("%s.parser" % self.name, sys.modules)
+        inst = klass(None, self.folder)
+        self.assertTrue(klass.materialized)
+        self.assertTrue(sys.modules["%s.parser" % self.name].IMPORTED)
+        self.assertEqual(list(inst.load_data("somewhere")), [{"_id" : "doc1", "folder" : "somewhere"}])
+
+    def test_worker_only_resolves_parser(self):
+        self.load()
+        klass = self.manager.uploader_manager.register[self.name][0]
+        inst = klass(None, self.folder)
+        # class as seen by a worker forked before it was materialized
+        klass.materialized = False
+        klass.parser_func = None
+        assistant = klass.assistant
+        with mock.patch.object(assistant, "install_requirements", side_effect=AssertionError("pip")), \
+             mock.patch.object(assistant, "invalidate_plugin", side_effect=AssertionError("hub db")):
+            self.assertEqual(list(inst.load_data("somewhere")), [{"_id" : "doc1", "folder" : "somewhere"}])
+            # broken plugin code, worker's job fails without touching anything else
+            klass.parser_func = None
+            klass.manifest = dict(klass.manifest, uploader={"parser" : "parser:missing"})
+            with self.assertRaises(AssertionError) as ctx:
+                list(inst.load_data("somewhere"))
+            self.assertIn("missing", str(ctx.exception))
+
+    def test_manifest_cached(self):
+        self.load()
+        mf = os.path.join(self.plugin_folder, "manifest.json")
+        self.assertEqual(get_data_plugin().find_one({"_id" : self.name})["manifest"]["key"],
+                         os.path.getmtime(mf))
+        # same mtime, cached manifest is used
+        mtime = os.path.getmtime(mf)
+        self.write_manifest({"dumper" : {"data_url" : "http://localhost/data.tsv"}})
+        os.utime(mf, (mtime, mtime))
+        self.load()
+        self.assertIn(self.name, self.manager.uploader_manager.register)
+        # manifest changed, parsed again
+        os.utime(mf, (mtime + 10, mtime + 10))
+        self.load()
+        self.assertNotIn(self.name, self.manager.uploader_manager.register)
+
+    def test_invalid_manifest(self):
+        self.write_manifest({"uploader" : {"parser" : "parser:load_data", "on_duplicates" : "whatever"}})
+        self.load()
+        self.assertNotIn(self.name, self.manager.uploader_manager.register)
+        klass = self.manager.data_plugin_manager.register[self.name][0]
+        self.assertIn("on_duplicates", klass.data_plugin_error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from biothings.utils.common import anyfile, ThreadedDecompressedFile
+from biothings.utils.dataload import tabfile_feeder
+
+
+class TestAnyfile(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = "".join(["id%d\tvalue%d\n" % (i, i * 7) for i in range(100000)]).encode()
+        half = len(self.data) // 2
+        # multi-member gzip, multi-stream xz
+        with open(os.path.join(self.folder, "data.tsv.gz"), "wb") as fout:
+            fout.write(gzip.compress(self.data[:half]) + gzip.compress(self.data[half:]))
+        with open(os.path.join(self.folder, "data.tsv.xz"), "wb") as fout:
+            fout.write(lzma.compress(self.data[:half]) + lzma.compress(self.data[half:]))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def test_read(self):
+        for ext in (".gz", ".xz"):
+            for threaded in (True, False):
+                with anyfile(self.path("data.tsv" + ext), threaded=threaded) as in_f:
+                    self.assertEqual(in_f.read(), self.data.decode())
+                with anyfile(self.path("data.tsv" + ext), threaded=threaded) as in_f:
+                    self.assertEqual(in_f.readline(), "id0\tvalue0\n")
+                    self.assertEqual(len(in_f.readlines()), 99999)
+
+    def test_threaded_default(self):
+        def raw(in_f):
+            return getattr(in_f.buffer, "raw", None)
+        with mock.patch("os.cpu_count", return_value=4):
+            with anyfile(self.path("data.tsv.gz")) as in_f:
+                self.assertIsInstance(raw(in_f), ThreadedDecompressedFile)
+            # measured slower for xz, not used by default
+            with anyfile(self.path("data.tsv.xz")) as in_f:
+                self.assertNotIsInstance(raw(in_f), ThreadedDecompressedFile)
+        with mock.patch("os.cpu_count", return_value=1):
+            with anyfile(self.path("data.tsv.gz")) as in_f:
+                self.assertNotIsInstance(raw(in_f), ThreadedDecompressedFile)
+
+    def test_compressed_file_found(self):
+        # only compressed version exists
+        os.unlink(self.path("data.tsv.xz"))
+        rows = list(tabfile_feeder(self.path("data.tsv"), header=0))
+        self.assertEqual(len(rows), 100000)
+        self.assertEqual(rows[-1], ["id99999", "value699993"])
+        with open(self.path("data.tsv"), "wb") as fout:
+            fout.write(b"plain\n")
+        # uncompressed file is used first
+        self.assertEqual(anyfile(self.path("data.tsv")).read(), "plain\n")
+
+    def test_truncated(self):
+        with open(self.path("data.tsv.gz"), "rb") as fin:
+            data = fin.read()
+        with open(self.path("truncated.gz"), "wb") as fout:
+            fout.write(data[:len(data) // 3])
+        with self.assertRaises(EOFError):
+            anyfile(self.path("truncated.gz"), threaded=True).read()
+
+    def test_large_output(self):
+        # highly compressed data, decompressed by chunks
+        with open(self.path("zeros.gz"), "wb") as fout:
+            fout.write(gzip.compress(b"\x00" * 10000000))
+        f = ThreadedDecompressedFile(self.path("zeros.gz"), "gz", chunk_size=65536, max_chunks=2)
+        self.assertEqual(len(f.read()), 10000000)
+        f.close()
+
+    def test_close_before_end(self):
+        in_f = anyfile(self.path("data.tsv.gz"), threaded=True)
+        in_f.readline()
+        in_f.close()
+        self.assertTrue(in_f.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+import copy
+import locale
+import os
+import shutil
+import tempfile
+import unittest
+
+from biothings.utils.dataload import dict_sweep, value_convert_to_number, dict_walk, \
+                                     merge_struct, hashable_value, file_byte_ranges, \
+                                     tabfile_feeder
+
+
+def deep_doc(depth, leaf):
+    doc = {"leaf" : leaf}
+    for i in range(depth):
+        doc = {"level%d" % i : doc}
+    return doc
+
+
+class TestDictSweep(unittest.TestCase):
+
+    def test_scalars(self):
+        d = {"a" : ".", "b" : "-", "c" : "", "d" : "NA", "e" : "none", "f" : " ",
+             "g" : "Not Available", "h" : "unknown", "i" : "value", "j" : 0, "k" : None}
+        res = dict_sweep(d)
+        # input is modified in place
+        self.assertIs(res,d)
+        self.assertEqual(res,{"i" : "value", "j" : 0, "k" : None})
+
+    def test_custom_vals(self):
+        d = {"a" : None, "b" : "NA", "c" : [None, 1]}
+        self.assertEqual(dict_sweep(d,vals=[None]),{"b" : "NA", "c" : [1]})
+
+    def test_nested_dicts(self):
+        d = {"a" : {"b" : {"c" : "NA"}, "d" : 1}, "e" : {"f" : {"g" : {}}}}
+        self.assertEqual(dict_sweep(d),{"a" : {"d" : 1}})
+
+    def test_lists(self):
+        d = {"a" : ["NA", "x", "-", "y"], "b" : ["NA", "."], "c" : [], "d" : [{"e" : "NA"}, {"f" : 1}]}
+        # empty dicts in lists are kept
+        self.assertEqual(dict_sweep(d),{"a" : ["x", "y"], "d" : [{}, {"f" : 1}]})
+
+    def test_adjacent_matches(self):
+        # list.remove() while iterating used to skip adjacent values
+        d = {"a" : ["NA", "NA", "x", "NA", "NA"], "b" : [None, None]}
+        self.assertEqual(dict_sweep(d,vals=["NA",None]),{"a" : ["x"]})
+
+    def test_remove_invalid_list(self):
+        vals = [".", "-", "", "NA", "none", " ", "Not Available", "unknown", None]
+        doc = {'gene': [None, None], 'site': ["Intron", None], 'snp_build' : 136}
+        lst = doc["site"]
+        d = dict_sweep(copy.deepcopy(doc),vals,remove_invalid_list=True)
+        self.assertEqual(d,{'site': ['Intron'], 'snp_build': 136})
+        # lists are modified in place unless remove_invalid_list
+        d = dict_sweep(doc,vals)
+        self.assertEqual(d,{'site': ['Intron'], 'snp_build': 136})
+        self.assertIs(d["site"],lst)
+
+    def test_nested_lists_untouched(self):
+        d = {"a" : [["NA"], "NA"], "b" : ({"c" : "NA"},)}
+        self.assertEqual(dict_sweep(d),{"a" : [["NA"]], "b" : ({"c" : "NA"},)})
+
+    def test_shared_dict(self):
+        shared = {"x" : "NA"}
+        d = {"a" : shared, "b" : shared, "c" : {"d" : shared}}
+        self.assertEqual(dict_sweep(d),{})
+
+    def test_deep(self):
+        d = deep_doc(5000,"NA")
+        d["keep"] = 1
+        self.assertEqual(dict_sweep(d),{"keep" : 1})
+
+
+class TestValueConvertToNumber(unittest.TestCase):
+
+    def test_convert(self):
+        d = {"a" : "1", "b" : "1.5", "c" : "1e3", "d" : "abc", "e" : " 2 ", "f" : 3,
+             "g" : None, "h" : "", "i" : "nan"}
+        res = value_convert_to_number(d)
+        self.assertIs(res,d)
+        self.assertEqual(res["a"],1)
+        self.assertEqual(type(res["a"]),int)
+        self.assertEqual(res["b"],1.5)
+        self.assertEqual(res["c"],1000.0)
+        self.assertEqual(res["d"],"abc")
+        self.assertEqual(res["e"],2)
+        self.assertEqual(res["f"],3)
+        self.assertEqual(res["g"],None)
+        self.assertEqual(res["h"],"")
+        self.assertNotEqual(res["i"],res["i"]) # float nan
+
+    def test_lists_tuples(self):
+        d = {"a" : ["1", "x", {"b" : "2"}, ["3"]], "c" : ("4", {"d" : "5"})}
+        self.assertEqual(value_convert_to_number(d),
+                         {"a" : [1, "x", {"b" : 2}, ["3"]], "c" : (4, {"d" : 5})})
+
+    def test_skipped_keys(self):
+        d = {"id" : "1", "a" : {"id" : "2", "v" : "3"}, "l" : ["4"],
+             "skip" : {"v" : "5"}, "skiplist" : ["6", {"v" : "7"}]}
+        res = value_convert_to_number(d,skipped_keys=["id","skip","skiplist"])
+        # dict values are converted whatever their key, but lists
+        # under skipped keys are left untouched
+        self.assertEqual(res,{"id" : "1", "a" : {"id" : "2", "v" : 3}, "l" : [4],
+                              "skip" : {"v" : 5}, "skiplist" : ["6", {"v" : "7"}]})
+
+    def test_deep(self):
+        d = deep_doc(5000,"42")
+        value_convert_to_number(d)
+        for i in reversed(range(5000)):
+            d = d["level%d" % i]
+        self.assertEqual(d,{"leaf" : 42})
+
+
+class TestDictWalk(unittest.TestCase):
+
+    def test_walk(self):
+        d = {"a" : {"b" : 1, "c" : [{"d" : 2}]}, "e" : "f"}
+        res = dict_walk(d,str.upper)
+        self.assertEqual(res,{"A" : {"B" : 1, "C" : [{"d" : 2}]}, "E" : "f"})
+        self.assertEqual(list(res),["A","E"])
+        # original untouched, lists values are shared
+        self.assertEqual(d,{"a" : {"b" : 1, "c" : [{"d" : 2}]}, "e" : "f"})
+        self.assertIs(res["A"]["C"],d["a"]["c"])
+        self.assertEqual(dict_walk("notadict",str.upper),"notadict")
+
+    def test_deep(self):
+        res = dict_walk(deep_doc(5000,1),str.upper)
+        for i in reversed(range(5000)):
+            res = res["LEVEL%d" % i]
+        self.assertEqual(res,{"LEAF" : 1})
+
+
+class TestMergeStruct(unittest.TestCase):
+
+    def test_hashable_value(self):
+        self.assertEqual(hashable_value({"a" : [1, {"b" : 2}], "c" : 3}),
+                         hashable_value({"c" : 3, "a" : [1, {"b" : 2}]}))
+        self.assertNotEqual(hashable_value([1,2]),hashable_value((1,2)))
+        self.assertNotEqual(hashable_value([1,2]),hashable_value([2,1]))
+        self.assertNotEqual(hashable_value({"a" : 1}),hashable_value([("a",1)]))
+        self.assertRaises(TypeError,hashable_value,[{1,2}])
+
+    def test_lists(self):
+        v1 = [{"a" : 1}, "x", 1]
+        v2 = [1, "y", {"a" : 1}, {"a" : 2}, "y"]
+        res = merge_struct(v1,v2)
+        # order is kept, v1 first, duplicates within v2 are kept
+        self.assertEqual(res,[{"a" : 1}, "x", 1, "y", {"a" : 2}, "y"])
+        self.assertEqual(v1,[{"a" : 1}, "x", 1])
+        self.assertEqual(merge_struct([1,2],3),[1,2,3])
+        self.assertEqual(merge_struct([1,2],2),[1,2])
+        self.assertEqual(merge_struct("a","b"),["a","b"])
+        self.assertEqual(merge_struct(1,[2]),[2,1])
+
+    def test_large_lists(self):
+        v1 = [{"id" : i, "vals" : [i, str(i)]} for i in range(20000)]
+        v2 = [{"id" : i, "vals" : [i, str(i)]} for i in range(10000,30000)]
+        res = merge_struct({"k" : v1},{"k" : v2})
+        self.assertEqual(res["k"],[{"id" : i, "vals" : [i, str(i)]} for i in range(30000)])
+
+    def test_unhashable(self):
+        v1 = [{1,2}] + list(range(20))
+        v2 = list(range(10,30)) + [{1,2}, {3}]
+        self.assertEqual(merge_struct(v1,v2),[{1,2}] + list(range(30)) + [{3}])
+
+    def test_nested_dicts(self):
+        d1 = {"_id" : "1", "a" : {"b" : [1, 2], "c" : "x"}, "d" : 1}
+        d2 = {"_id" : "1", "a" : {"b" : [2, 3], "c" : "y"}, "e" : 2}
+        self.assertEqual(merge_struct(d1,d2),
+                         {"_id" : "1", "a" : {"b" : [1, 2, 3], "c" : ["x", "y"]}, "d" : 1, "e" : 2})
+        d1 = {"a" : {"b" : 1}}
+        d2 = {"a" : [{"b" : 2}]}
+        self.assertEqual(merge_struct(d1,d2,aslistofdict="a"),{"a" : [{"b" : 1}, {"b" : 2}]})
+
+    def test_aggregate(self):
+        agg = {}
+        doc = {"_id" : "1", "l" : [{"v" : 0}]}
+        lst = doc["l"]
+        for i in range(1,1000):
+            doc = merge_struct(doc,{"_id" : "1", "l" : [{"v" : i}, {"v" : i-1}, {"v" : i}]},aggregate=agg)
+        # lists are extended in place, duplicates within merged lists are removed
+        self.assertIs(doc["l"],lst)
+        self.assertEqual(lst,[{"v" : i} for i in range(1000)])
+        # list modified outside merge_struct, index is rebuilt
+        lst.append({"v" : "ext"})
+        merge_struct(doc,{"l" : [{"v" : "ext"}, 1]},aggregate=agg)
+        self.assertEqual(lst[-2:],[{"v" : "ext"}, 1])
+
+
+class TestFileByteRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.folder, "data.tsv")
+        # variable line lengths, non-ascii chars
+        # files are read with locale's encoding (see anyfile()), non-ascii chars if it can
+        self.encoding = locale.getpreferredencoding(False)
+        char = "é".encode(self.encoding, "replace").decode(self.encoding).replace("?", "e")
+        self.rows = [["id%d" % i, char * (i % 50), str(i)] for i in range(10000)]
+        self.write(self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, rows, trailing="\n", newline=None):
+        with open(self.datafile, "w", encoding=self.encoding, newline=newline) as fout:
+            fout.write("id\tvalue\tnum\n")
+            fout.write("\n".join(["\t".join(r) for r in rows]) + trailing)
+
+    def test_ranges_aligned(self):
+        content = open(self.datafile, "rb").read()
+        for num in (1, 2, 7, 32):
+            ranges = file_byte_ranges(self.datafile, num)
+            self.assertEqual(len(ranges), num)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(content))
+            for (s1, e1), (s2, e2) in zip(ranges, ranges[1:]):
+                self.assertEqual(e1, s2)
+                self.assertEqual(content[s2 - 1:s2], b"\n")
+
+    def test_feeder_by_ranges(self):
+        for trailing in ("\n", ""):
+            self.write(self.rows, trailing)
+            rows = []
+            for byte_range in file_byte_ranges(self.datafile, 13):
+                rows.extend(tabfile_feeder(self.datafile, byte_range=byte_range))
+            self.assertEqual(rows, self.rows)
+
+    def test_decoded_as_whole_file(self):
+        for newline in ("\r\n", "\r"):
+            self.write(self.rows, newline=newline)
+            whole = list(tabfile_feeder(self.datafile))
+            rows = [r for rng in file_byte_ranges(self.datafile, 13)
+                      for r in tabfile_feeder(self.datafile, byte_range=rng)]
+            self.assertEqual(whole, self.rows)
+            self.assertEqual(rows, whole)
+
+    def test_quoted_newline(self):
+        rows = [r[:] for r in self.rows]
+        rows[5000][1] = '"multi\nline"'
+        self.write(rows)
+        self.assertEqual(list(tabfile_feeder(self.datafile))[5000][1], "multi\nline")
+        for num in (1, 13, 50):
+            with self.assertRaises(ValueError):
+                for rng in file_byte_ranges(self.datafile, num):
+                    list(tabfile_feeder(self.datafile, byte_range=rng))
+
+    def test_small_files(self):
+        self.write([["a", "b", "c"]])
+        # one range per line at most
+        ranges = file_byte_ranges(self.datafile, 100)
+        self.assertEqual(ranges, [(0, 13), (13, 19)])
+        rows = [r for rng in ranges for r in tabfile_feeder(self.datafile, byte_range=rng)]
+        self.assertEqual(rows, [["a", "b", "c"]])
+        open(self.datafile, "w").close()
+        self.assertEqual(file_byte_ranges(self.datafile, 4), [(0, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import copy
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import networkx as nx
+
+from biothings.hub.datatransform import DataTransformMDB, MongoDBEdge, RegExEdge, nested_lookup
+from biothings.hub.datatransform import datatransform_mdb
+
+
+class FakeCollection(object):
+    """Collection answering $in queries from a list of docs, counting queried ids"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queried = []
+
+    def find(self, query, projection=None):
+        (lookup, cond), = query.items()
+        self.queried.extend(cond["$in"])
+        return [copy.deepcopy(d) for d in self.docs if nested_lookup(d, lookup) in cond["$in"]]
+
+
+def make_graph():
+    # ensembl -> entrez -> symbol, entrez ids are fanning out for some ensembl ids
+    cols = {"ensembl2entrez" : FakeCollection([{"ensembl" : "ENSG%d" % i, "entrez" : str(i)} for i in range(100)] +
+                                              [{"ensembl" : "ENSG%d" % i, "entrez" : str(i + 1000)} for i in range(0, 100, 10)]),
+            "entrez2symbol" : FakeCollection([{"entrez" : str(i), "symbol" : "SYM%d" % i} for i in range(0, 2000, 2)])}
+    G = nx.DiGraph()
+    G.add_edge("ensembl", "entrez", object=MongoDBEdge("ensembl2entrez", "ensembl", "entrez"))
+    G.add_edge("entrez", "symbol", object=MongoDBEdge("entrez2symbol", "entrez", "symbol"))
+    G.add_edge("rawensembl", "ensembl", object=RegExEdge("^ens:", ""))
+    for (v1, v2) in G.edges():
+        edge = G.edges[v1, v2]["object"]
+        if isinstance(edge, MongoDBEdge):
+            edge._state["collection"] = cols[edge.collection_name]
+    return G, cols
+
+
+class UncachedDataTransformMDB(DataTransformMDB):
+
+    def _edge_lookup(self, edge_obj, id_strct):
+        return edge_obj.edge_lookup(self, id_strct)
+
+
+class EvictingDataTransformMDB(DataTransformMDB):
+    edge_cache_size = 10
+
+
+def load_data(num):
+    for i in range(num):
+        yield {"_id" : "ens:ENSG%d" % (i % 150), "value" : i}
+
+
+class TestEdgeCache(unittest.TestCase):
+
+    def convert(self, klass, num=300, **kwargs):
+        G, cols = make_graph()
+        dt = klass(G, input_types=["rawensembl"], output_types=["symbol", "ensembl"], **kwargs)
+        dt.batch_size = 50
+        docs = list(dt(load_data)(num))
+        return docs, cols, dt
+
+    def test_same_conversions(self):
+        cached, cached_cols, _ = self.convert(DataTransformMDB)
+        uncached, uncached_cols, _ = self.convert(UncachedDataTransformMDB)
+        key = lambda d: (d["value"], d["_id"])
+        self.assertEqual(sorted(cached, key=key), sorted(uncached, key=key))
+        self.assertIn({"_id" : "SYM10", "value" : 10}, cached)
+        self.assertIn({"_id" : "SYM1010", "value" : 10}, cached)
+        # no entrez/symbol, ensembl kept
+        self.assertIn({"_id" : "ENSG1", "value" : 1}, cached)
+        self.assertIn({"_id" : "ENSG120", "value" : 120}, cached)
+        # ids are looked up once per upload, found or not
+        for name in ("ensembl2entrez", "entrez2symbol"):
+            queried = cached_cols[name].queried
+            self.assertEqual(len(queried), len(set(queried)))
+            self.assertLess(len(queried), len(uncached_cols[name].queried))
+
+    def test_eviction(self):
+        docs, _, dt = self.convert(EvictingDataTransformMDB)
+        self.assertTrue(all([len(c) <= 10 for c in dt.edge_cache.values()]))
+        ref, _, _ = self.convert(UncachedDataTransformMDB)
+        self.assertEqual(len(docs), len(ref))
+
+    def test_copy_on_fanout(self):
+        G, _ = make_graph()
+        dt = DataTransformMDB(G, input_types=["rawensembl"], output_types=["symbol"])
+        docs = [{"_id" : "ens:ENSG2", "sub" : {"v" : 1}}, {"_id" : "ens:ENSG20", "sub" : {"v" : 2}}]
+        res = list(dt.key_lookup_batch(list(docs)))
+        # single hit, same document
+        self.assertIs(res[0], docs[0])
+        self.assertEqual(res[0]["_id"], "SYM2")
+        # fanned out, one copy, not sharing sub-documents
+        self.assertEqual(sorted([d["_id"] for d in res[1:]]), ["SYM1020", "SYM20"])
+        self.assertIsNot(res[1]["sub"], res[2]["sub"])
+
+
+def make_dense_graph(num_nodes):
+    # every node linked to every other one, weight is the distance between them
+    G = nx.DiGraph()
+    for i in range(num_nodes):
+        for j in range(num_nodes):
+            if i != j:
+                G.add_edge("n%d" % i, "n%d" % j, object=RegExEdge("x", "x", weight=abs(i - j)))
+    return G
+
+
+class TestPathTable(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # config module may have been re-created by other tests, patch the one used
+        self.patcher = mock.patch.object(datatransform_mdb.btconfig, "CACHE_FOLDER", self.folder)
+        self.patcher.start()
+        datatransform_mdb._path_tables.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+        datatransform_mdb._path_tables.clear()
+        shutil.rmtree(self.folder)
+
+    def test_same_paths(self):
+        G = make_dense_graph(5)
+        dt = DataTransformMDB(G, input_types=["n0", "n2"], output_types=["n4", "n1"],
+                              max_path_hops=10)
+        for (start, target), paths in dt.paths.items():
+            expected = sorted(nx.all_simple_paths(G, start, target), key=dt._compute_path_weight)
+            self.assertEqual(paths, expected)
+
+    def test_bounded(self):
+        G = make_dense_graph(30)
+        dt = DataTransformMDB(G, input_types=["n0"], output_types=["n29"], max_path_hops=3, max_path_weight=30)
+        paths = dt.paths[("n0", "n29")]
+        self.assertTrue(all([len(p) <= 4 and dt._compute_path_weight(p) <= 30 for p in paths]))
+        self.assertIn(["n0", "n29"], paths)
+        self.assertIn(["n0", "n10", "n29"], paths)
+        # too long
+        self.assertNotIn(["n0", "n1", "n2", "n3", "n29"], paths)
+        # too heavy
+        self.assertNotIn(["n0", "n28", "n1", "n29"], paths)
+        # all paths within limits
+        expected = [p for p in nx.all_simple_paths(G, "n0", "n29", cutoff=3) if dt._compute_path_weight(p) <= 30]
+        self.assertEqual(sorted(paths), sorted(expected))
+
+    def test_persisted(self):
+        G, _ = make_graph()
+        dt = DataTransformMDB(G, input_types=["rawensembl"], output_types=["symbol"])
+        graph_hash = dt.graph_hash()
+        path_file = dt.path_table_file(graph_hash)
+        self.assertTrue(os.path.exists(path_file))
+        self.assertEqual(dt.paths[("rawensembl", "symbol")], [["rawensembl", "ensembl", "entrez", "symbol"]])
+        # another process: loaded, not computed
+        datatransform_mdb._path_tables.clear()
+        with mock.patch.object(DataTransformMDB, "_compute_paths", side_effect=AssertionError("computed")):
+            other = DataTransformMDB(make_graph()[0], input_types=["rawensembl"], output_types=["symbol"])
+        self.assertEqual(other.paths, dt.paths)
+        # graph changed, new table
+        G.edges["entrez", "symbol"]["object"].weight = 2
+        changed = DataTransformMDB(G, input_types=["rawensembl"], output_types=["symbol"])
+        self.assertNotEqual(changed.graph_hash(), graph_hash)
+        self.assertEqual(len(os.listdir(os.path.dirname(path_file))), 2)
+
+
+class IndexedCollection(object):
+    """Collection answering $in queries from an index, counting queries"""
+
+    def __init__(self, lookup, docs):
+        self.index = {}
+        for doc in docs:
+            self.index.setdefault(doc[lookup], []).append(doc)
+        self.num_queries = 0
+
+    def find(self, query, projection=None):
+        (lookup, cond), = query.items()
+        self.num_queries += 1
+        if not isinstance(cond, dict):
+            cond = {"$in" : [cond]}
+        return [d for _id in cond["$in"] for d in self.index.get(_id, [])]
+
+
+def make_random_graph(num_ids, seed=42):
+    # a -> b -> c and a -> d -> c (heavier), some ids fan out, some are missing
+    rand = random.Random(seed)
+    def docs(src, dst, ratio):
+        res = []
+        for i in range(num_ids):
+            for j in range(rand.random() < ratio and rand.choice([1, 1, 2, 3]) or 0):
+                res.append({src : "%s%d" % (src, i), dst : "%s%d" % (dst, rand.randint(0, num_ids))})
+        return res
+    G = nx.DiGraph()
+    for (v1, v2, weight, ratio) in (("a", "b", 1, .8), ("b", "c", 1, .8), ("a", "d", 2, .9), ("d", "c", 2, .7)):
+        edge = MongoDBEdge("%s2%s" % (v1, v2), v1, v2, weight=weight)
+        edge._state["collection"] = IndexedCollection(v1, docs(v1, v2, ratio))
+        G.add_edge(v1, v2, object=edge)
+    return G
+
+
+def convert_per_doc(dt, doc):
+    """Reference conversion, one document and one id at a time"""
+    for output_type in dt.output_types:
+        for (input_type, field) in dt.input_types:
+            for path in dt.paths[(input_type, output_type)]:
+                keys = [nested_lookup(doc, field)]
+                for (v1, v2) in nx.utils.pairwise(path):
+                    edge = dt.G.edges[v1, v2]["object"]
+                    new_keys = []
+                    for key in keys:
+                        for d in edge.collection.find({edge.lookup : key}):
+                            if d[edge.field] not in new_keys:
+                                new_keys.append(d[edge.field])
+                    keys = new_keys
+                if keys:
+                    return [dict(doc, _id=k) for k in keys]
+    return [doc]
+
+
+class TestBatchLookup(unittest.TestCase):
+
+    def test_edge_lookup_batch(self):
+        edge = MongoDBEdge("col", "a.id", "b")
+        edge._state["collection"] = FakeCollection([{"a" : {"id" : "a1"}, "b" : ["b1", "b2"]},
+                                                    {"a" : {"id" : "a1"}, "b" : "b1"},
+                                                    {"a" : {"id" : "a2"}, "b" : None}])
+        self.assertEqual(edge.edge_lookup_batch(None, ["a1", "a2", "a3"]), {"a1" : ["b1", "b2"]})
+
+    def test_same_conversions(self):
+        num = 100000
+        G = make_random_graph(num)
+        collections = [G.edges[e]["object"].collection for e in G.edges()]
+        dt = DataTransformMDB(G, input_types=["a"], output_types=["c"])
+        docs = [{"_id" : "a%d" % i, "n" : i} for i in range(num)]
+        res = list(dt(lambda: iter(copy.deepcopy(docs)))())
+        batch_queries = sum([col.num_queries for col in collections])
+        expected = [d for doc in copy.deepcopy(docs) for d in convert_per_doc(dt, doc)]
+        per_doc_queries = sum([col.num_queries for col in collections]) - batch_queries
+        key = lambda d: (d["n"], d["_id"])
+        self.assertEqual(sorted(res, key=key), sorted(expected, key=key))
+        # some converted through the heavier path, some not converted
+        self.assertTrue([d for d in res if d["_id"].startswith("a")])
+        # one query per edge and batch
+        self.assertEqual(batch_queries, 4 * num / dt.batch_size)
+        self.assertGreater(per_doc_queries, 2 * num)
+        # hits/misses per edge, in aggregate
+        hist = dt.histogram
+        self.assertEqual(hist.edge_histogram["a-->b"] + hist.edge_miss_histogram["a-->b"], num)
+        self.assertEqual(hist.edge_histogram["a-->d"] + hist.edge_miss_histogram["a-->d"],
+                         num - hist.edge_histogram["b-->c"])
+        self.assertEqual(hist.io_histogram["('a', '_id')-->c"], len(res) - (num - hist.edge_histogram["b-->c"]
+                                                                           - hist.edge_histogram["d-->c"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
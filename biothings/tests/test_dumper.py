@@ -0,0 +1,436 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import base64
+import hashlib
+import os
+import time
+import re
+import shutil
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from biothings.hub.dataload.dumper import HTTPDumper, FTPDumper, DumperException, \
+                                          ftp_sessions, FTPSessionPool, BaseDumper, \
+                                          FilesystemDumper, GitDumper
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    FTPHandler = object
+
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubFileHandler(BaseHTTPRequestHandler):
+    """
+    Serve server.content for any path, supporting byte-range requests if
+    server.ranges is set. The first server.drops responses (range responses
+    only, if supported) are interrupted after server.drop_after bytes
+    (connection closed mid-transfer).
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        content = server.content
+        start, end = 0, len(content) - 1
+        rng = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(rng)
+        if rng and server.ranges:
+            m = re.match(r"bytes=(\d+)-(\d*)", rng)
+            start = int(m.group(1))
+            end = m.group(2) and int(m.group(2)) or end
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(content)))
+        else:
+            self.send_response(200)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if server.etag:
+            self.send_header("ETag", server.etag)
+        if server.digest:
+            self.send_header("Digest", server.digest)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        data = content[start:end + 1]
+        with server.lock:
+            drop = server.drops > 0 and len(data) > server.drop_after and \
+                    (rng or not server.ranges)
+            if drop:
+                server.drops -= 1
+        if drop:
+            data = data[:server.drop_after]
+        try:
+            self.wfile.write(data)
+            self.wfile.flush()
+        except ConnectionError:
+            pass
+        if drop:
+            self.close_connection = True
+
+
+class DummyHTTPDumper(HTTPDumper):
+    SRC_NAME = "test_http_dumper"
+    CHUNK_SIZE = 16 * 1024
+    SEGMENT_MIN_SIZE = 256 * 1024
+    MAX_SEGMENTS = 4
+    STATE_SAVE_INTERVAL = 0
+
+
+class TestHTTPDumper(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = ThreadedHTTPServer(("localhost", 0), StubFileHandler)
+        self.server.content = os.urandom(1024 * 1024 + 123)
+        self.server.ranges = True
+        self.server.etag = '"v1"'
+        self.server.digest = None
+        self.server.drops = 0
+        self.server.drop_after = 50000
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://localhost:%s/data.bin" % self.server.server_address[1]
+        self.localfile = os.path.join(self.folder, "release", "data.bin")
+        DummyHTTPDumper.DOWNLOAD_RETRIES = 5
+        self.dumper = DummyHTTPDumper(src_root_folder=self.folder)
+        # don't wait between retries
+        self.sleep = biothings.hub.dataload.dumper.time.sleep
+        biothings.hub.dataload.dumper.time.sleep = lambda s: None
+
+    def tearDown(self):
+        biothings.hub.dataload.dumper.time.sleep = self.sleep
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def assertDownloaded(self):
+        self.assertEqual(open(self.localfile, "rb").read(), self.server.content)
+        self.assertEqual(os.listdir(os.path.dirname(self.localfile)), ["data.bin"])
+
+    def test_parallel_segments(self):
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        # first request gives headers, then one request per segment
+        self.assertEqual(self.server.requests[0], None)
+        self.assertEqual(sorted(self.server.requests[1:]),
+                         ["bytes=0-262174", "bytes=262175-524349",
+                          "bytes=524350-786524", "bytes=786525-1048698"])
+
+    def test_disconnects_are_resumed(self):
+        self.server.drops = 6
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        self.assertEqual(len(self.server.requests), 1 + 4 + 6)
+
+    def test_resume_partial_download(self):
+        DummyHTTPDumper.DOWNLOAD_RETRIES = 0
+        self.server.drops = 4
+        with self.assertRaises(Exception):
+            self.dumper.download(self.url, self.localfile)
+        self.assertTrue(os.path.exists(self.localfile + ".part.state"))
+        self.assertFalse(os.path.exists(self.localfile))
+        self.server.requests = []
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        # only missing data was downloaded
+        self.assertEqual(sorted(self.server.requests[1:]),
+                         ["bytes=312175-524349", "bytes=50000-262174",
+                          "bytes=574350-786524", "bytes=836525-1048698"])
+
+    def test_remote_changed(self):
+        DummyHTTPDumper.DOWNLOAD_RETRIES = 0
+        self.server.drops = 4
+        with self.assertRaises(Exception):
+            self.dumper.download(self.url, self.localfile)
+        # new version, partial download can't be used anymore
+        self.server.content = self.server.content[::-1]
+        self.server.etag = '"v2"'
+        self.server.requests = []
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        self.assertIn("bytes=0-262174", self.server.requests)
+
+    def test_no_validator(self):
+        # no ETag nor Last-Modified, a remote change can't be detected
+        DummyHTTPDumper.DOWNLOAD_RETRIES = 0
+        self.server.etag = None
+        self.server.drops = 4
+        with self.assertRaises(Exception):
+            self.dumper.download(self.url, self.localfile)
+        self.server.content = self.server.content[::-1]
+        self.server.requests = []
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        self.assertIn("bytes=0-262174", self.server.requests)
+
+    def test_no_ranges(self):
+        self.server.ranges = False
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        self.assertEqual(self.server.requests, [None])
+        # connection closed before the end
+        self.server.drops = 1
+        with self.assertRaises(DumperException):
+            self.dumper.download(self.url, self.localfile + "2")
+        self.assertFalse(os.path.exists(self.localfile + "2"))
+        self.assertFalse(os.path.exists(self.localfile + "2.part"))
+
+    def test_small_file(self):
+        # below SEGMENT_MIN_SIZE, initial response is used, no range request
+        self.server.content = self.server.content[:100000]
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        self.assertEqual(self.server.requests, [None])
+
+    def test_checksum(self):
+        digest = base64.b64encode(hashlib.sha256(self.server.content).digest()).decode()
+        self.server.digest = "SHA-256=%s" % digest
+        self.dumper.download(self.url, self.localfile)
+        self.assertDownloaded()
+        os.unlink(self.localfile)
+        self.server.digest = "SHA-256=%s" % base64.b64encode(b"0" * 32).decode()
+        with self.assertRaisesRegex(DumperException, "Checksum mismatch"):
+            self.dumper.download(self.url, self.localfile)
+        self.assertEqual(os.listdir(os.path.dirname(self.localfile)), [])
+
+
+class RecordingFTPHandler(FTPHandler):
+    """Record commands sent to the server (server.commands)"""
+
+    def pre_process_command(self, line, cmd, arg):
+        self.server.commands.append(cmd)
+        super(RecordingFTPHandler, self).pre_process_command(line, cmd, arg)
+
+
+class NoMLSDFTPHandler(RecordingFTPHandler):
+
+    def ftp_MLSD(self, path):
+        self.respond("500 Command \"MLSD\" not understood.")
+
+
+@unittest.skipIf(FTPHandler is object, "pyftpdlib not installed")
+class TestFTPDumper(unittest.TestCase):
+
+    handler = RecordingFTPHandler
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.remote = os.path.join(self.folder, "remote")
+        os.makedirs(os.path.join(self.remote, "data", "chr"))
+        self.files = ["chr/chr%d.txt" % i for i in range(1, 23)]
+        mtime = time.time() - 3600
+        for f in self.files:
+            path = os.path.join(self.remote, "data", f)
+            with open(path, "w") as fout:
+                fout.write("%s\n" % f * 100)
+            os.utime(path, (mtime, mtime))
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(self.remote)
+        handler = type("handler", (self.handler,), {"authorizer" : authorizer})
+        self.server = ThreadedFTPServer(("localhost", 0), handler)
+        self.server.commands = []
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        ftp_sessions.clear()
+        klass = type("dumper", (FTPDumper,), {"SRC_NAME" : "test_ftp_dumper",
+                                              "FTP_HOST" : "localhost",
+                                              "CWD_DIR" : "/data"})
+        # FTP_HOST doesn't contain port, tell ftplib which one to use
+        self.port = FTPDumper.__init__.__globals__["FTP"].port
+        FTPDumper.__init__.__globals__["FTP"].port = self.server.address[1]
+        self.dumper = klass(src_root_folder=self.folder)
+        self.local = os.path.join(self.folder, "local")
+
+    def serve(self):
+        # server must be closed from its own thread
+        while not self.stop.is_set():
+            self.server.serve_forever(timeout=0.01, blocking=False)
+        self.server.close_all()
+
+    def tearDown(self):
+        ftp_sessions.clear()
+        ftp_sessions.idle_timeout = FTPSessionPool().idle_timeout
+        FTPDumper.__init__.__globals__["FTP"].port = self.port
+        self.stop.set()
+        self.thread.join()
+        shutil.rmtree(self.folder)
+
+    def commands(self, cmd):
+        return len([c for c in self.server.commands if c == cmd])
+
+    def download_all(self):
+        for f in self.files:
+            if self.dumper.remote_is_better(f, os.path.join(self.local, f)):
+                res = self.dumper.download(f, os.path.join(self.local, f))
+                # MDTM status code, even if not sent
+                self.assertEqual(res, "213")
+
+    def test_sessions_reused(self):
+        self.download_all()
+        for f in self.files:
+            self.assertEqual(open(os.path.join(self.local, f)).read(),
+                             open(os.path.join(self.remote, "data", f)).read())
+        # one login for all files
+        self.assertEqual(self.commands("USER"), 1)
+        self.assertEqual(self.commands("RETR"), len(self.files))
+        self.assertEqual(len(ftp_sessions.sessions[self.dumper.session_key]), 1)
+
+    def test_metadata_from_listing(self):
+        self.download_all()
+        self.assertEqual(self.commands("MLSD"), 1)
+        self.assertEqual(self.commands("MDTM"), 0)
+        self.assertEqual(self.commands("SIZE"), 0)
+        # mtime was set from listing
+        for f in self.files:
+            self.assertEqual(int(os.stat(os.path.join(self.local, f)).st_mtime),
+                             int(os.stat(os.path.join(self.remote, "data", f)).st_mtime))
+        # nothing newer, nothing to download
+        self.server.commands = []
+        self.download_all()
+        self.assertEqual(self.commands("RETR"), 0)
+        # bigger remote file
+        with open(os.path.join(self.remote, "data", self.files[3]), "a") as fout:
+            fout.write("more")
+        self.dumper.remote_listing = {}
+        self.server.commands = []
+        self.download_all()
+        self.assertEqual(self.commands("RETR"), 1)
+        self.assertEqual(self.commands("MLSD"), 1)
+
+    def test_dead_session_replaced(self):
+        self.download_all()
+        client = ftp_sessions.sessions[self.dumper.session_key][0][0]
+        # connection lost (eg. closed by server)
+        client.sock.shutdown(socket.SHUT_RDWR)
+        self.dumper.client.sendcmd("NOOP")
+        self.assertEqual(self.commands("USER"), 2)
+
+    def test_pool_ignored_after_fork(self):
+        self.download_all()
+        ftp_sessions.pid = -1
+        self.dumper.client.sendcmd("NOOP")
+        self.assertEqual(self.commands("USER"), 2)
+
+    def test_idle_sessions_reaped(self):
+        ftp_sessions.idle_timeout = 0.1
+        self.download_all()
+        self.assertEqual(self.commands("QUIT"), 0)
+        time.sleep(0.5)
+        self.assertEqual(ftp_sessions.sessions, {})
+        self.assertEqual(ftp_sessions.reaper, None)
+        self.assertEqual(self.commands("QUIT"), 1)
+
+    def test_sessions_closed_after_dump(self):
+        @asyncio.coroutine
+        def dump(dumper, *args, **kwargs):
+            self.download_all()
+            return "done"
+        with mock.patch.object(BaseDumper, "dump", dump):
+            res = asyncio.get_event_loop().run_until_complete(self.dumper.dump())
+        self.assertEqual(res, "done")
+        self.assertEqual(ftp_sessions.sessions, {})
+        self.assertEqual(ftp_sessions.reaper, None)
+        self.assertEqual(self.commands("QUIT"), 1)
+
+class TestFTPDumperWithoutMLSD(TestFTPDumper):
+
+    handler = NoMLSDFTPHandler
+
+    def test_metadata_from_listing(self):
+        self.download_all()
+        # MLSD is tried once per folder
+        self.assertEqual(self.commands("MLSD"), 1)
+        self.assertEqual(self.commands("MDTM"), len(self.files))
+        self.assertEqual(self.commands("SIZE"), 0)
+        self.server.commands = []
+        self.download_all()
+        self.assertEqual(self.commands("RETR"), 0)
+        self.assertEqual(self.commands("SIZE"), len(self.files))
+
+
+class TestFileChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.path.join(self.folder, "data")
+        os.makedirs(os.path.join(self.data, "sub"))
+        for f in ["a.txt", "b.txt", "sub/c.txt"]:
+            self.write(f, "content of %s" % f)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        with open(os.path.join(self.data, name), "w") as fout:
+            fout.write(content)
+
+    def changes(self, dumper):
+        changes = dumper.get_file_changes(self.data)
+        # register as previous dump
+        dumper.src_doc = {"download" : {"data_folder" : self.data, "files" : changes["files"]}}
+        return changes
+
+    def test_filesystem(self):
+        dumper = FilesystemDumper(src_name="test_fs_dumper", src_root_folder=self.folder)
+        changes = self.changes(dumper)
+        self.assertEqual(changes["changed_files"], ["a.txt", "b.txt", "sub/c.txt"])
+        self.assertEqual(changes["removed_files"], [])
+        self.assertEqual([f["path"] for f in changes["files"]], ["a.txt", "b.txt", "sub/c.txt"])
+        # nothing changed, nothing re-hashed
+        with mock.patch("biothings.hub.dataload.dumper.md5sum") as md5sum:
+            changes = self.changes(dumper)
+            self.assertFalse(md5sum.called)
+        self.assertEqual(changes["changed_files"], [])
+        # same size, different content
+        self.write("b.txt", "CONTENT OF b.txt")
+        os.utime(os.path.join(self.data, "b.txt"), (0, 0))
+        self.write("d.txt", "new")
+        os.unlink(os.path.join(self.data, "sub", "c.txt"))
+        changes = self.changes(dumper)
+        self.assertEqual(changes["changed_files"], ["b.txt", "d.txt"])
+        self.assertEqual(changes["removed_files"], ["sub/c.txt"])
+        # touched but same content
+        os.utime(os.path.join(self.data, "a.txt"), (1, 1))
+        self.assertEqual(self.changes(dumper)["changed_files"], [])
+
+    def test_git(self):
+        git = lambda *args: subprocess.check_output(("git", "-c", "user.name=test",
+                                                     "-c", "user.email=test@test") + args, cwd=self.data)
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "init")
+        dumper = GitDumper(src_name="test_git_dumper", src_root_folder=self.data)
+        changes = self.changes(dumper)
+        self.assertEqual(changes["changed_files"], ["a.txt", "b.txt", "sub/c.txt"])
+        self.assertEqual(changes["files"][0]["hash"], git("rev-parse", "HEAD:a.txt").decode().strip())
+        self.write("a.txt", "modified")
+        git("rm", "-q", "b.txt")
+        git("commit", "-q", "-a", "-m", "update")
+        changes = self.changes(dumper)
+        self.assertEqual(changes["changed_files"], ["a.txt"])
+        self.assertEqual(changes["removed_files"], ["b.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
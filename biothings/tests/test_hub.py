@@ -0,0 +1,82 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+import biothings.utils.hub as hub
+from biothings.utils.hub import HubShell, CommandError
+
+
+class TestCommandTracking(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        HubShell.running_commands = {}
+        HubShell.finished_commands = OrderedDict()
+        HubShell.failed_commands = set()
+        HubShell.pending_outputs = {}
+        self.shell = HubShell(None)
+        self.shell.cmd.remove({})
+        self.shell.__class__.cmd_cnt = 1
+
+    def tearDown(self):
+        self.shell.cmd.remove({})
+        self.loop.close()
+
+    def launch(self, cmd, fail=False):
+        @asyncio.coroutine
+        def job():
+            yield from asyncio.sleep(0.01)
+            if fail:
+                raise ValueError("failed")
+            return "done"
+        return self.shell.register_command(cmd, asyncio.ensure_future(job(), loop=self.loop), force=True)
+
+    def test_running_and_finished(self):
+        self.launch("ok()")
+        self.launch("ko()", fail=True)
+        self.assertEqual(sorted(HubShell.command_info(running=True)), [1, 2])
+        self.assertEqual(HubShell.command_info(running=False), {})
+        self.loop.run_until_complete(asyncio.sleep(0.1, loop=self.loop))
+        # jobs done callbacks moved commands, no refresh needed
+        self.assertEqual(HubShell.running_commands, {})
+        self.assertEqual(list(HubShell.command_info(failed=True)), [2])
+        self.assertEqual(list(HubShell.command_info(failed=False)), [1])
+        self.assertEqual(HubShell.command_info(id=1)["results"], ["done"])
+        self.assertTrue(HubShell.command_info(id=2)["failed"])
+        self.assertIn("OK", HubShell.pending_outputs[1])
+        self.assertIn("ERR", HubShell.pending_outputs[2])
+
+    def test_paging_from_hub_db(self):
+        with mock.patch.object(hub, "MAX_FINISHED_COMMANDS", 3):
+            for i in range(10):
+                self.launch("cmd%d()" % i, fail=i % 2)
+            self.loop.run_until_complete(asyncio.sleep(0.1, loop=self.loop))
+            self.assertEqual(list(HubShell.finished_commands), [8, 9, 10])
+            # in memory
+            self.assertEqual(list(HubShell.command_info(running=False, limit=2)), [10, 9])
+            # paged from hub db
+            self.assertEqual(list(HubShell.command_info(running=False, skip=2, limit=3)), [8, 7, 6])
+            self.assertEqual(list(HubShell.command_info(failed=True, skip=1, limit=2)), [8, 6])
+            self.assertEqual(HubShell.command_info(id=1)["cmd"], "cmd0()")
+            with self.assertRaises(CommandError):
+                HubShell.command_info(id=100)
+
+    def test_paged_by_hub_db(self):
+        with mock.patch.object(hub, "MAX_FINISHED_COMMANDS", 3):
+            for i in range(6):
+                self.launch("cmd%d()" % i, fail=i % 2)
+            self.loop.run_until_complete(asyncio.sleep(0.1, loop=self.loop))
+            with mock.patch.object(HubShell.cmd, "find", wraps=HubShell.cmd.find) as find:
+                cmds = HubShell.command_info(failed=False, skip=1, limit=2)
+            # filtered, sorted and paged by the query, not afterwards
+            self.assertEqual(list(cmds), [3, 1])
+            find.assert_called_once_with({"is_done" : True, "failed" : False}, sort=[("_id", -1)], skip=1, limit=2)
+        self.assertEqual([c["_id"] for c in self.shell.cmd.find({}, sort=[("_id", 1)], limit=3)], [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
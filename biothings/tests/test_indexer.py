@@ -0,0 +1,367 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+from elasticsearch import helpers
+
+from biothings.utils.es import ESIndexer
+from biothings.utils.hub_db import get_src_build
+from biothings.hub.dataindex import indexer
+from biothings.hub.dataindex.controller import IndexingController
+from biothings.hub.dataindex.checkpoint import IndexCheckpoint
+from biothings.hub.dataindex.idcache import LocalIDCache
+from biothings.tests.thread_job_manager import ThreadJobManager
+
+
+def iter_batches(ids, size):
+    for i in range(0,len(ids),size):
+        yield ids[i:i+size]
+
+
+class StubESHandler(BaseHTTPRequestHandler):
+    """
+    Minimal ES server: any GET returns 404 (index isn't an alias), bulk
+    requests are accepted but each document is rejected (429) the first
+    "rejections" times it's sent. If "reject_all" is set, the whole
+    bulk request is rejected.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.send_json(404,{"error" : "not found", "status" : 404})
+
+    def do_PUT(self):
+        # index creation
+        self.rfile.read(int(self.headers.get("Content-Length",0)))
+        self.send_json(200,{"acknowledged" : True})
+
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header("Content-Length","0")
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        lines = [json.loads(l) for l in body.splitlines() if l.strip()]
+        server.num_requests += 1
+        server.bulk_sizes.append(len(lines) // 2)
+        if server.reject_all:
+            server.reject_all -= 1
+            self.send_json(429,{"error" : "es_rejected_execution_exception", "status" : 429})
+            return
+        items = []
+        for action in lines[::2]:
+            op_type, meta = list(action.items())[0]
+            _id = meta["_id"]
+            seen = server.attempts.setdefault(_id,0)
+            server.attempts[_id] += 1
+            if seen < server.rejections:
+                items.append({op_type : {"_id" : _id, "status" : 429,
+                                         "error" : {"type" : "es_rejected_execution_exception"}}})
+            else:
+                server.indexed.add(_id)
+                items.append({op_type : {"_id" : _id, "status" : 201, "result" : "created"}})
+        self.send_json(200,{"took" : 1, "errors" : any(i for i in items
+                                                       if list(i.values())[0]["status"] != 201),
+                            "items" : items})
+
+
+class TestIndexerBackpressure(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("localhost",0),StubESHandler)
+        self.server.rejections = 0
+        self.server.reject_all = 0
+        self.server.attempts = {}
+        self.server.indexed = set()
+        self.server.num_requests = 0
+        self.server.bulk_sizes = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.es_host = "localhost:%s" % self.server.server_address[1]
+        self.docs = [{"_id" : "doc%d" % i, "value" : i} for i in range(50)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_indexer(self, **kwargs):
+        return ESIndexer(index="test",doc_type="doc",es_host=self.es_host,step=20,
+                         bulk_initial_backoff=0.01,bulk_max_backoff=0.05,**kwargs)
+
+    def test_no_rejection(self):
+        idxer = self.get_indexer()
+        res = idxer.index_bulk(self.docs)
+        self.assertEqual(res,(50,[]))
+        self.assertEqual(idxer.bulk_stats["count"],50)
+        self.assertEqual(idxer.bulk_stats["rejected"],0)
+        self.assertEqual(self.server.num_requests,3)
+
+    def test_rejected_docs_are_retried(self):
+        self.server.rejections = 2
+        idxer = self.get_indexer(bulk_max_retries=3)
+        res = idxer.index_bulk(self.docs)
+        self.assertEqual(res,(50,[]))
+        self.assertEqual(len(self.server.indexed),50)
+        self.assertEqual(idxer.bulk_stats["rejected"],50)
+        self.assertEqual(idxer.bulk_stats["retried"],100)
+
+    def test_rejected_request_is_retried(self):
+        self.server.reject_all = 2
+        idxer = self.get_indexer(bulk_max_retries=3)
+        res = idxer.index_bulk(self.docs)
+        self.assertEqual(res,(50,[]))
+        self.assertEqual(idxer.bulk_stats["rejected"],20)
+
+    def test_backoff_not_in_latency(self):
+        self.server.rejections = 1
+        idxer = self.get_indexer(bulk_max_retries=1)
+        with mock.patch("biothings.utils.es.random.uniform",return_value=0.3):
+            idxer.index_bulk(self.docs[:20])
+        self.assertEqual(idxer.bulk_stats["backoff"],0.3)
+        self.assertLess(idxer.bulk_stats["time"],0.3)
+
+    def test_max_retries_reached(self):
+        self.server.rejections = 5
+        idxer = self.get_indexer(bulk_max_retries=2)
+        with self.assertRaises(helpers.BulkIndexError) as ctx:
+            idxer.index_bulk(self.docs)
+        self.assertEqual(len(ctx.exception.errors),50)
+        self.assertEqual(len(self.server.indexed),0)
+
+    def test_index_with_controller(self):
+        # full Indexer.index() run: docs are rejected once, batches shrink
+        self.server.rejections = 1
+        ids = ["doc%03d" % i for i in range(400)]
+        src_build = get_src_build()
+        src_build.remove({"_id" : "test_build"})
+        src_build.insert_one({"_id" : "test_build", "jobs" : [],
+                              "build_config" : {"name" : "test", "doc_type" : "doc"}})
+        target = mock.Mock()
+        target.count.return_value = len(ids)
+        def doc_feeder(col, step, inbatch, query):
+            return ({"_id" : _id} for _id in query["_id"]["$in"])
+        loop = asyncio.new_event_loop()
+        job_manager = ThreadJobManager(loop)
+        idxer = indexer.Indexer(self.es_host,bulk_initial_backoff=0.01,bulk_max_backoff=0.05)
+        try:
+            with mock.patch.object(indexer.mongo,"get_target_db",return_value={"test_build" : target}), \
+                    mock.patch.object(indexer,"id_feeder",return_value=iter_batches(ids,100)), \
+                    mock.patch.object(indexer,"doc_feeder",side_effect=doc_feeder), \
+                    mock.patch.object(indexer.btconfig,"INDEX_MIN_BATCH_SIZE",25,create=True):
+                res = loop.run_until_complete(idxer.index("test_build","test_index",job_manager,
+                                                          steps=["index"],batch_size=100))
+            self.assertEqual(res,{"test_index" : 400})
+            self.assertEqual(self.server.indexed,set(ids))
+            job = src_build.find_one({"_id" : "test_build"})["jobs"][-1]
+            self.assertEqual(job["status"],"success")
+            ctrl = job["controller"]
+            self.assertEqual(ctrl["stats"]["count"],400)
+            self.assertEqual(ctrl["stats"]["rejected"],400)
+            self.assertGreater(ctrl["stats"]["slowdowns"],0)
+            self.assertLess(ctrl["batch_size"],100)
+            self.assertEqual(ctrl["inflight"],1)
+            # first bulk requests sent full batches, then smaller ones
+            self.assertEqual(self.server.bulk_sizes[0],100)
+            self.assertLess(self.server.bulk_sizes[-1],100)
+        finally:
+            job_manager.shutdown()
+            loop.close()
+            src_build.remove({"_id" : "test_build"})
+
+    def test_controller_slows_down_on_rejection(self):
+        ctrl = IndexingController(batch_size=1000,min_batch_size=100,max_inflight=4)
+        ctrl.record(1000,1.0,rejected=10)
+        self.assertEqual(ctrl.batch_size,500)
+        self.assertEqual(ctrl.inflight,3)
+        for _ in range(5):
+            ctrl.record(500,100.0)
+        self.assertEqual(ctrl.batch_size,100)
+        self.assertEqual(ctrl.inflight,1)
+
+    def test_controller_speeds_up_when_healthy(self):
+        ctrl = IndexingController(batch_size=1000,max_batch_size=1200,max_inflight=4,
+                                  increase_every=2)
+        ctrl.slow_down()
+        for _ in range(20):
+            ctrl.record(1000,0.5)
+        self.assertEqual(ctrl.batch_size,1200)
+        self.assertEqual(ctrl.inflight,4)
+        # worker results without bulk stats are ignored
+        ctrl.record_result((0,None))
+        self.assertEqual(ctrl.stats["batches"],20)
+        ctrl.record_result((10,[],{"count" : 10, "time" : 0.1, "rejected" : 10, "retried" : 10}))
+        self.assertEqual(ctrl.batch_size,600)
+
+    def test_controller_rechunk(self):
+        ctrl = IndexingController(batch_size=3)
+        batches = []
+        for ids in ctrl.rechunk([[1,2],[3,4,5,6,7],[8]]):
+            batches.append(ids)
+            if len(batches) == 1:
+                ctrl.batch_size = 2
+        self.assertEqual(batches,[[1,2,3],[4,5],[6,7],[8]])
+
+
+class TestIndexCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.src_build = get_src_build()
+        self.src_build.remove({"_id" : "test_build"})
+        self.src_build.insert_one({"_id" : "test_build"})
+        self.ids = ["id%03d" % i for i in range(100)]
+
+    def tearDown(self):
+        self.src_build.remove({"_id" : "test_build"})
+
+    def test_ranges_are_merged(self):
+        ckpt = IndexCheckpoint("test_build","test_index")
+        ckpt.reset()
+        ckpt.mark_done(20,self.ids[20:30])
+        ckpt.mark_done(0,self.ids[0:10])
+        ckpt.mark_done(40,self.ids[40:50])
+        ckpt.mark_done(10,self.ids[10:20])
+        self.assertEqual(ckpt.done,[[0,30,"id000","id029"],[40,50,"id040","id049"]])
+        ckpt.mark_done(30,self.ids[30:40])
+        self.assertEqual(ckpt.done,[[0,50,"id000","id049"]])
+
+    def test_resume_skips_done_batches(self):
+        ckpt = IndexCheckpoint("test_build","test_index")
+        ckpt.reset()
+        for start in (0,10,30):
+            ckpt.mark_launched(start,self.ids[start:start+10])
+            ckpt.mark_done(start,self.ids[start:start+10])
+        # batch 20-30 was being indexed when interrupted
+        ckpt.mark_launched(20,self.ids[20:30])
+        resumed = IndexCheckpoint("test_build","test_index")
+        self.assertTrue(resumed.load())
+        self.assertEqual(resumed.done,[[0,20,"id000","id019"],[30,40,"id030","id039"]])
+        self.assertEqual(resumed.launched,40)
+        # batch boundaries don't have to match the previous run ones
+        self.assertEqual(resumed.remaining(0,self.ids[0:15]),([],True))
+        self.assertEqual(resumed.remaining(15,self.ids[15:35]),(self.ids[20:30],True))
+        self.assertEqual(resumed.remaining(35,self.ids[35:50]),(self.ids[40:50],True))
+        self.assertEqual(resumed.remaining(50,self.ids[50:60]),(self.ids[50:60],False))
+
+    def test_checkpoint_invalid_when_ids_changed(self):
+        ckpt = IndexCheckpoint("test_build","test_index")
+        ckpt.reset()
+        ckpt.mark_done(0,self.ids[0:10])
+        ids = list(reversed(self.ids))
+        self.assertEqual(ckpt.remaining(0,ids[0:10]),(ids[0:10],True))
+        self.assertFalse(ckpt.valid)
+
+    def test_checkpoint_other_collection(self):
+        ckpt = IndexCheckpoint("test_build","test_index")
+        ckpt.reset()
+        ckpt.mark_done(0,self.ids[0:10])
+        other = IndexCheckpoint("test_build","test_index",target_name="cold_build")
+        self.assertFalse(other.load())
+        ckpt.clear()
+        self.assertFalse(IndexCheckpoint("test_build","test_index").load())
+
+
+class TestLocalIDCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.ids = ["id%05d" % i for i in range(2000)]
+        shuffled = list(self.ids)
+        random.shuffle(shuffled)
+        # id provider returns batches, unsorted, with some duplicates
+        self.batches = [shuffled[i:i+300] for i in range(0,len(shuffled),300)] + [self.ids[:10]]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_load_sorted(self):
+        # small sort buffer to force merging several sorted runs
+        cache = LocalIDCache("test",cache_folder=self.folder,sort_buffer=500)
+        cache.load(self.batches)
+        self.assertEqual(len(cache),2000)
+        self.assertEqual([cache.get(i) for i in range(len(cache))],self.ids)
+        self.assertEqual(cache.position("id01234"),1234)
+        self.assertIsNone(cache.position("nope"))
+        self.assertEqual(sum([len(b) for b in cache.remaining(batch_size=300)]),2000)
+
+    def test_mark_done(self):
+        cache = LocalIDCache("test",cache_folder=self.folder,sort_buffer=500)
+        cache.load(self.batches)
+        cache.mark_done(self.ids[100:1900] + ["unknown"])
+        cache.mark_done(self.ids[:50])
+        cache.close()
+        # state is persisted, reopen the cache
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        cache.load(self.batches,flush=False)
+        remaining = list(cache.remaining(batch_size=100))
+        self.assertEqual([len(b) for b in remaining],[100,50])
+        self.assertEqual(sum(remaining,[]),self.ids[50:100] + self.ids[1900:])
+        # ids marked as done aren't contained anymore (same as RedisIDCache)
+        self.assertEqual(cache.contains(self.ids[40:60] + ["unknown"]),set(self.ids[50:60]))
+        # reloading flushes done ids
+        cache.load(self.batches)
+        self.assertEqual(sum([len(b) for b in cache.remaining()]),2000)
+
+    def test_special_ids(self):
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        with self.assertRaises(ValueError):
+            cache.load([["a","b\nc"]])
+        ids = ["a\rb","a\r","é",""]
+        cache.load([ids])
+        self.assertEqual(sorted([cache.get(i) for i in range(len(cache))]),sorted(ids))
+        self.assertEqual(cache.contains(ids + ["a"]),set(ids))
+
+    def test_non_string_ids(self):
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        # would be read back as "1", and be the same as "1"
+        for _id in (1,None,b"a"):
+            with self.assertRaises(TypeError):
+                cache.load([["a",_id]])
+        cache.load([["1","a"]])
+        with self.assertRaises(TypeError):
+            cache.contains(["a",1])
+        with self.assertRaises(TypeError):
+            cache.mark_done([1])
+        self.assertEqual(list(cache.remaining()),[["1","a"]])
+
+    def test_hash_rebuilt(self):
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        cache.load(self.batches)
+        cache.close()
+        # cache created without hash table
+        os.remove(cache.hash_file)
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        self.assertEqual(cache.position("id01999"),1999)
+        self.assertTrue(os.path.exists(cache.hash_file))
+
+    def test_empty(self):
+        cache = LocalIDCache("test",cache_folder=self.folder)
+        cache.load([])
+        self.assertEqual(len(cache),0)
+        self.assertEqual(list(cache.remaining()),[])
+
+
+if __name__ == "__main__":
+    unittest.main()
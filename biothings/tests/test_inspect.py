@@ -0,0 +1,184 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import copy
+import random
+import unittest
+from unittest import mock
+
+from biothings.utils.inspect import inspect, inspect_docs, merge_inspect_results, post_inspect_results, \
+                                    reservoir_sample, sample_confidence, signature, merge_scalar_list
+from biothings.utils.common import splitstr
+import biothings.utils.inspect as btinspect
+from biothings.hub.datainspect import inspector
+from biothings.tests.thread_job_manager import ThreadJobManager
+
+
+def make_docs(num):
+    docs = []
+    for i in range(num):
+        doc = {"_id" : "doc%d" % i, "n" : i, "name" : "name%d" % i, "d" : {"start" : i, "end" : i * 2}}
+        if i % 2:
+            doc["l"] = [{"v" : i}, {"w" : "x y"}]
+        else:
+            doc["l"] = {"v" : i, "f" : i / 3}
+        if i % 7 == 0:
+            doc["rare"] = "value %d" % i
+        docs.append(doc)
+    return docs
+
+
+class TestPartialInspection(unittest.TestCase):
+
+    modes = ["type","mapping","stats","deepstats"]
+
+    def inspect_partials(self, docs, batch_size):
+        inspected = {}
+        for i in range(0,len(docs),batch_size):
+            res = inspect_docs(docs[i:i + batch_size],mode=self.modes,clean=False,
+                               pre_mapping=True,metadata=False)
+            merge_inspect_results(inspected,res,self.modes)
+        return post_inspect_results(inspected,self.modes)
+
+    def test_partials_merged(self):
+        docs = make_docs(100)
+        whole = inspect_docs(copy.deepcopy(docs),mode=self.modes,pre_mapping=True)
+        for batch_size in (10,33):
+            merged = self.inspect_partials(copy.deepcopy(docs),batch_size)
+            for m in self.modes:
+                self.assertEqual(merged[m],whole[m],"mode %s, batch_size %s" % (m,batch_size))
+        self.assertEqual(merged["stats"]["d"]["start"][int]["_stats"],{"_count" : 100, "_min" : 0, "_max" : 99})
+        self.assertEqual(merged["deepstats"]["n"][int]["_stats"]["_median"],49.5)
+        self.assertEqual(merged["stats"]["l"][list]["v"][int]["_stats"]["_count"],50)
+
+    def test_mapping_conflicts_kept(self):
+        docs = [{"_id" : "1", "f" : "a"}, {"_id" : "2", "f" : 1}]
+        inspected = {}
+        for doc in docs:
+            merge_inspect_results(inspected,inspect_docs([doc],mode="mapping",pre_mapping=True,clean=False),["mapping"])
+        self.assertEqual(set(inspected["mapping"]["f"]),{str,int})
+
+
+class TestSignatureCache(unittest.TestCase):
+
+    def test_signature(self):
+        self.assertEqual(signature({"a" : [1,2,3], "b" : {"c" : "x"}}),signature({"a" : [4], "b" : {"c" : "y"}}))
+        self.assertNotEqual(signature({"a" : [1]}),signature({"a" : 1}))
+        self.assertNotEqual(signature({"a" : [1]}),signature({"a" : [1.0]}))
+        # splittable strings only matter in mapping mode
+        self.assertEqual(signature({"a" : "x y"}),signature({"a" : "xy"}))
+        self.assertEqual(signature({"a" : "x y"},"mapping"),(("a",splitstr),))
+        self.assertNotEqual(signature({"a" : " xy "},"mapping"),signature({"a" : "x y"},"mapping"))
+
+    def test_same_results(self):
+        # documents with a known structure are skipped, results must be the same
+        # as inspecting each document
+        docs = make_docs(100) + [{"_id" : "x", "l" : [{"v" : "a"}, [1]], "n" : "text with spaces"}]
+        for mode in ("type","mapping"):
+            expected = {}
+            for doc in copy.deepcopy(docs):
+                inspect(doc,mapt=expected,mode=mode)
+            if mode == "mapping":
+                merge_scalar_list(expected,mode)
+            self.assertEqual(inspect_docs(copy.deepcopy(docs),mode=mode,pre_mapping=True)[mode],expected)
+
+    def test_type_merge_order(self):
+        # "a" is either a scalar or a dict, sub-fields must be merged whatever the order
+        d1 = {"f" : [{"a" : {"c" : 1}}]}
+        d2 = {"f" : [{"a" : 1}, {"a" : {"c" : "x"}}]}
+        m12 = inspect_docs([d1,d2])["type"]
+        self.assertEqual(m12,inspect_docs([d2,d1])["type"])
+        self.assertEqual(set(m12["f"][list]["a"]["c"]),{int,str})
+
+    def test_bounded_signatures(self):
+        def run(docs):
+            with mock.patch.object(btinspect,"MAX_SIGNATURES",5), \
+                 mock.patch.object(btinspect,"_inspect",wraps=btinspect._inspect) as _inspect, \
+                 mock.patch.object(btinspect,"signature",wraps=btinspect.signature) as sig:
+                res = inspect_docs(copy.deepcopy(docs))["type"]
+            expected = {}
+            for doc in copy.deepcopy(docs):
+                inspect(doc,mapt=expected)
+            self.assertEqual(res,expected)
+            # calls for documents (both functions are recursive)
+            return [len([c for c in mocked.call_args_list if type(c[0][0]) is dict])
+                    for mocked in (_inspect,sig)]
+        # all different: signatures are given up once 5 are collected
+        self.assertEqual(run([{"f%d" % i : 1} for i in range(20)]),[20,6])
+        # mostly the same: signatures are forgotten, "a" is inspected again
+        docs = [{"a" : 1}] * 50 + [{"f%d" % i : 1} for i in range(5)] + [{"a" : 1}] * 10
+        self.assertEqual(run(docs),[7,65])
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_reservoir(self):
+        rand = random.Random(42)
+        sample,total = reservoir_sample(iter(range(1000)),100,rand)
+        self.assertEqual(total,1000)
+        self.assertEqual(len(set(sample)),100)
+        # uniform: elements from whole range are kept
+        self.assertTrue(min(sample) < 200 and max(sample) > 800)
+        self.assertEqual(reservoir_sample(range(10),100),(list(range(10)),10))
+
+    def test_confidence(self):
+        self.assertEqual(sample_confidence(10,10)["max_missed_frequency"],0.0)
+        conf = sample_confidence(1000,10 ** 6)
+        # "rule of three"
+        self.assertAlmostEqual(conf["max_missed_frequency"],3 / 1000,places=4)
+
+
+class FakeBuilder(object):
+
+    def __init__(self):
+        self.statuses = []
+
+    def register_status(self, status, **kwargs):
+        self.statuses.append((status,kwargs))
+
+
+class TestInspectorManager(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = dict([(d["_id"],d) for d in make_docs(100)])
+        self.builder = FakeBuilder()
+        build_manager = mock.Mock()
+        build_manager.get_builder.return_value = self.builder
+        self.loop = asyncio.get_event_loop()
+        self.manager = inspector.InspectorManager(None,build_manager,job_manager=ThreadJobManager(self.loop))
+
+    def id_feeder(self, col, batch_size=1000, **kwargs):
+        ids = sorted(self.docs)
+        for i in range(0,len(ids),batch_size):
+            yield ids[i:i + batch_size]
+
+    def doc_feeder(self, col, step=1000, inbatch=False, query=None):
+        return (copy.deepcopy(self.docs[_id]) for _id in query["_id"]["$in"])
+
+    def inspect(self, **kwargs):
+        with mock.patch.object(inspector,"create_backend"), \
+             mock.patch.object(inspector,"id_feeder",self.id_feeder), \
+             mock.patch.object(inspector,"doc_feeder",self.doc_feeder):
+            task = self.manager.inspect("test_build",mode=["type","mapping","stats"],batch_size=15,**kwargs)
+            self.loop.run_until_complete(task)
+        status,info = self.builder.statuses[-1]
+        self.assertEqual(status,"success")
+        return info["build"]["inspect"]["results"]
+
+    def test_batches(self):
+        res = self.inspect()
+        self.assertEqual(res["stats"]["n"]["__type__:int"]["_stats"]["_count"],100)
+        self.assertIn("rare",res["mapping"])
+        self.assertNotIn("sample",res["__metadata__"])
+
+    def test_sampled(self):
+        res = self.inspect(sample_size=40)
+        self.assertEqual(res["stats"]["n"]["__type__:int"]["_stats"]["_count"],40)
+        self.assertEqual(res["__metadata__"]["sample"]["size"],40)
+        self.assertEqual(res["__metadata__"]["sample"]["total"],100)
+        self.assertEqual(res["__metadata__"]["sample"]["confidence"],0.95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import biothings_client
+import networkx as nx
+
+from biothings.hub.datatransform import DataTransformMDB
+from biothings.hub.datatransform.datatransform_api import MyGeneInfoEdge, DataTransformMyGeneInfo
+from biothings.hub.datatransform.lookupcache import MemoryLookupCache, SqliteLookupCache, lookup_many
+from biothings.tests.stub_biothings_api import StubBiothingsAPI
+
+
+def make_genes(num):
+    return [{"_id" : str(i), "entrezgene" : str(i), "symbol" : "SYM%d" % i,
+             "ensembl" : {"gene" : "ENSG%d" % i}} for i in range(num)]
+
+
+def stub_client(api):
+    client = biothings_client.get_client("gene", url=api.url)
+    # no delay between batches, it's a local server
+    client.delay = 0
+    return client
+
+
+class TestLookupCaches(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def check_cache(self, cache):
+        cache.set_many("ensembl.gene", "symbol", {"ENSG1" : ["SYM1"], "ENSG2" : [], "ENSG3" : ["A", "B"]})
+        cache.set_many("entrezgene", "symbol", {"ENSG1" : ["other"]})
+        self.assertEqual(cache.get_many("ensembl.gene", "symbol", ["ENSG1", "ENSG2", "ENSG3", "ENSG4"]),
+                         {"ENSG1" : ["SYM1"], "ENSG2" : [], "ENSG3" : ["A", "B"]})
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.get_many("entrezgene", "symbol", ["ENSG1"]), {"ENSG1" : ["other"]})
+        # misses expire first
+        cache.miss_ttl = -1
+        self.assertEqual(cache.get_many("ensembl.gene", "symbol", ["ENSG1", "ENSG2"]), {"ENSG1" : ["SYM1"]})
+        # expired
+        cache.ttl = -1
+        self.assertEqual(cache.get_many("ensembl.gene", "symbol", ["ENSG1"]), {})
+
+    def test_memory(self):
+        self.check_cache(MemoryLookupCache())
+
+    def test_sqlite(self):
+        db_file = os.path.join(self.folder, "cache.sqlite")
+        cache = SqliteLookupCache(db_file)
+        cache.query_size = 2
+        self.check_cache(cache)
+        cache.purge()
+        cache.close()
+        # persisted, and picklable (sent to worker processes)
+        cache = pickle.loads(pickle.dumps(SqliteLookupCache(db_file, ttl=3600)))
+        cache.set_many("a", "b", {1 : [2]})
+        self.assertEqual(cache.get_many("a", "b", [1]), {1 : [2]})
+        self.assertEqual(SqliteLookupCache(db_file).get_many("a", "b", [1]), {1 : [2]})
+
+    def test_sqlite_locked(self):
+        db_file = os.path.join(self.folder, "cache.sqlite")
+        cache = SqliteLookupCache(db_file)
+        cache.set_many("a", "b", {1 : [2]})
+        # another worker reading meanwhile (WAL mode)
+        other = SqliteLookupCache(db_file)
+        other.conn.execute("BEGIN")
+        self.assertEqual(other.conn.execute("SELECT count(*) FROM lookup").fetchone()[0], 1)
+        cache.set_many("a", "b", {3 : [4]})
+        self.assertEqual(cache.get_many("a", "b", [1, 3]), {1 : [2], 3 : [4]})
+        other.conn.rollback()
+        # another one writing for too long, not cached
+        cache.timeout = other.timeout = .1
+        cache.close()
+        other.conn.execute("BEGIN IMMEDIATE")
+        with self.assertLogs(level="WARNING"):
+            cache.set_many("a", "b", {5 : [6]})
+        self.assertEqual(cache.get_many("a", "b", [1, 5]), {1 : [2]})
+        other.conn.rollback()
+        cache.set_many("a", "b", {5 : [6]})
+        self.assertEqual(cache.get_many("a", "b", [5]), {5 : [6]})
+
+    def test_lookup_many(self):
+        threads = set()
+        def lookup(ids):
+            threads.add(threading.current_thread().name)
+            time.sleep(.1)
+            return dict([(i, [i * 2]) for i in ids if i % 2])
+        cache = MemoryLookupCache()
+        t0 = time.time()
+        res = lookup_many(lookup, range(40), "s", "f", cache, chunk_size=10, num_workers=4)
+        self.assertLess(time.time() - t0, .3)
+        self.assertEqual(len(threads), 4)
+        self.assertEqual(res[3], [6])
+        self.assertEqual(res[4], [])
+        res = lookup_many(lambda ids: self.fail("cached"), range(40), "s", "f", cache)
+        self.assertEqual(res[3], [6])
+
+
+class TestAPILookups(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.api = StubBiothingsAPI(make_genes(100), latency=.05).__enter__()
+
+    def tearDown(self):
+        self.api.__exit__()
+        shutil.rmtree(self.folder)
+
+    def make_graph(self, cache):
+        G = nx.DiGraph()
+        edge = MyGeneInfoEdge("ensembl.gene", "entrezgene", lookup_cache=cache)
+        edge.lookup_chunk_size = 10
+        edge._state["client"] = stub_client(self.api)
+        G.add_edge("ensembl", "entrez", object=edge)
+        return G
+
+    def convert(self, cache, ids):
+        dt = DataTransformMDB(self.make_graph(cache), input_types=["ensembl"], output_types=["entrez"])
+        load = dt(lambda: ({"_id" : _id} for _id in ids))
+        return sorted([d["_id"] for d in load()])
+
+    def test_edge(self):
+        ids = ["ENSG%d" % i for i in range(0, 150, 3)]
+        expected = sorted([str(i) for i in range(0, 100, 3)] + ["ENSG%d" % i for i in range(102, 150, 3)])
+        cache = SqliteLookupCache(os.path.join(self.folder, "cache.sqlite"))
+        self.assertEqual(self.convert(cache, ids), expected)
+        self.assertEqual(sorted(self.api.queried), sorted(ids))
+        # another upload, from cache, misses included
+        self.assertEqual(self.convert(SqliteLookupCache(cache.db_file), ids), expected)
+        self.assertEqual(len(self.api.queried), len(ids))
+        self.assertEqual(self.convert(None, ids), expected)
+        self.assertEqual(len(self.api.queried), 2 * len(ids))
+
+    def test_datatransform_api(self):
+        cache = MemoryLookupCache()
+        def load(ids):
+            dt = DataTransformMyGeneInfo(["ensembl"], ["symbol"], lookup_cache=cache)
+            dt.lookup_chunk_size = 10
+            dt.client = stub_client(self.api)
+            return [d["_id"] for d in dt(lambda: ({"_id" : _id, "n" : i} for i, _id in enumerate(ids)))()]
+        ids = ["ENSG%d" % i for i in range(0, 150, 7)]
+        expected = ["SYM%d" % i for i in range(0, 100, 7)] + ["ENSG%d" % i for i in range(105, 150, 7)]
+        self.assertEqual(load(ids), expected)
+        num_requests = self.api.num_requests
+        self.assertEqual(load(ids), expected)
+        self.assertEqual(self.api.num_requests, num_requests)
+        self.assertEqual(cache.hit_ratio(), .5)
+
+
+if __name__ == "__main__":
+    unittest.main()
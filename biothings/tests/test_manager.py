@@ -0,0 +1,195 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from biothings.utils import manager
+from biothings.utils.manager import JobManager, JobTracker
+
+
+class TestJobAdmission(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.job_manager = JobManager(self.loop,num_workers=1,
+                thread_queue=concurrent.futures.ThreadPoolExecutor(max_workers=6))
+        self.lock = threading.Lock()
+        self.started = []
+
+    def tearDown(self):
+        self.job_manager.thread_queue.shutdown()
+        self.job_manager.process_queue.shutdown()
+        self.job_manager.tracker.stop()
+        self.loop.close()
+
+    def job(self, duration):
+        with self.lock:
+            self.started.append((time.time(),[dict(j) for j in self.job_manager.jobs.values()]))
+        time.sleep(duration)
+
+    def run_jobs(self, num, duration, predicates):
+        @asyncio.coroutine
+        def do():
+            jobs = []
+            for i in range(num):
+                pinfo = {"category" : "test", "source" : "job%d" % i, "step" : "",
+                         "__predicates__" : predicates}
+                job = yield from self.job_manager.defer_to_thread(pinfo,lambda: self.job(duration))
+                jobs.append(job)
+            yield from asyncio.gather(*jobs,loop=self.loop)
+        self.loop.run_until_complete(do())
+
+    def test_admitted_on_completion(self):
+        # at most 2 jobs at a time: waiting jobs are admitted as soon as
+        # running ones are done, two at once, not on a polling schedule
+        t0 = time.time()
+        self.run_jobs(6,.3,[lambda jm: len(jm.jobs) < 2])
+        self.assertLess(time.time() - t0,2)
+        self.assertEqual(len(self.started),6)
+        self.assertLess(max([len(jobs) for _,jobs in self.started]),3)
+        # jobs started by pairs
+        starts = sorted([t for t,_ in self.started])
+        self.assertLess(starts[1] - starts[0],.1)
+        self.assertLess(starts[3] - starts[2],.1)
+        self.assertGreater(starts[2] - starts[0],.25)
+        # delay recorded per job
+        delays = sorted([j["admission_delay"] for _,jobs in self.started for j in jobs])
+        self.assertTrue(delays)
+        self.assertGreater(delays[-1],.25)
+        self.assertEqual(self.job_manager.num_waiting,0)
+        self.assertEqual(self.job_manager.jobs,{})
+
+    def test_memory_reservation(self):
+        jm = self.job_manager
+        jm.max_memory_usage = jm.hub_memory + 1000 * 1024 ** 2
+        pinfo = {"__reqs__" : {"mem" : 600 * 1024 ** 2}}
+        self.assertIsNone(jm.admission_blocker(pinfo,jm.hub_memory))
+        jm.reserved_memory["running"] = 600 * 1024 ** 2
+        self.assertIn("needs",jm.admission_blocker(pinfo,jm.hub_memory))
+        jm.job_done("running")
+        self.assertIsNone(jm.admission_blocker(pinfo,jm.hub_memory))
+
+
+def fail(msg):
+    raise ValueError(msg)
+
+
+class TestJobTracking(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.job_manager = JobManager(self.loop,num_workers=1,num_threads=2)
+
+    def tearDown(self):
+        self.job_manager.thread_queue.shutdown()
+        self.job_manager.process_queue.shutdown()
+        self.job_manager.tracker.stop()
+        self.loop.close()
+
+    def run_job(self, ptype, func, *args):
+        defer = ptype == "thread" and self.job_manager.defer_to_thread or self.job_manager.defer_to_process
+        @asyncio.coroutine
+        def do():
+            pinfo = {"category" : "test", "source" : "tracking", "step" : ptype, "description" : ""}
+            job = yield from defer(pinfo,func,*args)
+            return (yield from job)
+        return self.loop.run_until_complete(do())
+
+    def wait_done(self, num):
+        # process workers report through a pipe, read asynchronously
+        t0 = time.time()
+        while len(self.job_manager.tracker.get_done()) < num and time.time() - t0 < 5:
+            time.sleep(.01)
+        return [w for _,w in self.job_manager.tracker.get_done()]
+
+    def test_done_jobs(self):
+        self.assertEqual(self.run_job("thread",time.sleep,.1),None)
+        self.assertNotEqual(self.run_job("process",os.getpid),os.getpid())
+        dones = self.wait_done(2)
+        self.assertEqual(sorted([w["ptype"] for w in dones]),["process","thread"])
+        self.assertTrue(all([w["err"] is None and w["duration"] for w in dones]))
+        self.assertEqual(self.job_manager.tracker.running,{})
+        self.assertEqual(len(self.job_manager.get_dones().splitlines()),2)
+        # purged
+        self.assertEqual(self.job_manager.tracker.get_done(),[])
+
+    def test_running_jobs(self):
+        fut = asyncio.ensure_future(self.job_manager.defer_to_thread({"category" : "test",
+                "source" : "tracking", "step" : "", "description" : ""},partial_sleep),loop=self.loop)
+        self.loop.run_until_complete(asyncio.sleep(.1,loop=self.loop))
+        tworkers = self.job_manager.get_thread_files()
+        self.assertEqual(len(tworkers),1)
+        self.assertEqual(list(tworkers.values())[0]["job"]["source"],"tracking")
+        self.loop.run_until_complete(fut.result())
+
+    def test_errors(self):
+        for ptype in ("thread","process"):
+            with self.assertRaises(ValueError):
+                self.run_job(ptype,fail,"oops")
+        dones = self.wait_done(2)
+        self.assertEqual(len(dones),2)
+        self.assertTrue(all(["oops" in str(w["err"]) and w["trace"] for w in dones]))
+
+    def test_tracker_stopped(self):
+        tracker = self.job_manager.tracker
+        other = JobManager(self.loop,num_workers=1,num_threads=1)
+        # stop() runs in current event loop
+        default_loop = asyncio.get_event_loop()
+        try:
+            # replaced tracker doesn't keep reading
+            self.assertFalse(tracker.reader.is_alive())
+            self.assertIs(manager.job_tracker,other.tracker)
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(other.stop())
+            self.assertFalse(other.tracker.reader.is_alive())
+            self.assertIsNone(manager.job_tracker)
+        finally:
+            asyncio.set_event_loop(default_loop)
+            other.thread_queue.shutdown()
+
+
+def partial_sleep():
+    time.sleep(.3)
+
+
+class TestJobJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.journal = os.path.join(self.folder,"jobs.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_recover(self):
+        tracker = JobTracker(journal=self.journal)
+        worker = {"func_name" : "f", "ptype" : "thread", "job" : {"started_at" : time.time(), "id" : "t1"}}
+        tracker.update("start","t1_a",dict(worker))
+        tracker.update("start","t1_b",dict(worker))
+        tracker.update("done","t1_a",{"duration" : "1s", "err" : None, "trace" : None})
+        tracker.stop()
+        # hub crashed, t1_b was running
+        tracker = JobTracker(journal=self.journal)
+        tracker.recover()
+        dones = tracker.get_done()
+        self.assertEqual([k for k,_ in dones],["t1_b"])
+        self.assertIn("interrupted",dones[0][1]["err"])
+        self.assertEqual(os.path.getsize(self.journal),0)
+        # journal is reset when no job is running anymore
+        tracker.update("start","t2_a",dict(worker))
+        self.assertEqual(json.loads(open(self.journal).readline())["key"],"t2_a")
+        tracker.update("done","t2_a",{"duration" : "1s", "err" : None, "trace" : None})
+        self.assertEqual(os.path.getsize(self.journal),0)
+        tracker.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
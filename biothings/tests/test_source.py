@@ -0,0 +1,144 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import concurrent.futures
+import time
+import unittest
+from unittest import mock
+
+from biothings.utils.common import get_random_string
+from biothings.utils.dotfield import project_doc
+from biothings.utils.hub_db import get_src_dump, ChangeWatcher
+from biothings.hub.dataload.dumper import DumperManager, BaseDumper
+from biothings.hub.dataload.uploader import UploaderManager, BaseSourceUploader
+from biothings.hub.dataplugin.manager import DataPluginManager
+from biothings.hub.dataload.source import SourceManager
+
+
+class TestProjection(unittest.TestCase):
+
+    def doc(self):
+        return {"_id" : "a", "b" : {"c" : 1, "d" : {"e" : 2, "f" : 3}}, "g" : 4}
+
+    def test_exclusion(self):
+        self.assertEqual(project_doc(self.doc(), {"b.d.e" : 0, "g" : 0, "x.y" : 0}),
+                         {"_id" : "a", "b" : {"c" : 1, "d" : {"f" : 3}}})
+
+    def test_inclusion(self):
+        self.assertEqual(project_doc(self.doc(), {"b.d.e" : 1, "x.y" : 1}),
+                         {"_id" : "a", "b" : {"d" : {"e" : 2}}})
+        self.assertEqual(project_doc(self.doc(), {"g" : 1, "_id" : 0}), {"g" : 4})
+
+    def test_sqlite_find(self):
+        col = get_src_dump()
+        ids = ["test_proj_%s" % get_random_string() for i in range(3)]
+        try:
+            for _id in ids:
+                col.insert_one(dict(self.doc(), _id=_id))
+            docs = col.find({"_id" : {"$in" : ids[:2]}}, {"b" : 0})
+            self.assertEqual(sorted([d["_id"] for d in docs]), sorted(ids[:2]))
+            self.assertEqual(docs[0]["g"], 4)
+            self.assertNotIn("b", docs[0])
+            self.assertEqual(col.find_one({"_id" : ids[2]}, {"g" : 1}), {"_id" : ids[2], "g" : 4})
+        finally:
+            col.remove({"_id" : {"$in" : ids}})
+
+
+class TestSourceSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.name = "test_source_%s" % get_random_string()
+        self.dumper = type("Dumper", (BaseDumper,), {"SRC_NAME" : self.name})
+        self.uploader = type("Uploader", (BaseSourceUploader,), {"name" : self.name})
+        dm = DumperManager(None)
+        um = UploaderManager(job_manager=None)
+        with mock.patch.object(SourceManager, "reload"):
+            self.manager = SourceManager([], dm, um, DataPluginManager(None))
+        dm.register_classes([self.dumper])
+        um.register_classes([self.uploader])
+        self.src_dump = get_src_dump()
+        self.src_dump.insert_one({
+            "_id" : self.name,
+            "download" : {"status" : "success", "files" : [{"path" : "f%d" % i} for i in range(1000)]},
+            "upload" : {"jobs" : {self.name : {"status" : "success", "count" : 10,
+                                               "files" : [{"path" : "f1"}]}}},
+            "inspect" : {"jobs" : {self.name : {"status" : "failed", "inspect" : {"results" : {
+                "type" : {"big" : "x" * 100000},
+                "mapping" : {"pre-mapping" : {"big" : "x" * 100000}, "errors" : ["conflict"]}}}}}}})
+
+    def tearDown(self):
+        self.src_dump.remove({"_id" : self.name})
+
+    def summary(self):
+        return [s for s in self.manager.get_sources() if s["_id"] == self.name].pop()
+
+    def test_summary(self):
+        src = self.summary()
+        self.assertEqual(src["download"]["status"], "success")
+        self.assertEqual(src["count"], 10)
+        self.assertIn("uploader", src["upload"]["sources"][self.name])
+        self.assertEqual(src["inspect"]["sources"][self.name]["inspect"]["results"],
+                         {"mapping" : {"errors" : ["conflict"]}})
+        # detailed view keeps all inspection results
+        src = self.manager.get_source(self.name)
+        self.assertIn("pre-mapping", src["inspect"]["sources"][self.name]["inspect"]["results"]["mapping"])
+
+    def test_cache_invalidation(self):
+        self.summary()
+        self.src_dump.update_one({"_id" : self.name}, {"$set" : {"download.status" : "failed"}})
+        with mock.patch.object(self.manager, "summarize_source") as summarize:
+            # no hub db access while cached
+            self.assertEqual(self.summary()["download"]["status"], "success")
+            self.assertFalse(summarize.called)
+        self.manager.read({"_id" : self.name, "obj" : "source", "op" : "update_one"})
+        self.assertEqual(self.summary()["download"]["status"], "failed")
+
+    def test_plugin_error_not_cached(self):
+        plugin = type("Plugin", (), {"data_plugin_error" : "can't load"})
+        self.manager.data_plugin_manager.register[self.name] = [plugin]
+        with mock.patch.object(self.manager, "summarize_source",
+                               return_value={"_id" : self.name, "data_plugin" : {"plugin" : {}}}):
+            self.assertEqual(self.summary()["data_plugin"]["error"], "can't load")
+        self.assertNotIn("error", self.manager.summaries[self.name]["data_plugin"])
+
+
+class TestChangeWatcher(unittest.TestCase):
+
+    def test_events_after_write(self):
+        loop = asyncio.new_event_loop()
+        old_loop = asyncio.get_event_loop()
+        asyncio.set_event_loop(loop)
+        docs = {}
+        seen = []
+        class Listener(object):
+            def read(self, event):
+                # write is visible when event is received
+                seen.append(event["_id"] in docs)
+        def write(doc):
+            time.sleep(0.01)
+            docs[doc["_id"]] = doc
+        try:
+            with mock.patch.object(ChangeWatcher, "listeners", set()), \
+                    mock.patch.object(ChangeWatcher, "event_queue", asyncio.Queue(loop=loop)), \
+                    mock.patch.object(ChangeWatcher, "loop", None):
+                ChangeWatcher.add(Listener())
+                monitored = ChangeWatcher.monitor(write, "source", "insert_one")
+                # writes from worker threads
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+                jobs = [loop.run_in_executor(executor, monitored, {"_id" : "doc%d" % i}) for i in range(20)]
+                loop.run_until_complete(asyncio.gather(*jobs, loop=loop))
+                loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+                ChangeWatcher.do_publish = False
+                executor.shutdown()
+            self.assertEqual(seen, [True] * 20)
+        finally:
+            for task in asyncio.Task.all_tasks(loop):
+                task.cancel()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            asyncio.set_event_loop(old_loop)
+            loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
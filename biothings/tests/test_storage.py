@@ -0,0 +1,236 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import copy
+import logging
+import pickle
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+import bson
+from pymongo.errors import BulkWriteError
+
+from biothings.hub.dataload import uploader
+from biothings.hub.dataload.storage import BasicStorage, IgnoreDuplicatedStorage, \
+                                           StorageException, MergerStorage
+from biothings.utils.dataload import merge_struct
+from biothings.hub.dataindex.idcache import LocalIDCache
+
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        # no database needed to iterate over batches
+        self.storage = BasicStorage({"test" : None}, "test")
+
+    def docs(self, num, size=10):
+        return ({"_id" : "doc%d" % i, "value" : "x" * size} for i in range(num))
+
+    def test_batch_by_count(self):
+        batches = list(self.storage.doc_iterator(self.docs(25), batch_size=10))
+        self.assertEqual([len(b) for b in batches], [10, 10, 5])
+        self.assertEqual([b["docs"] for b in self.storage.stats["batches"]], [10, 10, 5])
+        self.assertTrue(all([b["peak_rss"] > 0 for b in self.storage.stats["batches"]]))
+
+    def test_rss_after_storing(self):
+        rss = iter([100, 500, 200, 300])
+        self.storage.process_info = mock.Mock(memory_info=lambda: mock.Mock(rss=next(rss)))
+        batches = []
+        for batch in self.storage.doc_iterator(self.docs(15), batch_size=10):
+            # batch not registered until stored
+            self.assertEqual(len(self.storage.stats["batches"]), len(batches))
+            batches.append(batch)
+        # measured before and after storing each batch
+        self.assertEqual([b["peak_rss"] for b in self.storage.stats["batches"]], [500, 300])
+
+    def test_batch_by_size(self):
+        doc_size = len(bson.BSON.encode(next(self.docs(1, 1000))))
+        self.storage.max_batch_bytes = doc_size * 4
+        batches = list(self.storage.doc_iterator(self.docs(10, 1000), batch_size=100))
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertEqual(max([b["est_bytes"] for b in self.storage.stats["batches"]]), doc_size * 4)
+        # small docs, count is the limit
+        batches = list(self.storage.doc_iterator(self.docs(10), batch_size=3))
+        self.assertEqual([len(b) for b in batches], [3, 3, 3, 1])
+
+    def test_size_sampling(self):
+        # only one document every SIZE_SAMPLE_RATE is encoded to estimate sizes
+        doc_size = len(bson.BSON.encode(next(self.docs(1, 1000))))
+        self.storage.max_batch_bytes = doc_size * 150
+        with mock.patch.object(self.storage, "doc_size", wraps=self.storage.doc_size) as sized:
+            batches = list(self.storage.doc_iterator(self.docs(1000, 1000), batch_size=10000))
+        self.assertEqual(sized.call_count, 10)
+        self.assertEqual([len(b) for b in batches], [150] * 6 + [100])
+
+    def test_memory_budget(self):
+        with mock.patch.object(biothings.config.conf, "UPLOAD_WORKER_MEMORY_BUDGET", 4000, create=True):
+            storage = BasicStorage({"test" : None}, "test")
+        self.assertEqual(storage.max_batch_bytes, 4000 // BasicStorage.BATCH_MEMORY_RATIO)
+        with mock.patch.object(biothings.config.conf, "UPLOAD_WORKER_MEMORY_BUDGET", None, create=True):
+            storage = BasicStorage({"test" : None}, "test")
+        batches = list(storage.doc_iterator(self.docs(10, 100000), batch_size=5))
+        self.assertEqual([len(b) for b in batches], [5, 5])
+
+    def test_dict_input(self):
+        docs = dict([("doc%d" % i, {"value" : i}) for i in range(5)])
+        batches = list(self.storage.doc_iterator(docs, batch_size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(batches[0][0], {"_id" : "doc0", "value" : 0})
+
+
+class DictCollection(object):
+    """Collection storing documents in a dict, reporting errors the way mongo does"""
+
+    def __init__(self):
+        self.docs = {}
+        self.inserted = 0
+        self.calls = []
+
+    def insert_many(self, docs, ordered=True):
+        self.calls.append("insert_many")
+        errors = []
+        for i, d in enumerate(docs):
+            if d["_id"] in self.docs or d.get("invalid"):
+                code = d.get("invalid") and 2 or 11000
+                errors.append({"index" : i, "code" : code, "errmsg" : "error %s" % code, "op" : d})
+                if ordered:
+                    break
+            else:
+                self.docs[d["_id"]] = d
+                self.inserted += 1
+        if errors:
+            raise BulkWriteError({"nInserted" : len(docs) - len(errors), "writeErrors" : errors})
+        return mock.Mock(inserted_ids=[d["_id"] for d in docs])
+
+    def insert(self, docs, **kwargs):
+        self.calls.append("insert")
+        for d in docs:
+            self.docs[d["_id"]] = d
+
+    def find(self, query):
+        self.calls.append("find")
+        return [copy.deepcopy(self.docs[_id]) for _id in query["_id"]["$in"] if _id in self.docs]
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls.append("bulk_write")
+        for op in ops:
+            assert op._filter["_id"] in self.docs
+            self.docs[op._filter["_id"]] = op._doc
+
+
+class DictStorage(BasicStorage):
+    """BasicStorage on a DictCollection, instantiated like upload_worker() does"""
+
+    def __init__(self, db, dest_col_name, logger):
+        super(DictStorage, self).__init__({dest_col_name : DictCollection()}, dest_col_name, logger)
+
+
+class TestUploadWorker(unittest.TestCase):
+
+    def test_stats_returned(self):
+        docs = lambda: ({"_id" : "doc%d" % i} for i in range(25))
+        cnt, stats = uploader.upload_worker("test", DictStorage, docs, "col", 10, 3)
+        self.assertEqual(cnt, 25)
+        self.assertEqual([b["docs"] for b in stats["batches"]], [10, 10, 5])
+        # a count alone is still a valid result
+        self.assertEqual(uploader.worker_result(25), (25, {}))
+        self.assertIsNone(uploader.worker_result("error"))
+
+    def test_stats_aggregated(self):
+        klass = type("StatsUploader", (uploader.BaseSourceUploader,), {"name" : "test_stats"})
+        up = klass(None, tempfile.gettempdir())
+        up.update_batch_stats({"batches" : [{"docs" : 10, "est_bytes" : 100, "peak_rss" : 1000}]}, 0)
+        up.update_batch_stats({}, 1)
+        up.update_batch_stats({"batches" : [{"docs" : 5, "est_bytes" : 50, "peak_rss" : 2000}]}, 2)
+        self.assertEqual(up.batch_stats["num_batches"], 2)
+        self.assertEqual(up.batch_stats["peak_rss"], 2000)
+        self.assertEqual(up.batch_stats["max_batch_bytes"], 100)
+        self.assertEqual([(b["job"], b["peak_rss"]) for b in up.batch_stats["batches"]], [(0, 1000), (2, 2000)])
+
+
+class TestIgnoreDuplicatedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.col = DictCollection()
+        self.storage = IgnoreDuplicatedStorage({"test" : self.col}, "test")
+
+    def test_duplicates_ignored(self):
+        docs = [{"_id" : "doc%d" % (i % 30), "i" : i} for i in range(100)]
+        self.assertEqual(self.storage.process((d for d in docs), 20), 30)
+        # first document is kept
+        self.assertEqual(self.col.docs["doc5"]["i"], 5)
+        # duplicates within a batch didn't reach the collection
+        self.assertEqual(self.col.inserted, 30)
+
+    def test_other_errors_raised(self):
+        docs = [{"_id" : "a"}, {"_id" : "b", "invalid" : True}]
+        with self.assertRaises(StorageException):
+            self.storage.process((d for d in docs), 10)
+
+    def test_id_cache(self):
+        folder = tempfile.mkdtemp()
+        try:
+            cache = LocalIDCache("test", cache_folder=folder)
+            cache.load([["doc%d" % i for i in range(0, 100, 2)]])
+            cache.contains(["doc0"])
+            # passed as an uploader would, partial storage class sent to a worker process
+            storage_class = pickle.loads(pickle.dumps(partial(IgnoreDuplicatedStorage, id_cache=cache)))
+            storage = storage_class({"test" : self.col}, "test", logging)
+            self.assertIsNot(storage.id_cache, cache)
+            docs = [{"_id" : "doc%d" % i} for i in range(100)]
+            self.assertEqual(storage.process((d for d in docs), 10), 50)
+            self.assertEqual(sorted(self.col.docs), sorted(["doc%d" % i for i in range(1, 100, 2)]))
+            storage.id_cache.close()
+            cache.close()
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestMergerStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.col = DictCollection()
+        self.storage = MergerStorage({"test" : self.col}, "test")
+
+    def rows(self):
+        # several rows per _id, spread over batches
+        for i in range(100):
+            yield {"_id" : "gene%d" % (i % 7), "rows" : [i], "name" : "gene%d" % (i % 7)}
+
+    def expected(self):
+        # same documents, merged one by one
+        merged = {}
+        for d in self.rows():
+            if d["_id"] in merged:
+                _id = d.pop("_id")
+                merged[_id] = merge_struct(d, merged[_id])
+            else:
+                merged[d["_id"]] = d
+        return merged
+
+    def test_intra_batch(self):
+        self.assertEqual(self.storage.process(self.rows(), 1000), 100)
+        self.assertEqual(self.col.docs, self.expected())
+        self.assertEqual(sorted(self.col.docs["gene3"]["rows"]), list(range(3, 100, 7)))
+        # all merged in memory
+        self.assertEqual(self.col.calls, ["insert_many"])
+
+    def test_cross_batch(self):
+        self.assertEqual(self.storage.process(self.rows(), 10), 100)
+        self.assertEqual(self.col.docs, self.expected())
+        # one fetch and one bulk write per batch with collisions
+        self.assertEqual(self.col.calls, ["insert_many"] + ["insert_many", "find", "bulk_write"] * 9)
+
+    def test_aslistofdict(self):
+        docs = [{"_id" : "a", "sub" : {"x" : 1}, "__aslistofdict__" : "sub"},
+                {"_id" : "a", "sub" : {"x" : 2}, "__aslistofdict__" : "sub"},
+                {"_id" : "a", "sub" : {"x" : 3}, "__aslistofdict__" : "sub"}]
+        self.storage.process((d for d in docs), 2)
+        self.assertEqual(sorted([s["x"] for s in self.col.docs["a"]["sub"]]), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import config, biothings
+biothings.config_for_app(config)
+
+import asyncio
+import collections
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pymongo import IndexModel
+
+from biothings.hub.dataload.uploader import ChunkedFileSourceUploader, BaseSourceUploader, \
+                                           ParallelizedSourceUploader
+from biothings.utils.dataload import tabfile_feeder
+from biothings.tests.thread_job_manager import ThreadJobManager
+
+
+class DummyChunkedUploader(ChunkedFileSourceUploader):
+    name = "test_chunked_uploader"
+    chunk_size = 100000
+
+    def input_files(self):
+        return [os.path.join(self.data_folder, f) for f in ("big.tsv", "small.tsv")]
+
+    def load_data(self, infile, byte_range):
+        for row in tabfile_feeder(infile, byte_range=byte_range):
+            yield {"_id" : row[0], "value" : row[1]}
+
+
+class TestChunkedFileSourceUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        with open(os.path.join(self.folder, "big.tsv"), "w") as fout:
+            fout.write("id\tvalue\n")
+            for i in range(50000):
+                fout.write("id%d\t%s\n" % (i, "x" * (i % 20)))
+        # only available compressed
+        with gzip.open(os.path.join(self.folder, "small.tsv.gz"), "wt") as fout:
+            fout.write("id\tvalue\nsmall\tdata\n")
+        self.uploader = DummyChunkedUploader(None, self.folder)
+        self.uploader.data_folder = self.folder
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_jobs(self):
+        jobs = self.uploader.jobs()
+        big = [j for j in jobs if j[0].endswith("big.tsv")]
+        self.assertEqual(len(big), os.path.getsize(os.path.join(self.folder, "big.tsv")) // 100000)
+        self.assertEqual(jobs[-1], (os.path.join(self.folder, "small.tsv"), None))
+
+    def test_chunks_parsed(self):
+        docs = []
+        for args in self.uploader.jobs():
+            docs.extend(self.uploader.load_data(*args))
+        self.assertEqual(len(docs), 50001)
+        self.assertEqual(docs[0], {"_id" : "id0", "value" : ""})
+        self.assertEqual(docs[-2], {"_id" : "id49999", "value" : "x" * 19})
+        self.assertEqual(docs[-1], {"_id" : "small", "value" : "data"})
+        self.assertEqual(len(set([d["_id"] for d in docs])), 50001)
+
+
+class IndexRecorder(object):
+    """Collection recording index creation (sleeping, to check builds are concurrent)"""
+
+    name = "test_temp"
+
+    def __init__(self):
+        self.created = []
+        self.threads = set()
+
+    def create_index(self, keys, background=False):
+        time.sleep(.3)
+        self.threads.add(threading.current_thread().name)
+        self.created.append((keys, background))
+        return isinstance(keys, str) and "%s_1" % keys or "_".join(["%s_%s" % k for k in keys])
+
+    def create_indexes(self, models):
+        time.sleep(.3)
+        self.threads.add(threading.current_thread().name)
+        self.created.append(models[0].document["key"])
+        return [models[0].document["name"]]
+
+
+class DummyIndexedUploader(BaseSourceUploader):
+    name = "test_indexed_uploader"
+    indexes = ["a", [("b", 1), ("c", -1)], IndexModel([("d", 1)], unique=True)]
+
+
+class TestBuildIndexes(unittest.TestCase):
+
+    def test_concurrent_builds(self):
+        loop = asyncio.new_event_loop()
+        uploader = DummyIndexedUploader(None, tempfile.gettempdir())
+        uploader.temp_collection_name = "test_temp"
+        col = IndexRecorder()
+        uploader._state["db"] = {"test_temp" : col}
+        t0 = time.time()
+        loop.run_until_complete(uploader.build_indexes(ThreadJobManager(loop, max_workers=4)))
+        self.assertLess(time.time() - t0, .8)
+        self.assertEqual(len(col.threads), 3)
+        self.assertIn(("a", True), col.created)
+        self.assertEqual([s["name"] for s in uploader.index_stats], ["a_1", "b_1_c_-1", "d_1"])
+        self.assertTrue(all(["time_in_s" in s for s in uploader.index_stats]))
+        loop.close()
+
+
+class DummyPartitionedUploader(ParallelizedSourceUploader):
+    name = "test_partitioned_uploader"
+    file_partitionable = True
+
+    def jobs(self):
+        return [("a.tsv",), ("b.tsv",)]
+
+
+class TestIncrementalUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.uploader = DummyPartitionedUploader(None, tempfile.gettempdir())
+        self.uploader.temp_collection_name = "test_temp"
+        # any collection, not empty so it's not considered unset
+        self.uploader._state["db"] = collections.defaultdict(mock.MagicMock, test_temp=mock.MagicMock())
+        self.uploader._state["logger"] = mock.Mock()
+        self.uploader._state["src_master"] = None
+        self.calls = []
+        self.uploader.copy_unchanged_documents = lambda purged: \
+                self.calls.append(("copy", purged, threading.current_thread().name))
+        @asyncio.coroutine
+        def build_indexes(job_manager):
+            self.calls.append(("indexes",))
+        self.uploader.build_indexes = build_indexes
+        self.uploader.switch_collection = lambda: self.calls.append(("switch",))
+        self.uploader.clean_archived_collections = lambda: None
+
+    def tearDown(self):
+        self.loop.close()
+
+    def update(self, changes):
+        self.uploader.get_file_changes = lambda: changes
+        self.loop.run_until_complete(self.uploader.update_data(10, ThreadJobManager(self.loop)))
+
+    def test_nothing_changed(self):
+        self.update(({"a.tsv", "b.tsv"}, set()))
+        self.assertEqual(self.calls, [])
+
+    def test_removed_file(self):
+        self.update(({"a.tsv", "b.tsv"}, {"c.tsv"}))
+        # copied in a thread, indexed before switched
+        self.assertEqual([c[0] for c in self.calls], ["copy", "indexes", "switch"])
+        self.assertEqual(self.calls[0][1], {"c.tsv"})
+        self.assertNotEqual(self.calls[0][2], threading.current_thread().name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import asyncio
+import concurrent.futures
+
+
+class ThreadJobManager(object):
+    """
+    Minimal JobManager for tests: run jobs in a thread pool, processes too,
+    so mocks apply to workers
+    """
+
+    def __init__(self, loop, max_workers=2):
+        self.loop = loop
+        # same attribute names as JobManager, one pool for both kinds of jobs
+        self.process_queue = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.thread_queue = self.process_queue
+
+    @asyncio.coroutine
+    def defer_to_thread(self, pinfo, func):
+        yield from asyncio.sleep(0)
+        return self.loop.run_in_executor(self.process_queue, func)
+
+    defer_to_process = defer_to_thread
+
+    def shutdown(self):
+        self.process_queue.shutdown()
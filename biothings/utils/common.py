@@ -20,6 +20,8 @@ import importlib
 import math, statistics
 import hashlib
 import asyncio
+import queue, threading
+from functools import partial
 from datetime import date, datetime, timezone
 
 if sys.version_info.major == 3:
@@ -148,20 +150,42 @@ def safewfile(filename, prompt=True, default='C', mode='w'):
     return open(filename, mode), filename
 
 
-def anyfile(infile, mode='r'):
+# extensions of compressed files anyfile() looks for when
+# asked for a file which doesn't exist (stream-decompressed on read)
+COMPRESSED_EXTENSIONS = ['.gz', '.xz', '.bz2']
+
+
+def anyfile(infile, mode='r', threaded=None):
     '''
-    return a file handler with the support for gzip/zip comppressed files
+    return a file handler with the support for gzip/zip/xz/bz2 comppressed files
     if infile is a two value tuple, then first one is the compressed file;
       the second one is the actual filename in the compressed file.
       e.g., ('a.zip', 'aa.txt')
-
+    if infile doesn't exist but a compressed version does (eg. infile + ".gz",
+      see COMPRESSED_EXTENSIONS), the compressed one is opened, so data can be
+      kept compressed and decompressed while being read.
+    When reading gzip/xz files and threaded is True, decompression runs in a
+      background thread (see ThreadedDecompressedFile). By default (None),
+      it's only the case for gzip files when more than one CPU is available:
+      xz decompression was measured slower that way.
     '''
     if isinstance(infile, tuple):
         infile, rawfile = infile[:2]
     else:
         rawfile = os.path.splitext(infile)[0]
+        if "r" in mode and not os.path.exists(infile):
+            for ext in COMPRESSED_EXTENSIONS:
+                if os.path.exists(infile + ext):
+                    infile = infile + ext
+                    break
     filetype = os.path.splitext(infile)[1].lower()
-    if filetype == '.gz':
+    reading = "r" in mode and not "+" in mode
+    if threaded is None:
+        threaded = filetype == '.gz' and (os.cpu_count() or 1) > 1
+    if filetype in ('.gz', '.xz') and reading and threaded:
+        in_f = io.TextIOWrapper(io.BufferedReader(ThreadedDecompressedFile(infile, filetype[1:]),
+                                                  buffer_size=1024*1024))
+    elif filetype == '.gz':
         import gzip
         in_f = io.TextIOWrapper(gzip.GzipFile(infile, mode))
     elif filetype == '.zip':
@@ -170,10 +194,128 @@ def anyfile(infile, mode='r'):
     elif filetype == '.xz':
         import lzma
         in_f = io.TextIOWrapper(lzma.LZMAFile(infile,mode))
+    elif filetype == '.bz2':
+        import bz2
+        in_f = io.TextIOWrapper(bz2.BZ2File(infile,mode))
     else:
         in_f = open(infile, mode)
     return in_f
 
+
+class ThreadedDecompressedFile(io.RawIOBase):
+    """
+    Read-only, non-seekable, file object returning decompressed data from
+    gzip ("gz") or xz ("xz") file "filename". Compressed data is read and
+    decompressed by chunks in a single background thread (zlib and lzma release
+    the GIL), while decompressed data is consumed (parsed) in the calling one.
+    Decompression itself isn't parallelized, it only overlaps with parsing, so
+    it's only worth it with more than one CPU. With xz, it was measured slower
+    than reading with lzma.LZMAFile, so anyfile() doesn't use it by default.
+    At most "max_chunks" decompressed chunks are kept in memory.
+    Multi-member gzip and multi-stream xz files are supported.
+    """
+
+    def __init__(self, filename, fmt="gz", chunk_size=1024*1024, max_chunks=16):
+        assert fmt in ("gz", "xz"), "Unsupported format '%s'" % fmt
+        self.name = filename
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.current = b""
+        self.pos = 0
+        self.eof = False
+        self.stopped = threading.Event()
+        self.fin = open(filename, "rb")
+        self.thread = threading.Thread(target=self.decompress, name="decompress-%s" % os.path.basename(filename))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def new_decompressor(self):
+        if self.fmt == "gz":
+            import zlib
+            return zlib.decompressobj(zlib.MAX_WBITS | 16)
+        else:
+            import lzma
+            return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+    def put(self, data):
+        # don't block forever if reader is gone
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(data, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decompress(self):
+        try:
+            decomp = None
+            data = b""
+            full = False
+            while not self.stopped.is_set():
+                if decomp is None:
+                    # (zero padding may follow a member/stream)
+                    data = data.lstrip(b"\x00")
+                    if not data:
+                        data = self.fin.read(self.chunk_size)
+                        if not data:
+                            break
+                        continue
+                    decomp = self.new_decompressor()
+                # output is limited to chunk_size, more can be pending
+                # without requiring more input
+                needs_input = self.fmt == "xz" and decomp.needs_input or self.fmt == "gz" and not full
+                if not data and needs_input:
+                    data = self.fin.read(self.chunk_size)
+                    if not data:
+                        raise EOFError("Compressed file '%s' ended before the " % self.name + \
+                                "end-of-stream marker was reached")
+                out = decomp.decompress(data, self.chunk_size)
+                full = len(out) == self.chunk_size
+                if decomp.eof:
+                    # next member/stream
+                    data = decomp.unused_data
+                    decomp = None
+                elif self.fmt == "gz":
+                    data = decomp.unconsumed_tail
+                else:
+                    data = b""
+                if out and not self.put(out):
+                    return
+            self.put(b"")
+        except Exception as e:
+            self.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.eof:
+            return 0
+        while self.pos >= len(self.current):
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.eof = True
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.current = chunk
+            self.pos = 0
+        size = min(len(b), len(self.current) - self.pos)
+        b[:size] = self.current[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.fin.close()
+        super(ThreadedDecompressedFile, self).close()
+
+
 def is_filehandle(fh):
     '''return True/False if fh is a file-like object'''
     return hasattr(fh, 'read') and hasattr(fh, 'close')
@@ -630,6 +772,9 @@ def untargzall(folder,pattern="*.tar.gz"):
 def gunzipall(folder,pattern="*.gz"):
     '''
     gunzip all *.gz files in "folder"
+    Note: files can also be kept compressed, anyfile() (and parsers using it,
+    like tabfile_feeder) decompress them while reading, even if given
+    the uncompressed filename.
     '''
     for f in glob.glob(os.path.join(folder,pattern)):
         # build uncompress filename from gz file and pattern
@@ -663,7 +808,7 @@ def aiogunzipall(folder, pattern, job_manager, pinfo):
     for f in glob.glob(os.path.join(folder,pattern)):
         pinfo["description"] = os.path.basename(f)
         suffix = pattern.replace("*","")
-        job = yield from job_manager.defer_to_process(pinfo, partial(gunzip,f,suffix=suffix))
+        job = yield from job_manager.defer_to_process(pinfo, partial(gunzip,f,pattern=suffix))
         def gunzipped(fut,inf):
             try:
                 res = fut.result()
@@ -689,7 +834,7 @@ def uncompressall(folder):
 def md5sum(fname):
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
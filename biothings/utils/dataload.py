@@ -6,6 +6,7 @@ mapping to JSON, cleaning.
 #from __future__ import unicode_literals
 import itertools
 import csv
+import io
 import os, os.path
 import json
 import collections
@@ -23,40 +24,42 @@ def dict_sweep(d, vals=[".", "-", "", "NA", "none", " ", "Not Available", "unkno
     """
     @param d: a dictionary
     @param vals: a string or list of strings to sweep
-    @param remove_invalid_list: when true, will remove key for which
-           list has only one value, which is part of "vals".
+    @param remove_invalid_list: when true, lists are replaced by new lists
+           instead of being modified in place. In both cases, values which
+           are part of "vals" are removed from lists, and key is removed if
+           list ends up empty.
            Ex:
                - test_dict = {'gene': [None, None], 'site': ["Intron", None], 'snp_build' : 136}
-           with remove_invalid_list == False:
-               - {'gene': [None], 'site': ['Intron'], 'snp_build': 136}
-           with remove_invalid_list == True:
+           with vals including None:
                - {'site': ['Intron'], 'snp_build': 136}
+    Document is walked iteratively (no recursion), in a single pass, then
+    dictionaries which ended up empty are removed, deepest first.
     """
-    for key, val in list(d.items()):
-        if val in vals:
-            del d[key]
-        elif isinstance(val, list):
-            if remove_invalid_list:
-                val = [v for v in val if v not in vals]
-                for item in val:
-                    if isinstance(item, dict):
-                        dict_sweep(item, vals)
-                if len(val) == 0:
-                    del d[key]
-                else:
-                    d[key] = val
-            else:
-                for item in val:
-                    if item in vals:
-                        val.remove(item)
-                    elif isinstance(item, dict):
-                        dict_sweep(item, vals)
-                if len(val) == 0:
-                    del d[key]
-        elif isinstance(val, dict):
-            dict_sweep(val, vals)
-            if len(val) == 0:
-                del d[key]
+    # dicts to sweep, and (parent,key) to check for emptiness once children are swept
+    stack = [d]
+    sweeped = []
+    while stack:
+        dd = stack.pop()
+        for key, val in list(dd.items()):
+            if val in vals:
+                del dd[key]
+            elif isinstance(val, list):
+                newval = [item for item in val if item not in vals]
+                stack.extend([item for item in newval if isinstance(item, dict)])
+                if len(newval) == 0:
+                    del dd[key]
+                elif remove_invalid_list:
+                    dd[key] = newval
+                elif len(newval) != len(val):
+                    val[:] = newval
+            elif isinstance(val, dict):
+                stack.append(val)
+                sweeped.append((dd,key))
+    # children dicts were registered after their parent
+    for dd, key in reversed(sweeped):
+        # (dict could be referenced more than once in the document)
+        if key in dd and len(dd[key]) == 0:
+            del dd[key]
     return d
 
 
@@ -347,13 +350,75 @@ def dupline_seperator(dupline, dup_sep, dup_idx=None, strip=False):
     return itertools.product(*value_li)    # itertools.product fits exactly the purpose here
 
 
+def file_byte_ranges(datafile, num_chunks):
+    '''Split datafile in (at most) num_chunks byte ranges of about the same
+       size, returned as a list of (start, end) offsets (end excluded). Each
+       range starts at the beginning of a line, so they can be parsed independently.'''
+    size = os.path.getsize(datafile)
+    bounds = [0]
+    with open(datafile, "rb") as in_f:
+        for i in range(1, num_chunks):
+            pos = size * i // num_chunks
+            if pos <= bounds[-1]:
+                continue
+            # next line start (pos itself if previous byte ends a line)
+            in_f.seek(pos - 1)
+            in_f.readline()
+            pos = in_f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ByteRangeReader(io.RawIOBase):
+    '''Raw binary stream over bytes between offsets start and end of in_f'''
+
+    def __init__(self, in_f, start, end):
+        in_f.seek(start)
+        self.in_f = in_f
+        self.remaining = max(0, end - start)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.remaining:
+            return 0
+        num = self.in_f.readinto(memoryview(b)[:self.remaining])
+        self.remaining -= num
+        return num
+
+
+def range_lines(datafile, start, end, encoding=None):
+    '''A generator to return lines from datafile found between byte offsets
+       start and end (see file_byte_ranges()). Lines are decoded as when the
+       whole file is read (see anyfile()): locale's encoding (unless specified)
+       and universal newlines.'''
+    with open(datafile, "rb") as in_f:
+        yield from io.TextIOWrapper(io.BufferedReader(ByteRangeReader(in_f, start, end)), encoding=encoding)
+
+
 def tabfile_feeder(datafile, header=1, sep='\t',
                    includefn=None,
                    coerce_unicode=True,
-                   assert_column_no=None):
-    '''a generator for each row in the file.'''
-
-    in_f = anyfile(datafile)
+                   assert_column_no=None,
+                   byte_range=None):
+    '''a generator for each row in the file.
+       if byte_range is given as (start, end) offsets (see file_byte_ranges()),
+       only rows within that range are returned, header being skipped only
+       if range is at the beginning of the file. Ranges are cut on lines, so
+       records must be line-oriented: ValueError is raised if a quoted field
+       spans lines (row would be split across ranges).'''
+
+    if byte_range:
+        in_f = range_lines(datafile, *byte_range)
+        if byte_range[0] > 0:
+            header = 0
+    else:
+        in_f = anyfile(datafile)
     reader = csv.reader(in_f, delimiter=sep)
     lineno = 0
     try:
@@ -361,7 +426,15 @@ def tabfile_feeder(datafile, header=1, sep='\t',
             next(reader)
             lineno += 1
 
+        num_lines = reader.line_num
         for ld in reader:
+            if byte_range:
+                # a quoted field spanning lines is either within this range (record read
+                # from several lines) or left open by the end of the range (field ends
+                # with a newline), either way next range would start within that field
+                if reader.line_num - num_lines > 1 or ld and ld[-1].endswith("\n"):
+                    raise ValueError("Quoted field spanning lines, '%s' can't be parsed by byte ranges" % datafile)
+                num_lines = reader.line_num
             if assert_column_no:
                 if len(ld) != assert_column_no:
                     err = "Unexpected column number:" \
@@ -497,17 +570,26 @@ def value_convert(_dict, fn, traverse_list=True):
 # is recursive for dict typed values
 def value_convert_to_number(d, skipped_keys=[]):
     """convert string numbers into integers or floats
-       skip converting certain keys in skipped_keys list"""
-    for key, val in d.items():
-        if isinstance(val, dict):
-            value_convert_to_number(val, skipped_keys)
-        if key not in skipped_keys:
-            if isinstance(val, list):
-                d[key] = [to_number(x) if not isinstance(x, dict) else value_convert_to_number(x, skipped_keys) for x in val]
-            elif isinstance(val, tuple):
-                d[key] = tuple([to_number(x) if not isinstance(x, dict) else value_convert_to_number(x, skipped_keys) for x in val])
-            else:
-                d[key] = to_number(val)
+       skip converting certain keys in skipped_keys list
+       (dict values are still converted, whatever their key)"""
+    stack = [d]
+    while stack:
+        dd = stack.pop()
+        for key, val in dd.items():
+            if isinstance(val, dict):
+                stack.append(val)
+            elif key not in skipped_keys:
+                if isinstance(val, (list, tuple)):
+                    newval = []
+                    for x in val:
+                        if isinstance(x, dict):
+                            stack.append(x)
+                            newval.append(x)
+                        else:
+                            newval.append(to_number(x))
+                    dd[key] = newval if isinstance(val, list) else tuple(newval)
+                else:
+                    dd[key] = to_number(val)
     return d
 
 
@@ -716,22 +798,93 @@ def dict_to_list(gene_d):
     return doc_li
 
 
-def merge_struct(v1, v2,aslistofdict=None):
+def hashable_value(val):
+    """
+    Return a hashable representation of val, so values can be compared
+    using hashes instead of equality, even for dict and list (unhashable).
+    Two values are equal if and only if their representations are equal
+    (type is part of the representation for containers, as [1] != (1,)).
+    Raise TypeError if val (or a value it contains) can't be represented.
+    """
+    if isinstance(val, dict):
+        return (dict, frozenset([(k, hashable_value(v)) for k, v in val.items()]))
+    elif isinstance(val, list):
+        return (list, tuple([hashable_value(v) for v in val]))
+    elif isinstance(val, tuple):
+        return (tuple, tuple([hashable_value(v) for v in val]))
+    hash(val) # raise TypeError if not hashable
+    return val
+
+
+def _list_index(lst, aggregate=None):
+    """
+    Return set of hashable values for list lst, or None if some values
+    can't be hashed. When aggregate (dict) is passed, sets are cached there
+    by list, to be re-used for subsequent merges on the same list.
+    """
+    if aggregate is not None:
+        cached = aggregate.get(id(lst))
+        # list must be the same and not modified outside merge_struct
+        if cached and cached[0] is lst and cached[2] == len(lst):
+            return cached[1]
+    try:
+        index = set([hashable_value(x) for x in lst])
+    except TypeError:
+        return None
+    if aggregate is not None:
+        aggregate[id(lst)] = [lst, index, len(lst)]
+    return index
+
+
+def merge_struct(v1, v2, aslistofdict=None, aggregate=None):
+    """
+    Merge v2 into v1 and return the merged structure. Values found in v2
+    but not in v1 are appended to v1's lists, dict are merged key by key
+    and different scalars are turned into a list.
+    List membership is tested with hashes of values (see hashable_value()),
+    so merging large lists is linear.
+    "aggregate" is an opt-in mode for repeated merges on the same (large)
+    structure, typically when merging many documents into one: pass a dict
+    (empty on first call, then the same on subsequent calls) used to cache
+    list indexes between merges. In that mode, lists from v1 are extended
+    in place and values duplicated within v2 are only added once.
+    """
 
     #print("v1 = %s" % repr(v1))
     #print("v2 = %s" % repr(v2))
 
     if isinstance(v1, list):
         #print("v1 is list ", end="")
-        if isinstance(v2, list):
-            #print("v2 is list -> extend")
-            #v1.extend(v2)
-            #v1 = list(set(v1))
-            v1 = v1 + [x for x in v2 if x not in v1]
-        else:
+        if not isinstance(v2, list):
             #print("v2 not list -> append")
-            if v2 not in v1:
-                v1.append(v2)
+            v2 = [v2]
+            if aggregate is None:
+                # single value, no need to hash the whole list
+                if v2[0] not in v1:
+                    v1.append(v2[0])
+                v2 = []
+        #print("v2 is list -> extend")
+        # hashing isn't worth it for small lists
+        index = hv2 = None
+        if v2 and (aggregate is not None or len(v1) * len(v2) >= 100):
+            index = _list_index(v1, aggregate)
+            try:
+                hv2 = [hashable_value(x) for x in v2]
+            except TypeError:
+                index = None
+        if index is None:
+            if aggregate is None:
+                v1 = v1 + [x for x in v2 if x not in v1]
+            else:
+                v1.extend([x for x in v2 if x not in v1])
+        elif aggregate is None:
+            v1 = v1 + [x for x, hx in zip(v2, hv2) if hx not in index]
+        else:
+            for x, hx in zip(v2, hv2):
+                if hx not in index:
+                    index.add(hx)
+                    v1.append(x)
+            aggregate[id(v1)][2] = len(v1)
 
     elif isinstance(v2, list) and isinstance(v1, dict):
         #return merge_struct(v2,v1)
@@ -757,9 +910,9 @@ def merge_struct(v1, v2,aslistofdict=None):
                     # we may have transformed it in a list (no merge, but just type change).
                     # if so, back to scalar
                     if v1elem != v2elem:
-                        v1[k] = merge_struct(v1elem,v2elem)
+                        v1[k] = merge_struct(v1elem,v2elem,aggregate=aggregate)
                 else:
-                    v1[k] = merge_struct(v1[k], v2[k])
+                    v1[k] = merge_struct(v1[k], v2[k], aggregate=aggregate)
             else:
                 #print("%s not in v2 -> update v1 with v2" % k)
                 #print("v2 before %s" % repr(v2))
@@ -783,7 +936,7 @@ def merge_struct(v1, v2,aslistofdict=None):
                 #print("v1 == v2, skip")
         else:
             #print("v2 iterable, reverse merge")
-            return merge_struct(v2, v1)
+            return merge_struct(v2, v1, aggregate=aggregate)
     else:
         raise TypeError("dunno how to merge type %s" % type(v1))
 
@@ -792,8 +945,19 @@ def merge_struct(v1, v2,aslistofdict=None):
 
 
 def dict_walk(dictionary, key_func):
-    """Recursively apply key_func to dict's keys"""
+    """Recursively apply key_func to dict's keys (values other than
+    dict are kept as-is). Returns a new dict, built iteratively"""
     if not isinstance(dictionary, dict):
         return dictionary
-    return dict((key_func(k), dict_walk(v, key_func))
-            for k, v in dictionary.items())
+    root = {}
+    stack = [(dictionary, root)]
+    while stack:
+        src, dst = stack.pop()
+        for k, v in src.items():
+            if isinstance(v, dict):
+                newv = {}
+                stack.append((v, newv))
+                dst[key_func(k)] = newv
+            else:
+                dst[key_func(k)] = v
+    return root
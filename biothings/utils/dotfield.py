@@ -76,3 +76,45 @@ def compose_dot_fields_by_fields(genedoc, fields):
         del res[k]
 
     return res if res else genedoc
+
+
+def project_doc(doc, projection):
+    """
+    Apply a MongoDB-like projection to doc and return the result. projection
+    is a dict of (dotted) field names, with value 1 to keep only these
+    fields (and '_id', unless '_id': 0), or 0 to remove them (doc is then
+    modified in place). Ex:
+      project_doc({'a': {'b': 1, 'c': 2}, 'd': 3}, {'a.b': 0})
+     should return
+        {'a': {'c': 2}, 'd': 3}
+    """
+    if not projection:
+        return doc
+    if [v for k, v in projection.items() if v and k != "_id"]:
+        res = {}
+        if "_id" in doc and projection.get("_id", 1):
+            res["_id"] = doc["_id"]
+        for field, keep in projection.items():
+            if not keep or field == "_id":
+                continue
+            src, dest = doc, res
+            keys = field.split(".")
+            for k in keys[:-1]:
+                if not isinstance(src.get(k), dict):
+                    break
+                src = src[k]
+                dest = dest.setdefault(k, {})
+            else:
+                if keys[-1] in src:
+                    dest[keys[-1]] = src[keys[-1]]
+        return res
+    for field in projection:
+        keys = field.split(".")
+        d = doc
+        for k in keys[:-1]:
+            d = d.get(k)
+            if not isinstance(d, dict):
+                break
+        else:
+            d.pop(keys[-1], None)
+    return doc
@@ -1,4 +1,4 @@
-import time, copy, re
+import time, copy, re, random
 import json
 from elasticsearch import Elasticsearch, NotFoundError, RequestError, TransportError
 from elasticsearch import helpers
@@ -68,7 +68,8 @@ class IndexerException(Exception): pass
 
 class ESIndexer():
     def __init__(self, index, doc_type, es_host, step=10000,
-                 number_of_shards=10, number_of_replicas=0,**kwargs):
+                 number_of_shards=10, number_of_replicas=0,
+                 bulk_max_retries=0, bulk_initial_backoff=1, bulk_max_backoff=60, **kwargs):
         self.es_host = es_host
         self._es = get_es(es_host,**kwargs)
         # if index is actually an alias, resolve the alias to
@@ -87,6 +88,13 @@ class ESIndexer():
         self.step = step  # the bulk size when doing bulk operation.
         self.s = None   # optionally, can specify number of records to skip,
                         # useful to continue indexing after an error.
+        # number of times documents rejected by ES (429, queue is full) are
+        # sent again, waiting a random ("jittered") time between attempts
+        self.bulk_max_retries = bulk_max_retries
+        self.bulk_initial_backoff = bulk_initial_backoff
+        self.bulk_max_backoff = bulk_max_backoff
+        # stats about last index_bulk() call (duration, rejections, ...)
+        self.bulk_stats = {}
 
     @wrapper
     def get_biothing(self, bid, only_source=False, **kwargs):
@@ -169,6 +177,14 @@ class ESIndexer():
         self._es.index(self._index, self._doc_type, doc, id=id, params={"op_type":action})
 
     def index_bulk(self, docs, step=None, action='index'):
+        """
+        Send docs to ES in bulk, "step" docs at a time. Docs rejected by ES
+        because it's overloaded (status 429) are re-sent up to self.bulk_max_retries
+        times, with a jittered exponential backoff between attempts. Returns a tuple
+        (number of indexed docs, list of errors), raises BulkIndexError if some
+        docs couldn't be indexed. Statistics about the operation (duration, number
+        of rejected docs, time spent in backoff, ...) are stored in self.bulk_stats.
+        """
         index_name = self._index
         doc_type = self._doc_type
         step = step or self.step
@@ -182,8 +198,56 @@ class ESIndexer():
                 "_op_type" : action,
             })
             return ndoc
-        actions = (_get_bulk(doc) for doc in docs)
-        return helpers.bulk(self._es, actions, chunk_size=step)
+
+        # "time" is the time spent waiting for ES to respond, backoff sleeps
+        # aren't included so they don't look like ES slowing down
+        stats = {"count": 0, "rejected": 0, "retried": 0, "time": 0.0, "backoff": 0.0}
+        self.bulk_stats = stats
+        success = 0
+        errors = []
+        for chunk in iter_n((_get_bulk(doc) for doc in docs), step):
+            stats["count"] += len(chunk)
+            attempt = 0
+            while chunk:
+                rejected = []
+                t0 = time.time()
+                try:
+                    cnt, errs = helpers.bulk(self._es, chunk, chunk_size=step, raise_on_error=False)
+                    stats["time"] += time.time() - t0
+                    success += cnt
+                    byid = dict([(d.get("_id"),d) for d in chunk])
+                    for err in errs:
+                        info = list(err.values())[0]
+                        if info.get("status") == 429 and info.get("_id") in byid:
+                            rejected.append(byid[info["_id"]])
+                        else:
+                            errors.append(err)
+                except TransportError as e:
+                    stats["time"] += time.time() - t0
+                    # the whole request was rejected
+                    if e.status_code != 429:
+                        raise
+                    rejected = chunk
+                if attempt == 0:
+                    stats["rejected"] += len(rejected)
+                if rejected and attempt < self.bulk_max_retries:
+                    # "full jitter" so workers rejected at the same time don't
+                    # come back hammering the cluster all together
+                    backoff = random.uniform(0,min(self.bulk_max_backoff,self.bulk_initial_backoff * 2**attempt))
+                    time.sleep(backoff)
+                    stats["backoff"] += backoff
+                    attempt += 1
+                    stats["retried"] += len(rejected)
+                    chunk = rejected
+                else:
+                    errors.extend([{action : {"_id" : d.get("_id"), "status" : 429,
+                                              "error" : "rejected (max retries reached)"}}
+                                   for d in rejected])
+                    chunk = []
+        if errors:
+            raise helpers.BulkIndexError("%i document(s) failed to index." % len(errors), errors)
+
+        return success, errors
 
     def delete_doc(self, id):
         '''delete a doc from the index based on passed id.'''
@@ -674,7 +738,7 @@ def generate_es_mapping(inspect_doc,init=True,level=0):
 # ES as HUB DB backend #
 #@######################
 from biothings.utils.hub_db import IDatabase
-from biothings.utils.dotfield import parse_dot_fields
+from biothings.utils.dotfield import parse_dot_fields, project_doc
 from biothings.utils.dataload import update_dict_recur
 from biothings.utils.common import json_serial
 
@@ -813,13 +877,27 @@ class Collection(object):
     def find(self,*args,**kwargs):
         results = []
         query = {}
-        if args and len(args) == 1 and type(args[0]) == dict and len(args[0]) > 0:
-            query = {"query":{"match":args[0]}}
+        # optional projection, as 2nd param
+        projection = args[1:] and args[1]
+        if args and len(args) <= 2 and type(args[0]) == dict and len(args[0]) > 0:
+            if len(args[0]) == 1:
+                query = {"query":{"match":args[0]}}
+            else:
+                # "match" takes only one field
+                query = {"query":{"bool":{"must":[{"match":{k:v}} for k,v in args[0].items()]}}}
+        # pymongo-like paging, done by ES
+        if kwargs.get("sort"):
+            query["sort"] = [{key:{"order":direction < 0 and "desc" or "asc"}} for key,direction in kwargs["sort"]]
+        if kwargs.get("skip"):
+            query["from"] = kwargs["skip"]
+        if kwargs.get("limit"):
+            query["size"] = kwargs["limit"]
         # it's key/value search, let's iterate
         res = self.get_conn().search(self.dbname,self.colname,query)
         for _src in res["hits"]["hits"]:
             doc = {"_id":_src["_id"]}
             doc.update(_src["_source"])
+            doc = project_doc(doc,projection)
             if "find_one" in kwargs:
                 return doc
             else:
@@ -829,6 +907,10 @@ class Collection(object):
             return None
         return results
 
+    def create_index(self,keys):
+        # documents are indexed by ES already
+        pass
+
     def insert_one(self,doc,check_unique=True):
         assert "_id" in doc
         _id = doc.pop("_id")
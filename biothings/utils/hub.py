@@ -28,11 +28,13 @@ done = "done"
 HUB_ENV = hasattr(config,"HUB_ENV") and config.HUB_ENV or "" # default: prod (or "normal")
 VERSIONS = HUB_ENV and "%s-versions" % HUB_ENV or "versions"
 LATEST = HUB_ENV and "%s-latest" % HUB_ENV or "latest"
+# number of finished commands kept in memory, older ones are fetched from hub db
+MAX_FINISHED_COMMANDS = hasattr(config,"HUB_MAX_FINISHED_COMMANDS") and config.HUB_MAX_FINISHED_COMMANDS or 1000
 
 
 def jsonreadify(cmd):
     newcmd = copy.copy(cmd)
-    newcmd.pop("jobs")
+    newcmd.pop("jobs",None)
     return newcmd
 
 ##############
@@ -47,7 +49,9 @@ class CommandDefinition(dict): pass
 
 class HubShell(InteractiveShell):
 
-    launched_commands = {}
+    running_commands = {} # command ID => info, for commands with running jobs
+    finished_commands = OrderedDict() # most recent finished commands, by finish order
+    failed_commands = set() # IDs of failed commands, among finished_commands
     pending_outputs = {}
     cmd_cnt = None
     cmd = None # "cmd" collection
@@ -63,6 +67,8 @@ class HubShell(InteractiveShell):
         self.buf = io.StringIO()
         # there should be only one shell instance (todo: singleton)
         self.__class__.cmd = get_cmd()
+        # finished commands are paged from there, see find_finished_commands()
+        self.__class__.cmd.create_index([("is_done",1),("failed",1),("_id",-1)])
         self.__class__.set_command_counter()
         super(HubShell,self).__init__(user_ns=self.extra_ns)
 
@@ -268,9 +274,8 @@ class HubShell(InteractiveShell):
         cmdnum = self.__class__.cmd_cnt
         cmdinfo = CommandInformation(cmd=cmd,jobs=result,started_at=time.time(),
                                      id=cmdnum,is_done=False)
-        assert not cmdnum in self.__class__.launched_commands
+        assert not cmdnum in self.__class__.running_commands
         # register
-        self.__class__.launched_commands[cmdnum] = cmdinfo
         self.__class__.save_cmd(cmdnum,cmdinfo)
         self.__class__.cmd_cnt += 1
 
@@ -280,6 +285,10 @@ class HubShell(InteractiveShell):
             # it's asyncio related
             result = type(result) != list and [result] or result
             cmdinfo["jobs"] = result
+            self.__class__.running_commands[cmdnum] = cmdinfo
+            # command is finished when all its jobs are
+            for job in result:
+                job.add_done_callback(partial(self.__class__.command_done,cmdnum))
             return cmdinfo
         else:
             # ... and it's not asyncio related, we can display it directly
@@ -288,13 +297,14 @@ class HubShell(InteractiveShell):
             cmdinfo["started_at"] = time.time()
             cmdinfo["finished_at"] = time.time()
             cmdinfo["duration"] = "0s"
+            self.__class__.add_finished_command(cmdinfo)
             return result
 
     def eval(self, line, return_cmdinfo=False):
         line = line.strip()
         origline = line # keep what's been originally entered
         # poor man's singleton...
-        if line in [j["cmd"] for j in self.__class__.launched_commands.values() if not j.get("is_done")]:
+        if line in [j["cmd"] for j in self.__class__.running_commands.values()]:
             raise AlreadyRunningException("Command '%s' is already running\n" % repr(line))
         # is it a hub command, in which case, intercept and run the actual declared cmd
         m = re.match("(.*)\(.*\)",line)
@@ -362,77 +372,108 @@ class HubShell(InteractiveShell):
     #def cancel(klass,jobnum):
     #    return klass.launched_commands.get(jobnum)
 
+    @classmethod
+    def add_finished_command(klass, info):
+        klass.finished_commands[info["id"]] = info
+        if info.get("failed"):
+            klass.failed_commands.add(info["id"])
+        klass.save_cmd(info["id"],info)
+        # older ones are still available from hub db
+        while len(klass.finished_commands) > MAX_FINISHED_COMMANDS:
+            num,_ = klass.finished_commands.popitem(last=False)
+            klass.failed_commands.discard(num)
+
+    @classmethod
+    def command_done(klass, num, f):
+        """
+        Done callback for command's jobs: once all of them are done,
+        command is moved from running to finished commands
+        """
+        info = klass.running_commands.get(num)
+        if not info or not all([j.done() for j in info["jobs"]]):
+            return
+        has_err = [True for j in info["jobs"] if j.exception()] or None
+        localoutputs = [str(j.exception()) for j in info["jobs"] if j.exception()] or \
+                    [j.result() for j in info["jobs"]]
+        klass.running_commands.pop(num)
+        info["is_done"] = True
+        info["failed"] = has_err and has_err[0] or False
+        info["results"] = localoutputs
+        info["finished_at"] = time.time()
+        info["duration"] = timesofar(t0=info["started_at"],t1=info["finished_at"])
+        # jobs aren't needed anymore
+        info.pop("jobs")
+        klass.add_finished_command(info)
+        if not has_err and localoutputs and set(map(type,localoutputs)) == {str}:
+            localoutputs = "\n" + "".join(localoutputs)
+        klass.pending_outputs[num] = "[%s] %s {%s} %s: finished %s " % \
+                (num,has_err and "ERR" or "OK",timesofar(info["started_at"]),info["cmd"],localoutputs)
+
     @classmethod
     def refresh_commands(klass):
-        for num,info in sorted(klass.launched_commands.items()):
-            # already process, this current command is now history
-            # Note: if we have millions of commands there, it could last quite a while,
-            # but IRL we only have a few
-            if info.get("is_done") == True:
-                continue
-            is_done = set([j.done() for j in info["jobs"]]) == set([True])
-            has_err = is_done and  [True for j in info["jobs"] if j.exception()] or None
-            localoutputs = is_done and ([str(j.exception()) for j in info["jobs"] if j.exception()] or \
-                        [j.result() for j in info["jobs"]]) or None
-            if is_done:
-                klass.launched_commands[num]["is_done"] = True
-                klass.launched_commands[num]["failed"] = has_err and has_err[0] or False
-                klass.launched_commands[num]["results"] = localoutputs
-                klass.launched_commands[num]["finished_at"] = time.time()
-                klass.launched_commands[num]["duration"] = timesofar(t0=klass.launched_commands[num]["started_at"],
-                                                                    t1=klass.launched_commands[num]["finished_at"])
-                klass.save_cmd(num,klass.launched_commands[num])
-                if not has_err and localoutputs and set(map(type,localoutputs)) == {str}:
-                    localoutputs = "\n" + "".join(localoutputs)
-                klass.pending_outputs[num] = "[%s] %s {%s} %s: finished %s " % \
-                        (num,has_err and "ERR" or "OK",timesofar(info["started_at"]),info["cmd"],localoutputs)
+        # finished commands are reported by command_done(), only running ones here
+        for num,info in sorted(klass.running_commands.items()):
+            klass.pending_outputs[num] = "[%s] RUN {%s} %s" % (num,timesofar(info["started_at"]),info["cmd"])
+
+    @classmethod
+    def find_finished_commands(klass, failed=None, skip=0, limit=None):
+        """
+        Return finished commands (most recent first), from memory if the
+        requested page is there, from hub db "cmd" collection otherwise
+        """
+        if failed is None:
+            ids = list(klass.finished_commands)
+        elif failed:
+            ids = [num for num in klass.finished_commands if num in klass.failed_commands]
+        else:
+            ids = [num for num in klass.finished_commands if not num in klass.failed_commands]
+        ids.reverse()
+        if limit is None or skip + limit <= len(ids) or \
+                len(klass.finished_commands) < MAX_FINISHED_COMMANDS:
+            # all finished commands are in memory, or at least the requested ones
+            if limit is None:
+                ids = ids[skip:]
             else:
-                klass.pending_outputs[num] = "[%s] RUN {%s} %s" % (num,timesofar(info["started_at"]),info["cmd"])
+                ids = ids[skip:skip+limit]
+            return [klass.finished_commands[num] for num in ids]
+        query = {"is_done":True}
+        if not failed is None:
+            query["failed"] = bool(failed)
+        return list(klass.cmd.find(query,sort=[("_id",-1)],skip=skip,limit=limit))
 
     @classmethod
-    def command_info(klass, id=None, running=None, failed=None):
+    def command_info(klass, id=None, running=None, failed=None, skip=0, limit=None):
+        """
+        Return command 'id' information, or commands filtered by status:
+        running (true/false) and failed (true/false, applies to finished
+        commands). Finished commands are returned most recent first and
+        can be paged with 'skip' and 'limit'.
+        """
         cmds = {}
         if not id is None:
             try:
                 id = int(id)
-                return jsonreadify(klass.launched_commands[id])
+                cmd = klass.running_commands.get(id) or klass.finished_commands.get(id) or \
+                        klass.cmd.find_one({"_id":id})
+                if not cmd:
+                    raise KeyError(id)
+                return jsonreadify(cmd)
             except KeyError:
                 raise CommandError("No such command with ID %s" % repr(id))
             except ValueError:
                 raise CommandError("Invalid ID %s" % repr(id))
         if not running is None:
-            is_done = not to_boolean(running)
-        else:
-            is_done = None
+            running = to_boolean(running)
         if not failed is None:
             failed = to_boolean(failed)
-        for _id,cmd in klass.launched_commands.items():
-            if not is_done is None:
-                # running or done commands (not both)
-                if cmd.get("is_done") == is_done:
-                    # done + failed (a failed command is always done btw)
-                    if not failed is None and cmd.get("is_done") == True:
-                        if cmd.get("failed") == failed:
-                            cmds[_id] = jsonreadify(cmd)
-                    else:
-                        # don't care if failed or not
-                        cmds[_id] = jsonreadify(cmd)
-                else:
-                    # If asked is_done=true, it means command _id has is_done=false
-                    # if we get there. So the command is sill running, so we don't
-                    # know if it failed or not, so no need to check failed there,
-                    # it's been handled above.
-                    # If asksed is_done=false, we don't need to check failed, 
-                    # same logic applies
-                    continue
-            else:
-                # either running or done commands (both)
-                if not failed is None and cmd.get("is_done") == True:
-                    if cmd.get("failed") == failed:
-                        cmds[_id] = jsonreadify(cmd)
-                else:
-                    # don't care if failed or not
-                    cmds[_id] = jsonreadify(cmd)
+        if running != False:
+            # we don't know yet if running commands failed or not,
+            # failed filter doesn't apply
+            for _id,cmd in sorted(klass.running_commands.items()):
+                cmds[_id] = jsonreadify(cmd)
+        if running != True:
+            for cmd in klass.find_finished_commands(failed,int(skip),limit and int(limit)):
+                cmds[cmd["id"]] = jsonreadify(cmd)
 
         return cmds
 
@@ -135,7 +135,8 @@ class Collection(object):
 
     def find_one(self,*args,**kwargs):
         """Return one document from the collection. *args will contain
-        a dict with the query parameters. See also find()"""
+        a dict with the query parameters, and optionally a projection.
+        See also find()"""
         raise NotImplementedError()
 
     def find(self,*args,**kwargs):
@@ -144,12 +145,27 @@ class Collection(object):
         by MongoDB. Dict can contain the name of a key, and the value being searched for.
         Ex: {"field1":"value1"} will return all documents where field1 == "value1".
         Nested key (field1.subfield1) aren't supported (no need to implement).
-        Exact matches only are required.
+        Exact matches only are required, except {"_id":{"$in":[...]}} to select
+        documents by _ids.
+
+        An optional projection can be passed in *args[1], a dict of (dotted) field
+        names, to either keep (value 1) or remove (value 0) them from returned
+        documents (see biothings.utils.dotfield.project_doc() for a generic
+        implementation).
 
         If no query is passed, or if query is an empty dict, return all documents.
+
+        Optional keyword arguments, as in pymongo: "sort", a list of (key,direction)
+        tuples (direction being 1 or -1), "skip", the number of documents to skip,
+        and "limit", the max number of documents to return (0 or None means no limit).
         """
         raise NotImplementedError()
 
+    def create_index(self,keys):
+        """Create an index on keys, a list of (key,direction) tuples, as in pymongo.
+        Backends without index support can ignore it (do nothing)."""
+        raise NotImplementedError()
+
     def insert_one(self,doc):
         """Insert a document in the collection. Raise an error if already inserted"""
         raise NotImplementedError()
@@ -235,6 +251,8 @@ class ChangeWatcher(object):
 
     listeners = set()
     event_queue = asyncio.Queue()
+    # loop publishing events, see publish()
+    loop = None
     do_publish = False
 
     col_entity = {
@@ -248,6 +266,7 @@ class ChangeWatcher(object):
     @classmethod
     def publish(klass):
         klass.do_publish = True
+        klass.loop = asyncio.get_event_loop()
         @asyncio.coroutine
         def do():
             while klass.do_publish:
@@ -267,10 +286,20 @@ class ChangeWatcher(object):
         klass.listeners.add(listener)
         klass.publish()
 
+    @classmethod
+    def notify(klass,event):
+        # collections are also written from worker threads, and asyncio.Queue
+        # isn't thread-safe: event is queued from the publishing loop's thread
+        if klass.loop is None or klass.loop.is_closed():
+            return
+        klass.loop.call_soon_threadsafe(klass.event_queue.put_nowait,event)
+
     @classmethod
     def monitor(klass,func,entity,op):
         @wraps(func)
         def func_wrapper(*args,**kwargs):
+            # listeners (eg. caches) must see the change once it's actually written
+            res = func(*args,**kwargs)
             # don't speak alone in the immensity of the void
             if klass.listeners:
                 # try to narrow down the event to a doc
@@ -282,13 +311,12 @@ class ChangeWatcher(object):
                     if entity == "event":
                         # sends everything
                         event["data"] = args[0]
-                    klass.event_queue.put_nowait(event)
+                    klass.notify(event)
                 else:
                     # can't find ID, we send a general event (not specific to one doc)
                     event = {"obj" : entity, "op" : op}
-                    klass.event_queue.put_nowait(event)
-
-            return func(*args,**kwargs)
+                    klass.notify(event)
+            return res
         return func_wrapper
 
     @classmethod
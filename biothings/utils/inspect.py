@@ -23,6 +23,13 @@ class BaseMode(object):
     # key under which values are stored for this mode
     key = None
 
+    def init_values(self):
+        """
+        Return a new, empty, structure storing values for this mode
+        (what's stored under self.key)
+        """
+        return copy.deepcopy(self.template[self.key])
+
     def report(self, struct, drep, orig_struct=None):
         """
         Given a data structure "struct" being inspected, report (fill)
@@ -50,6 +57,9 @@ class StatsMode(BaseMode):
     template = {"_stats" : {"_min":math.inf,"_max":-math.inf,"_count":0}}
     key = "_stats"
 
+    def init_values(self):
+        return {"_min":math.inf,"_max":-math.inf,"_count":0}
+
     def sumiflist(self, val):
         if type(val) == list:
             return sum(val)
@@ -71,16 +81,21 @@ class StatsMode(BaseMode):
         stats["_min"] = self.maxminiflist(stats["_min"],min)
         return stats
 
-    def report(self, struct, drep, orig_struct=None):
+    def value(self, struct):
+        # value stats are computed on (length for strings and containers)
         if is_str(struct) or type(struct) in [dict,list]:
-            val = len(struct)
+            return len(struct)
         else:
-            val = struct
-        drep[self.key]["_count"] += 1
-        if val < drep[self.key]["_min"]:
-            drep[self.key]["_min"] = val
-        if val > drep[self.key]["_max"]:
-            drep[self.key]["_max"] = val
+            return struct
+
+    def report(self, struct, drep, orig_struct=None):
+        val = self.value(struct)
+        stats = drep[self.key]
+        stats["_count"] += 1
+        if val < stats["_min"]:
+            stats["_min"] = val
+        if val > stats["_max"]:
+            stats["_max"] = val
 
     def merge(self, target_stats, tomerge_stats):
         target_stats = self.flatten_stats(target_stats)
@@ -99,15 +114,24 @@ class DeepStatsMode(StatsMode):
     template = {"_stats" : {"_min":math.inf,"_max":-math.inf,"_count":0,"__vals":[]}}
     key = "_stats"
 
+    def init_values(self):
+        return {"_min":math.inf,"_max":-math.inf,"_count":0,"__vals":[]}
+
     def merge(self, target_stats, tomerge_stats):
         super(DeepStatsMode, self).merge(target_stats,tomerge_stats)
         # extend values
         target_stats.get("__vals",[]).extend(tomerge_stats.get("__vals",[]))
 
-    def report(self, val, drep, orig_struct=None):
-        super(DeepStatsMode, self).report(val,drep,orig_struct)
+    def report(self, struct, drep, orig_struct=None):
+        val = self.value(struct)
+        stats = drep[self.key]
+        stats["_count"] += 1
+        if val < stats["_min"]:
+            stats["_min"] = val
+        if val > stats["_max"]:
+            stats["_max"] = val
         # keep track of vals for now, stats are computed at the end
-        drep[self.key]["__vals"].append(val)
+        stats["__vals"].append(val)
 
     def post(self, mapt, mode,clean):
         if type(mapt) == dict:
@@ -196,20 +220,56 @@ def get_mode_layer(mode):
         return None
 
 
+def signature(struct,mode="type"):
+    """
+    Return a hashable signature of struct's structure: two structures with
+    the same signature give the same inspection results in "type" mode (or
+    in "mapping" mode, if mode is "mapping": splittable strings are then
+    distinguished). Lists' signatures ignore elements' order and repetitions.
+    """
+    typ = type(struct)
+    if typ is dict:
+        return tuple([(k,signature(v,mode)) for k,v in struct.items()])
+    elif typ is list:
+        return (list,frozenset([signature(e,mode) for e in struct]))
+    elif mode == "mapping":
+        if typ is str and " " in struct.strip():
+            return splitstr
+        elif typ is bson.int64.Int64:
+            return int
+    return typ
+
+
+def merge_mode_record(target,tomerge,mode_inst):
+    """
+    Merge maps inspected with a mode layer (eg. "stats"). Structure is the
+    same at any level (nested dicts), mode's values are found under mode_inst.key
+    and merged by the mode layer itself.
+    """
+    for k in tomerge:
+        if not k in target:
+            target[k] = tomerge[k]
+        elif k == mode_inst.key:
+            mode_inst.merge(target[k],tomerge[k])
+        elif type(target[k]) == dict and type(tomerge[k]) == dict:
+            merge_mode_record(target[k],tomerge[k],mode_inst)
+        else:
+            # value computed in post() (eg. "_median"), computed again once merged
+            target[k] = tomerge[k]
+    return target
+
+
 def merge_record(target,tomerge,mode):
     mode_inst = get_mode_layer(mode)
+    if mode_inst:
+        return merge_mode_record(target,tomerge,mode_inst)
     for k in tomerge:
         if k in target:
-            if mode_inst and mode_inst.key == k:
-                tgt = target[mode_inst.key]
-                tom = tomerge[mode_inst.key]
-                mode_inst.merge(tgt,tom)
-                continue
             if not isinstance(tomerge[k], collections.Iterable):
                 continue
             for typ in tomerge[k]:
                 # if not an actual type we need to merge further to reach them
-                if mode_inst is None and (type(typ) != type or typ == list):
+                if type(typ) != type or typ == list:
                     target[k].setdefault(typ,{})
                     target[k][typ] = merge_record(target[k][typ],tomerge[k][typ],mode)
                 else:
@@ -218,26 +278,18 @@ def merge_record(target,tomerge,mode):
                         # target with tomerge's values and in mode "type"
                         # there's no actual information for scalar fields
                         # (eg a string field will be like: {"myfield" : {str:{}}}
-                        target[k].update(tomerge[k])
+                        # (only that type though, sub-fields are merged in their own iteration)
+                        target[k][typ] = tomerge[k][typ]
                     elif mode == "mapping":
                         # keep track on splitable (precedence: splitable > non-splitable)
                         # so don't merge if target has a "split" and tomerge has not,
-                        # as we would loose that information
+                        # as we would loose that information. Other types are kept,
+                        # as merge_scalar_list() does, to report conflicts
+                        if typ is str and splitstr in target[k]:
+                            continue
+                        target[k][typ] = tomerge[k][typ]
                         if splitstr is typ:
-                            target.pop(k)
-                            target[k] = tomerge[k]
-                    elif mode_inst:
-                        if typ in target[k]:
-                            # same key, same type, need to merge
-                            if not mode_inst.key in tomerge[k][typ]:
-                                # we try to merge record at a too higher level, need to merge deeper
-                                target[k] = merge_record(target[k],tomerge[k],mode)
-                                continue
-                            tgt = target[k][typ][mode_inst.key]
-                            tom = tomerge[k][typ][mode_inst.key]
-                            mode_inst.merge(tgt,tom)
-                        else:
-                            target[k].setdefault(typ,{}).update(tomerge[k][typ])
+                            target[k].pop(str,None)
                     else:
                         raise ValueError("Unknown mode '%s'" % mode)
         else:
@@ -245,11 +297,7 @@ def merge_record(target,tomerge,mode):
             if mode == "type":
                 target.setdefault(k,{}).update(tomerge[k])
             else:
-                if mode_inst:
-                    # running special mode, we just set the keys in target
-                    target.setdefault(k,tomerge[k])
-                else:
-                    target.setdefault(k,{}).update(tomerge[k])
+                target.setdefault(k,{}).update(tomerge[k])
                 # if we already have splitstr and we want to merge str, skip it
                 # as splitstr > str
                 if str in target and splitstr in target:
@@ -268,59 +316,47 @@ def inspect(struct,key=None,mapt=None,mode="type",level=0,logger=logging):
     - (level: is for internal purposes, mostly debugging)
     - mode: see inspect_docs() documentation
     """
-
-    mode_inst = get_mode_layer(mode)
-
     # init recording structure if none were passed
     if mapt is None:
         mapt = {}
+    return _inspect(struct,mapt,mode,get_mode_layer(mode))
 
-    if type(struct) == dict:
-        # was this struct already explored before ? was it a list for that previous doc ?
-        # then we have to pretend here it's also a list even if not, because we want to
-        # report the list structure
-        for k in struct:
-            if mapt and list in mapt:# and key == k:
-                already_explored_as_list = True
-            else:
-                already_explored_as_list = False
-            if False:#already_explored_as_list:
-                mapt[list].setdefault(k,{})
-                typ = inspect(struct[k],key=k,mapt=mapt[list][k],mode=mode,level=level+1)
-                mapt[list].update({k:typ})
-            else:
-                mapt.setdefault(k,{})
-                typ = inspect(struct[k],key=k,mapt=mapt[k],mode=mode,level=level+1)
 
+def _inspect(struct,mapt,mode,mode_inst):
+    typ = type(struct)
+    if typ is dict:
+        for k in struct:
+            submapt = mapt.get(k)
+            if submapt is None:
+                submapt = mapt[k] = {}
+            _inspect(struct[k],submapt,mode,mode_inst)
         if mode_inst:
-            mapt.setdefault(mode_inst.key,copy.deepcopy(mode_inst.template[mode_inst.key]))
+            if not mode_inst.key in mapt:
+                mapt[mode_inst.key] = mode_inst.init_values()
             mode_inst.report(1,mapt,struct)
-    elif type(struct) == list:
-
+    elif typ is list:
         mapl = {}
         for e in struct:
-            typ = inspect(e,key=key,mapt=mapl,mode=mode,level=level+1)
-            mapl.update(typ)
+            _inspect(e,mapl,mode,mode_inst)
         if mode_inst:
             # here we just report that one document had a list
-            mapl.update(copy.deepcopy(mode_inst.template))
+            mapl[mode_inst.key] = mode_inst.init_values()
             mode_inst.report(struct,mapl)
         # if mapt exist, it means it's been explored previously but not as a list,
         # instead of mixing dict and list types, we want to normalize so we merge the previous
         # struct into that current list
-        if mapt and list in mapt:
+        if list in mapt:
             mapt[list] = merge_record(mapt[list],mapl,mode)
         else:
-            mapt.setdefault(list,{})
-            mapt[list].update(mapl)
-    elif is_scalar(struct) or type(struct) == datetime:
-        typ = type(struct)
+            mapt[list] = mapl
+    elif is_scalar(struct) or typ == datetime:
         if mode == "type":
             mapt[typ] = {}
         elif mode == "mapping":
             # some type precedence processing...
             # splittable string ?
-            if is_str(struct) and len(re.split(" +",struct.strip())) > 1:
+            # (stripped string contains a space <=> len(re.split(" +",struct.strip())) > 1)
+            if is_str(struct) and " " in struct.strip():
                 mapt[splitstr] = {}
             elif typ == bson.int64.Int64:
                 mapt[int] = {}
@@ -333,8 +369,10 @@ def inspect(struct,key=None,mapt=None,mode="type",level=0,logger=logging):
             if int in mapt and float in mapt:
                 mapt.pop(int)
         else:
-            mapt.setdefault(typ,copy.deepcopy(mode_inst.template))
-            mode_inst.report(struct,mapt[typ])
+            vals = mapt.get(typ)
+            if vals is None:
+                vals = mapt[typ] = {mode_inst.key : mode_inst.init_values()}
+            mode_inst.report(struct,vals)
     else:
         raise TypeError("Can't analyze type %s (data was: %s)" % (type(struct),struct))
 
@@ -397,6 +435,13 @@ def merge_scalar_list(mapt,mode):
             merge_scalar_list(e,mode)
 
 
+# max number of structure signatures kept (per mode) by inspect_docs()
+MAX_SIGNATURES = 10000
+# when that number is reached, if less than this ratio of documents were skipped
+# thanks to signatures, documents' structures are too diverse and signatures
+# aren't used anymore. Otherwise signatures are forgotten and collected again
+MIN_SIGNATURE_HIT_RATIO = 0.5
+
 def inspect_docs(docs, mode="type", clean=True, merge=False, logger=logging,
                  pre_mapping=False, limit=None, sample=None, metadata=True):
     """Inspect docs and return a summary of its structure:
@@ -435,13 +480,34 @@ def inspect_docs(docs, mode="type", clean=True, merge=False, logger=logging,
     if limit:
         limit = int(limit)
         logger.debug("Limiting inspection to the %s first documents" % limit)
+    # in these modes, documents with a structure already inspected wouldn't
+    # change the results, they're skipped
+    # (number of signatures is bounded, see MAX_SIGNATURES)
+    seen = dict([(m,set()) for m in modes if m in ("type","mapping")])
+    hits = dict([(m,0) for m in seen])
+    mode_insts = dict([(m,get_mode_layer(m)) for m in modes])
     for doc in docs:
         if not sample is None:
             if random.random() <= sample:
                 continue
         for m in modes:
             try:
-                inspect(doc,mapt=_map[m],mode=m)
+                if m in seen:
+                    sig = signature(doc,m)
+                    if sig in seen[m]:
+                        hits[m] += 1
+                        continue
+                    _inspect(doc,_map[m],m,mode_insts[m])
+                    if len(seen[m]) >= MAX_SIGNATURES:
+                        if hits[m] < MIN_SIGNATURE_HIT_RATIO * (hits[m] + len(seen[m])):
+                            logger.debug("Too many different structures, not using signatures anymore for mode '%s'" % m)
+                            seen.pop(m)
+                            continue
+                        seen[m].clear()
+                        hits[m] = 0
+                    seen[m].add(sig)
+                else:
+                    _inspect(doc,_map[m],m,mode_insts[m])
             except Exception as e:
                 logging.exception("Can't inspect document (_id: %s) because: %s\ndoc: %s" % (doc.get("_id"),e,pformat("dpc")))
                 errors.add(str(e))
@@ -477,6 +543,69 @@ def inspect_docs(docs, mode="type", clean=True, merge=False, logger=logging,
         _map["errors"] = errors
     return _map
 
+def merge_inspect_results(target, tomerge, modes):
+    """
+    Merge inspection results "tomerge" into "target". Results are partial,
+    obtained with inspect_docs(...,clean=False,pre_mapping=True) on a subset of
+    documents (eg. a batch of _ids). Once all partial results are merged, they
+    must be post-processed (see post_inspect_results()).
+    """
+    for m in modes:
+        target[m] = merge_record(target.setdefault(m,{}),tomerge[m],m)
+    if tomerge.get("errors"):
+        target.setdefault("errors",set()).update(tomerge["errors"])
+    return target
+
+
+def post_inspect_results(inspected, modes, clean=True):
+    """
+    Post-process merged partial results (see merge_inspect_results()),
+    as inspect_docs() does. Mapping, if any, is still a pre-mapping.
+    """
+    for m in modes:
+        mode_inst = get_mode_layer(m)
+        if mode_inst:
+            mode_inst.post(inspected[m],m,clean)
+    if "mapping" in modes:
+        # scalars and lists may have been found in different partials
+        merge_scalar_list(inspected["mapping"],"mapping")
+    return inspected
+
+
+def reservoir_sample(iterable, size, rand=random):
+    """
+    Uniformly sample "size" elements from iterable, without knowing its
+    length (reservoir sampling). Return (sample,total), total being the
+    number of elements found in iterable
+    """
+    sample = []
+    total = 0
+    for total,elem in enumerate(iterable,1):
+        if total <= size:
+            sample.append(elem)
+        else:
+            pos = int(rand.random() * total)
+            if pos < size:
+                sample[pos] = elem
+    return sample,total
+
+
+def sample_confidence(size, total, confidence=0.95):
+    """
+    Describe how representative a uniform sample of "size" elements, among
+    "total", is. In modes "type" and "mapping", any field or type found in more
+    than "max_missed_frequency" of the documents would have been found in the
+    sample, with given confidence.
+    """
+    if size >= total:
+        missed = 0.0
+    else:
+        # (1 - missed)^size = 1 - confidence
+        missed = 1 - (1 - confidence) ** (1 / size)
+    return {"size" : size, "total" : total, "confidence" : confidence,
+            "max_missed_frequency" : missed}
+
+
 def compute_metadata(mapt,mode):
     if mode == "mapping":
         flat = flatten_doc(mapt["mapping"])
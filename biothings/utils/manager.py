@@ -1,7 +1,7 @@
-import importlib, threading, re, copy
+import importlib, threading, re, copy, json
+import multiprocessing
 import asyncio, aiocron
 import os, inspect, types, glob, psutil
-import dill as pickle
 from functools import wraps, partial
 import time, datetime
 from pprint import pprint, pformat
@@ -18,6 +18,134 @@ from biothings.utils.hub_db import get_src_dump, get_src_build
 # see psutil cpu_percent() recommandation
 # this is in seconds, and provokes a blocking call, so keep it low
 CPU_PERCENT_WAIT_DELAY = 0.1
+# while jobs are waiting to be launched, hub memory is sampled every
+# MEMORY_WATCH_DELAY seconds (waiting jobs are woken up when it decreases),
+# and constraints are anyway checked again after ADMISSION_RECHECK_DELAY
+# seconds (predicates may depend on things other than jobs)
+MEMORY_WATCH_DELAY = 1
+ADMISSION_RECHECK_DELAY = 5
+
+# job tracker receiving job states from workers, set by JobManager
+# (forked worker processes inherit it)
+job_tracker = None
+
+
+class JobTracker(object):
+    """
+    Keep track of running and finished jobs. Workers report their job
+    state (when starting and when done) through report(): jobs running
+    in the hub process (threads) update states directly, worker processes
+    send them through a pipe, read by a thread in the hub process.
+    If journal (a file path) is given, job starts and ends are also appended
+    there, so jobs interrupted by a hub crash can be reported on next start
+    (see recover()). Journal is truncated whenever no job is running. At
+    most max_done finished jobs are kept.
+    """
+
+    def __init__(self, journal=None, max_done=1000):
+        self.hub_pid = os.getpid()
+        self.running = {}
+        self.done = OrderedDict()
+        self.max_done = max_done
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.queue = multiprocessing.SimpleQueue()
+        self.reader = threading.Thread(target=self.read,name="JobTracker",daemon=True)
+        self.reader.start()
+
+    def read(self):
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                break
+            self.update(*msg)
+
+    def stop(self, timeout=5):
+        """
+        Stop reading job states sent by workers (the ones already
+        sent are processed first)
+        """
+        if self.reader.is_alive():
+            self.queue.put(None)
+            self.reader.join(timeout)
+
+    def report(self, op, key, info):
+        if os.getpid() == self.hub_pid:
+            self.update(op,key,info)
+            return
+        try:
+            self.queue.put((op,key,info))
+        except Exception:
+            # can't pickle exception, keep its string representation
+            info["err"] = str(info.get("err"))
+            self.queue.put((op,key,info))
+
+    def update(self, op, key, info):
+        with self.lock:
+            if op == "start":
+                self.running[key] = info
+            else:
+                worker = self.running.pop(key,None)
+                if worker is None:
+                    return
+                worker.update(info)
+                self.done[key] = worker
+                while len(self.done) > self.max_done:
+                    self.done.popitem(last=False)
+            if self.journal:
+                self.write_journal(op,key,info)
+
+    def write_journal(self, op, key, info):
+        if op == "done" and not self.running:
+            # nothing to recover anymore
+            open(self.journal,"w").close()
+            return
+        entry = {"op" : op, "key" : key}
+        if op == "start":
+            entry["worker"] = info
+        with open(self.journal,"a") as fout:
+            fout.write(json.dumps(entry,default=str) + "\n")
+
+    def recover(self):
+        """
+        Register jobs found running in journal (hub stopped while they
+        were running) as finished, with an error, and reset journal
+        """
+        if not self.journal or not os.path.exists(self.journal):
+            return
+        interrupted = OrderedDict()
+        with open(self.journal) as fin:
+            for line in fin:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line could have been partially written
+                    continue
+                if entry["op"] == "start":
+                    interrupted[entry["key"]] = entry["worker"]
+                else:
+                    interrupted.pop(entry["key"],None)
+        open(self.journal,"w").close()
+        with self.lock:
+            for key,worker in interrupted.items():
+                logger.warning("Job %s was interrupted (hub stopped while running)" % key)
+                worker["err"] = "interrupted, hub stopped while job was running"
+                worker["duration"] = "n/a"
+                self.done[key] = worker
+
+    def get_running(self, ptype=None):
+        with self.lock:
+            return [w for w in self.running.values() if ptype is None or w["ptype"] == ptype]
+
+    def get_done(self):
+        with self.lock:
+            return list(self.done.items())
+
+    def purge(self, keys):
+        with self.lock:
+            for key in keys:
+                self.done.pop(key,None)
+
 
 def track(func):
     @wraps(func)
@@ -40,8 +168,8 @@ def track(func):
             # usefull information like predicates
             pinfo = copy.deepcopy(args[2])
 
-        # predicates can't be pickles/dilled
-        pinfo.pop("__predicates__",None)
+        # predicates can't be pickled (sent to the hub process)
+        pinfo and pinfo.pop("__predicates__",None)
         # just informative, so stringify is just ok there)
         # make sure we can pickle the whole thing (and it's
         innerargs = [str(arg) for arg in innerargs]
@@ -61,12 +189,12 @@ def track(func):
 
         pinfo["started_at"] = time.time()
         worker = {'func_name' : fname,
-                 'args': innerargs, 'kwargs' : kwargs,
-                 'job' : pinfo}
+                 'args': innerargs, 'kwargs' : dict([(k,str(v)) for k,v in kwargs.items()]),
+                 'ptype' : ptype, 'job' : pinfo}
         results = None
         exc = None
         trace = None
-        pidfile = None
+        key = None
         try:
             _id = None
             if ptype == "thread":
@@ -74,11 +202,11 @@ def track(func):
             else:
                 _id = os.getpid()
             # add random chars: 2 jobs handled by the same slot (pid or thread) 
-            # would override filename otherwise
-            fn = "%s_%s" % (_id,job_id)
+            # would override each other otherwise
+            key = "%s_%s" % (_id,job_id)
             worker["job"]["id"] = _id
-            pidfile = os.path.join(config.RUN_DIR,"%s.pickle" % fn)
-            pickle.dump(worker, open(pidfile,"wb"))
+            if job_tracker:
+                job_tracker.report("start",key,worker)
             results = func(*args,**kwargs)
         except Exception as e:
             import traceback
@@ -87,22 +215,10 @@ def track(func):
             # we want to store exception so for now, just make a reference
             exc = e
         finally:
-            if pidfile and os.path.exists(pidfile):
-                pass
-                # move to "done" dir and register end of execution time 
-                os.rename(pidfile,os.path.join(config.RUN_DIR,"done",os.path.basename(pidfile)))
-                pidfile = os.path.join(config.RUN_DIR,"done",os.path.basename(pidfile))
-                worker = pickle.load(open(pidfile,"rb"))
-                worker["duration"] = timesofar(worker["job"]["started_at"])
-                worker["err"] = exc
-                worker["trace"] = trace
-                # try to keep original exception, but this may fail depending on
-                # what's in the exception. If we can't, keep the string representation
-                try:
-                    pickle.dump(worker,open(pidfile,"wb"))
-                except Exception:
-                    worker["err"] = str(exc)
-                    pickle.dump(worker,open(pidfile,"wb"))
+            if key and job_tracker:
+                # register end of execution time
+                job_tracker.report("done",key,{"duration" : timesofar(pinfo["started_at"]),
+                                               "err" : exc, "trace" : trace})
         # now raise original exception
         if exc:
             raise exc
@@ -339,7 +455,14 @@ class JobManager(object):
             self.loop.set_default_executor(self.thread_queue)
         else:
             self.loop.set_default_executor(self.process_queue)
-        self.ok_to_run = asyncio.Semaphore()
+        # jobs waiting to be launched (constraints are checked) at the same time,
+        # callers submitting more jobs are blocked until some are launched
+        self.ok_to_run = asyncio.Semaphore(max(getattr(config,"MAX_QUEUED_JOBS",1),1),loop=self.loop)
+        # notified when waiting jobs should check their constraints again
+        self.admission = asyncio.Condition(loop=self.loop)
+        self.num_waiting = 0
+        self.memory_watcher = None
+        self.reserved_memory = {} # job_id => memory required by running jobs (__reqs__)
 
         if max_memory_usage == "auto":
             # try to find a nice limit...
@@ -353,9 +476,17 @@ class JobManager(object):
         self.max_memory_usage = max_memory_usage
         self.avail_memory = int(psutil.virtual_memory().available)
         self._phub = None
-        donedir = os.path.join(config.RUN_DIR,"done")
-        if not os.path.exists(donedir):
-            os.makedirs(donedir)
+        if not os.path.exists(config.RUN_DIR):
+            os.makedirs(config.RUN_DIR)
+        # job states are only kept in memory, unless asked to persist them
+        # so jobs interrupted by a crash can be reported
+        journal = getattr(config,"HUB_PERSIST_JOBS",False) and os.path.join(config.RUN_DIR,"jobs.journal") or None
+        self.tracker = JobTracker(journal=journal,max_done=getattr(config,"HUB_MAX_FINISHED_JOBS",1000))
+        global job_tracker
+        if job_tracker:
+            # replaced, its reader thread would be left waiting for ever
+            job_tracker.stop()
+        job_tracker = self.tracker
         self.clean_staled()
         self.auto_recycle = auto_recycle # active
         self.auto_recycle_setting = auto_recycle # keep setting if we need to restore it its orig value
@@ -383,6 +514,8 @@ class JobManager(object):
                     self.process_queue = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers)
                 else:
                     self.process_queue = None
+                    # workers are gone, no more job states to read
+                    self.stop_tracker()
             except Exception as e:
                 logger.error("Error while recycling the process queue: %s" % e)
                 raise
@@ -407,35 +540,15 @@ class JobManager(object):
             futkill = asyncio.ensure_future(kill())
         return fut
 
+    def stop_tracker(self):
+        global job_tracker
+        self.tracker.stop()
+        if job_tracker is self.tracker:
+            job_tracker = None
+
     def clean_staled(self):
-        # clean old/staled files
-        children_pids = [p.pid for p in self.hub_process.children()]
-        active_tids = [t.getName() for t in self.thread_queue._threads]
-        pid_pat = re.compile(".*/(\d+)_.*\.pickle") # see track() for filename format
-        for fn in glob.glob(os.path.join(config.RUN_DIR,"*.pickle")):
-            pid = pid_pat.findall(fn)
-            if not pid:
-                continue
-            try:
-                pid = int(pid[0].split("_")[0])
-            except IndexError:
-                logger.warning("Invalid PID file '%s', skip it" % fn)
-                raise
-            if not pid in children_pids:
-                logger.info("Removing staled pid file '%s'" % fn)
-                os.unlink(fn)
-        tid_pat = re.compile(".*/(Thread\w*-\d+)_.*\.pickle")
-        for fn in glob.glob(os.path.join(config.RUN_DIR,"*.pickle")):
-            try:
-                tid = tid_pat.findall(fn)[0].split("_")[0]
-            except IndexError:
-                logger.warning("Invalid TID file '%s', skip it" % fn)
-                raise
-            if not tid:
-                continue
-            if not tid in active_tids:
-                logger.info("Removing staled thread file '%s'" % fn)
-                os.unlink(fn)
+        # report jobs interrupted by a previous hub crash, if persisted
+        self.tracker.recover()
 
     def recycle_process_queue(self):
         """
@@ -448,82 +561,110 @@ class JobManager(object):
         """
         return self.stop(recycling=True)
 
-    @asyncio.coroutine
-    def check_constraints(self,pinfo=None):
+    def admission_blocker(self,pinfo,hub_mem):
+        """
+        Return the reason why job described in pinfo can't be launched
+        now, given hub_mem (hub memory usage), or None if it can
+        """
+        if self.max_memory_usage and hub_mem >= self.max_memory_usage:
+            if self.auto_recycle and not self.jobs:
+                logger.info("No worker running, recycling the process queue...")
+                # don't recycle again while recycling
+                self.auto_recycle = False
+                fut = self.recycle_process_queue()
+                def recycled(f):
+                    res = f.result()
+                    # still out of memory ?
+                    avail_mem = self.max_memory_usage - self.hub_memory
+                    if avail_mem <= 0:
+                        logger.error("After recycling process queue, " + \
+                                     "memory usage is still too high (needs at least %s more)" % sizeof_fmt(abs(avail_mem)) + \
+                                     "now turn auto-recycling off to prevent infinite recycling...")
+                    else:
+                        self.auto_recycle = self.auto_recycle_setting
+                    self.wake_up()
+                fut.add_done_callback(recycled)
+            return "hub is using too much memory (%s used, more than max allowed %s)" % \
+                    (sizeof_fmt(hub_mem),sizeof_fmt(self.max_memory_usage))
         mem_req = pinfo and pinfo.get("__reqs__",{}).get("mem") or 0
-        t0 = time.time()
-        waited = False
-        sleep_time = 5 
-        if mem_req:
-            logger.info("Job {cat:%s,source:%s,step:%s} requires %s memory, checking if available" % \
-                    (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), sizeof_fmt(mem_req)))
-        if self.max_memory_usage:
-            hub_mem = self.hub_memory
-            while hub_mem >= self.max_memory_usage:
-                if self.auto_recycle:
-                    pworkers = self.get_pid_files()
-                    tworkers = self.get_thread_files()
-                    if len(pworkers) == 0 and len(tworkers) == 0:
-                        logger.info("No worker running, recycling the process queue...")
-                        fut = self.recycle_process_queue()
-                        def recycled(f):
-                            res = f.result()
-                            # still out of memory ?
-                            avail_mem = self.max_memory_usage - self.hub_memory
-                            if avail_mem <= 0:
-                                logger.error("After recycling process queue, " + \
-                                             "memory usage is still too high (needs at least %s more)" % sizeof_fmt(abs(avail_mem)) + \
-                                             "now turn auto-recycling off to prevent infinite recycling...")
-                                self.auto_recycle = False
-                        fut.add_done_callback(recycled)
-                logger.info("Hub is using too much memory to launch job {cat:%s,source:%s,step:%s} (%s used, more than max allowed %s), wait a little (job's already been postponed for %s)" % \
-                        (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), sizeof_fmt(hub_mem),
-                         sizeof_fmt(self.max_memory_usage),timesofar(t0)))
-                yield from asyncio.sleep(sleep_time)
-                waited = True
-                hub_mem = self.hub_memory
         if mem_req:
             # max allowed mem is either the limit we gave and the os limit
             max_mem = self.max_memory_usage and self.max_memory_usage or self.avail_memory
-            # TODO: check projected memory (jobs with mem requirements currently running
-            # as those jobs may not have reached their max mem usage yet)
-            hub_mem = self.hub_memory
-            while mem_req >= (max_mem - hub_mem):
-                logger.info("Job {cat:%s,source:%s,step:%s} needs %s to run, not enough to launch it (hub consumes %s while max allowed is %s), wait a little  (job's already been postponed for %s)" % \
-                        (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), sizeof_fmt(mem_req), sizeof_fmt(hub_mem),
-                         sizeof_fmt(max_mem), timesofar(t0)))
-                yield from asyncio.sleep(sleep_time)
-                waited = True
-                # refresh limites and usage (manager can be modified from hub
-                # thus memory usage can be modified on-the-fly
-                hub_mem = self.hub_memory
-                max_mem = self.max_memory_usage and self.max_memory_usage or self.avail_memory
+            # memory required by running jobs is reserved (they may not have
+            # reached their max memory usage yet)
+            reserved = sum(self.reserved_memory.values())
+            if mem_req >= (max_mem - hub_mem - reserved):
+                return "needs %s to run, not enough (hub consumes %s, %s reserved, while max allowed is %s)" % \
+                        (sizeof_fmt(mem_req),sizeof_fmt(hub_mem),sizeof_fmt(reserved),sizeof_fmt(max_mem))
         pendings = len(self.process_queue._pending_work_items.keys()) - config.HUB_MAX_WORKERS
-        while pendings >= config.MAX_QUEUED_JOBS:
-            if not waited:
-                logger.info("Can't run job {cat:%s,source:%s,step:%s} right now, too much pending jobs in the queue (max: %s), will retry until possible" % \
-                        (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), config.MAX_QUEUED_JOBS))
-            yield from asyncio.sleep(sleep_time)
-            pendings = len(self.process_queue._pending_work_items.keys()) - config.HUB_MAX_WORKERS
-            waited = True
+        if pendings >= config.MAX_QUEUED_JOBS:
+            return "too much pending jobs in the queue (max: %s)" % config.MAX_QUEUED_JOBS
         # finally check custom predicates
-        predicates =  pinfo and pinfo.get("__predicates__",[])
-        failed_predicate = None
-        while True:
-            for predicate in predicates:
-                if not predicate(self):
-                    failed_predicate = predicate
-                    break # for loop (most inner one)
-                else:
-                    # reset flag
-                    failed_predicate = None
-            if failed_predicate:
-                logger.info("Can't run job {cat:%s,source:%s,step:%s} right now, predicate %s failed, will retry until possible" % \
-                        (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"),failed_predicate))
-                yield from asyncio.sleep(sleep_time)
+        for predicate in pinfo and pinfo.get("__predicates__",[]) or []:
+            if not predicate(self):
+                return "predicate %s failed" % predicate
+        return None
+
+    def wake_up(self):
+        """Wake up jobs waiting to be launched, so they check their constraints again"""
+        @asyncio.coroutine
+        def notify():
+            with (yield from self.admission):
+                self.admission.notify_all()
+        if self.num_waiting:
+            asyncio.ensure_future(notify(),loop=self.loop)
+
+    @asyncio.coroutine
+    def watch_memory(self):
+        last_mem = self.hub_memory
+        last_check = time.time()
+        while self.num_waiting:
+            yield from asyncio.sleep(MEMORY_WATCH_DELAY,loop=self.loop)
+            hub_mem = self.hub_memory
+            if hub_mem < last_mem or time.time() - last_check >= ADMISSION_RECHECK_DELAY:
+                self.wake_up()
+                last_check = time.time()
+            last_mem = hub_mem
+        self.memory_watcher = None
+
+    def job_done(self,job_id):
+        self.jobs.pop(job_id,None)
+        self.reserved_memory.pop(job_id,None)
+        self.wake_up()
+
+    @asyncio.coroutine
+    def check_constraints(self,pinfo=None,job_id=None):
+        """
+        Wait until job described in pinfo can be launched. Constraints are checked
+        again each time a job is done, when hub memory usage decreases, or after
+        ADMISSION_RECHECK_DELAY seconds. Return admission delay, in seconds.
+        """
+        pinfo = pinfo or {}
+        mem_req = pinfo.get("__reqs__",{}).get("mem") or 0
+        t0 = time.time()
+        waited = False
+        if mem_req:
+            logger.info("Job {cat:%s,source:%s,step:%s} requires %s memory, checking if available" % \
+                    (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), sizeof_fmt(mem_req)))
+        with (yield from self.admission):
+            while True:
+                reason = self.admission_blocker(pinfo,self.hub_memory)
+                if not reason:
+                    break
+                if not waited:
+                    logger.info("Can't run job {cat:%s,source:%s,step:%s} right now, %s, will retry until possible" % \
+                            (pinfo.get("category"), pinfo.get("source"), pinfo.get("step"), reason))
                 waited = True
-            else:
-                break # while loop
+                self.num_waiting += 1
+                if not self.memory_watcher:
+                    self.memory_watcher = asyncio.ensure_future(self.watch_memory(),loop=self.loop)
+                try:
+                    yield from self.admission.wait()
+                finally:
+                    self.num_waiting -= 1
+            if mem_req and job_id:
+                self.reserved_memory[job_id] = mem_req
+        delay = time.time() - t0
         if waited:
             logger.info("Job {cat:%s,source:%s,step:%s} now can be launched (total waiting time: %s)" % (pinfo.get("category"),
                 pinfo.get("source"), pinfo.get("step"), timesofar(t0)))
@@ -532,6 +673,7 @@ class JobManager(object):
             # recycling setting (if auto_recycle was False, it's ignored
             if self.auto_recycle_setting:
                 self.auto_recycle = self.auto_recycle_setting
+        return delay
 
     @asyncio.coroutine
     def defer_to_process(self, pinfo=None, func=None, *args):
@@ -539,12 +681,15 @@ class JobManager(object):
         @asyncio.coroutine
         def run(future, job_id):
             nonlocal pinfo
-            yield from self.check_constraints(pinfo)
-            self.ok_to_run.release()
+            try:
+                delay = yield from self.check_constraints(pinfo,job_id)
+            finally:
+                self.ok_to_run.release()
             # pinfo can contain predicates hardly pickleable during run_in_executor
             # but we also need not to touch the original one
             copy_pinfo = copy.deepcopy(pinfo)
             copy_pinfo.pop("__predicates__",None)
+            copy_pinfo["admission_delay"] = delay
             self.jobs[job_id] = copy_pinfo
             res = self.loop.run_in_executor(self.process_queue,
                     partial(do_work,job_id,"process",copy_pinfo,func,*args))
@@ -555,7 +700,7 @@ class JobManager(object):
                 finally:
                     # whatever the result we want to make sure to clean the job registry
                     # to keep it sync with actual running jobs
-                    self.jobs.pop(job_id)
+                    self.job_done(job_id)
             res.add_done_callback(ran)
             res = yield from res
             # process could generate other parallelized jobs and return a Future/Task
@@ -580,9 +725,13 @@ class JobManager(object):
 
         @asyncio.coroutine
         def run(future, job_id):
+            nonlocal pinfo
             if not skip_check:
-                yield from self.check_constraints(pinfo)
-                self.ok_to_run.release()
+                try:
+                    delay = yield from self.check_constraints(pinfo,job_id)
+                finally:
+                    self.ok_to_run.release()
+                pinfo = dict(pinfo,admission_delay=delay)
             self.jobs[job_id] = pinfo
             res = self.loop.run_in_executor(self.thread_queue,
                     partial(do_work,job_id,"thread",pinfo,func,*args))
@@ -592,7 +741,7 @@ class JobManager(object):
                 finally:
                     # whatever the result we want to make sure to clean the job registry
                     # to keep it sync with actual running jobs
-                    self.jobs.pop(job_id)
+                    self.job_done(job_id)
             res.add_done_callback(ran)
             res = yield from res
             # thread could generate other parallelized jobs and return a Future/Task
@@ -642,48 +791,32 @@ class JobManager(object):
         return total_mem
 
     def get_pid_files(self, child=None):
-        pat = re.compile(".*/(\d+)_.*\.pickle") # see track() for filename format
         pchildren = self.hub_process.children()
         children_pids = [p.pid for p in pchildren]
         pids = {}
-        for fn in glob.glob(os.path.join(config.RUN_DIR,"*.pickle")):
+        for worker in self.tracker.get_running("process"):
+            pid = worker["job"]["id"]
+            if child and child.pid != pid:
+                continue
             try:
-                pid = int(pat.findall(fn)[0].split("_")[0])
-                if not child or child.pid == pid:
-                    try:
-                        worker = pickle.load(open(fn,"rb"))
-                    except FileNotFoundError:
-                        # it's possible that, as this point, the pickle file
-                        # doesn't exist anymore (process is done and file was unlinked)
-                        # just ignore go to next one
-                        continue
-                    proc = pchildren[children_pids.index(pid)]
-
-                    worker["process"] = {
-                            "mem" : proc.memory_info().rss,
-                            "cpu" : proc.cpu_percent(CPU_PERCENT_WAIT_DELAY)
-                            }
-                    pids[pid] = worker
-            except IndexError:
-                # weird though... should have only pid files there...
-                pass
+                proc = pchildren[children_pids.index(pid)]
+            except ValueError:
+                # process is gone, job is done or about to be reported as such
+                continue
+            worker = dict(worker)
+            worker["process"] = {
+                    "mem" : proc.memory_info().rss,
+                    "cpu" : proc.cpu_percent(CPU_PERCENT_WAIT_DELAY)
+                    }
+            pids[pid] = worker
         return pids
 
     def get_thread_files(self):
-        # see track() for filename format
-        pat = re.compile(".*/(Thread\w*-\d+)_.*\.pickle")
-        threads = self.thread_queue._threads
-        active_tids = [t.getName() for t in threads]
         tids = {}
-        for fn in glob.glob(os.path.join(config.RUN_DIR,"*.pickle")):
-            try:
-                tid = pat.findall(fn)[0].split("_")[0]
-                worker = pickle.load(open(fn,"rb"))
-                worker["process"] = self.hub_process # misleading... it's the hub process
-                tids[tid] = worker
-            except IndexError:
-                # weird though... should have only pid files there...
-                pass
+        for worker in self.tracker.get_running("thread"):
+            worker = dict(worker)
+            worker["process"] = self.hub_process # misleading... it's the hub process
+            tids[worker["job"]["id"]] = worker
         return tids
 
     def extract_pending_info(self, pending):
@@ -886,14 +1019,17 @@ class JobManager(object):
 
 
     def get_dones(self, jobs=None, purge=True):
+        """
+        jobs is a list of (key,worker) as returned by JobTracker.get_done()
+        (default to all finished jobs)
+        """
         if jobs is None:
-            jobs = glob.glob(os.path.join(config.RUN_DIR,"done","*.pickle"))
+            jobs = self.tracker.get_done()
         if jobs:
-            jfiles_workers = [(jfile,pickle.load(open(jfile,"rb"))) for jfile in jobs]
             # sort by start time
-            jfiles_workers = sorted(jfiles_workers,key=lambda e: e[1]["job"]["started_at"])
+            jobs = sorted(jobs,key=lambda e: e[1]["job"]["started_at"])
             out = []
-            for jfile,worker in jfiles_workers:
+            for key,worker in jobs:
                 info = self.extract_worker_info(worker)
                 # format start time
                 tt = datetime.datetime.fromtimestamp(info["started_at"]).timetuple()
@@ -906,8 +1042,8 @@ class JobManager(object):
                 except (TypeError, KeyError) as e:
                     out.append(e)
                     out.append(pformat(info))
-                if purge:
-                    os.unlink(jfile)
+            if purge:
+                self.tracker.purge([key for key,_ in jobs])
 
             return "\n".join(out)
 
@@ -926,7 +1062,7 @@ class JobManager(object):
         #        pass
         pworkers = self.get_pid_files(child)
         tworkers = self.get_thread_files()
-        done_jobs = glob.glob(os.path.join(config.RUN_DIR,"done","*.pickle"))
+        done_jobs = self.tracker.get_done()
         out = []
         if child:
             return pworkers[child.pid]
@@ -963,6 +1099,8 @@ class JobManager(object):
                 "memory" : summary["memory"],
                 "available_system_memory" : summary["available_system_memory"],
                 "max_memory_usage" : summary["max_memory_usage"],
+                "reserved_memory" : sum(self.reserved_memory.values()),
+                "waiting_jobs" : self.num_waiting,
                 "hub_pid" : summary["hub_pid"],
                 }
 
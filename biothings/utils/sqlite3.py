@@ -4,7 +4,7 @@ import json
 
 from biothings import config
 from biothings.utils.hub_db import IDatabase
-from biothings.utils.dotfield import parse_dot_fields
+from biothings.utils.dotfield import parse_dot_fields, project_doc
 from biothings.utils.dataload import update_dict_recur
 from biothings.utils.common import json_serial
 
@@ -121,11 +121,11 @@ class Collection(object):
         return self.db
 
     def find_one(self,*args,**kwargs):
-        if args and len(args) == 1 and type(args[0]) == dict:
-            if len(args[0]) == 1 and "_id" in args[0]:
+        if args and len(args) <= 2 and type(args[0]) == dict:
+            if len(args[0]) == 1 and "_id" in args[0] and type(args[0]["_id"]) != dict:
                 strdoc = self.get_conn().execute("SELECT document FROM %s WHERE _id = ?" % self.colname,(args[0]["_id"],)).fetchone()
                 if strdoc:
-                    return json.loads(strdoc[0])
+                    return project_doc(json.loads(strdoc[0]),args[1:] and args[1])
                 else:
                     return None
             else:
@@ -136,32 +136,63 @@ class Collection(object):
             return self.find(find_one=True)
 
     def find(self,*args,**kwargs):
+        # pymongo-like paging, applied on matching documents
+        sort = kwargs.pop("sort",None)
+        skip = kwargs.pop("skip",0)
+        limit = kwargs.pop("limit",0)
+        results = self._find(*args,**kwargs)
+        if "find_one" in kwargs:
+            return results
+        # stable sorts, least significant key first
+        for key,direction in reversed(sort or []):
+            results.sort(key=lambda doc: doc.get(key),reverse=direction < 0)
+        results = results[skip:]
+        if limit:
+            results = results[:limit]
+        return results
+
+    def _find(self,*args,**kwargs):
         results = []
-        if args and len(args) == 1 and type(args[0]) == dict and len(args[0]) > 0:
+        # optional projection, as 2nd param (see project_doc())
+        projection = args[1:] and args[1]
+        if args and len(args) <= 2 and type(args[0]) == dict and len(args[0]) > 0:
+            if len(args[0]) == 1 and type(args[0].get("_id")) == dict and \
+                    list(args[0]["_id"].keys()) == ["$in"]:
+                # selection by _ids, let sqlite do it
+                ids = list(args[0]["_id"]["$in"])
+                docs = self.get_conn().execute("SELECT document FROM %s WHERE _id IN (%s)" % \
+                        (self.colname,",".join(["?"] * len(ids))),ids).fetchall()
+                results = [project_doc(json.loads(doc[0]),projection) for doc in docs]
+                if "find_one" in kwargs:
+                    return results and results[0] or None
+                return results
             # it's key/value search, let's iterate
             for doc in self.get_conn().execute("SELECT document FROM %s" % self.colname).fetchall():
                 found = False
                 doc = json.loads(doc[0])
                 for k,v in args[0].items():
-                    if k in doc:
-                        if doc[k] == v:
-                            found = True
+                    if k in doc and doc[k] == v:
+                        found = True
                     else:
                         found = False
                         break
                 if found:
                     if "find_one" in kwargs:
-                        return doc
+                        return project_doc(doc,projection)
                     else:
-                        results.append(doc)
+                        results.append(project_doc(doc,projection))
             return results
-        elif not args or len(args) == 1 and len(args[0]) == 0:
+        elif not args or len(args) <= 2 and len(args[0]) == 0:
             # nothing or empty dict
-            return [json.loads(doc[0]) for doc in \
+            return [project_doc(json.loads(doc[0]),projection) for doc in \
                     self.get_conn().execute("SELECT document FROM %s" % self.colname).fetchall()]
         else:
             raise NotImplementedError("find: args=%s kwargs=%s" % (repr(args),repr(kwargs)))
 
+    def create_index(self,keys):
+        # documents are stored as JSON and scanned, nothing to index
+        pass
+
     def insert_one(self,doc):
         assert "_id" in doc
         with self.get_conn() as conn:
@@ -204,13 +235,19 @@ class Collection(object):
         else:
             self.insert_one(doc)
 
-    def replace_one(self,query,doc):
+    def replace_one(self,query,doc,upsert=False):
         orig = self.find_one(query)
         if orig:
+            # like MongoDB, replacement keeps original _id
+            doc = dict(doc,_id=orig["_id"])
             with self.get_conn() as conn:
                 conn.execute("UPDATE %s SET document = ? WHERE _id = ?" % self.colname,
                         (json.dumps(doc,default=json_serial),orig["_id"]))
                 conn.commit()
+        elif upsert:
+            doc = dict(doc)
+            doc.setdefault("_id",query.get("_id"))
+            self.insert_one(doc)
 
     def remove(self,query):
         docs = self.find(query)
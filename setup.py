@@ -92,6 +92,6 @@ setup(
     install_requires=install_requires,
     extras_require={
         'hub': hub_requires,
-        'dev':  hub_requires + ['sphinx' + 'sphinx_rtd_theme']
+        'dev':  hub_requires + ['sphinx' + 'sphinx_rtd_theme', 'pyftpdlib']
     },
 )